@@ -4,9 +4,32 @@
 import streamlit as st
 from authentication import save_user_credentials, load_user_credentials, verify_password
 from model_manager import ModelManager
-from evaluator import Evaluator
-from trial_manager import TrialManager
+from evaluator import DEFAULT_THRESHOLDS, DEFAULT_TOLERANCE, Evaluator
+from metrics_logger import MetricsLogger
+from response_cache import get_response_cache
+from reevaluate import reevaluate
+from job_queue import FINAL_STATES, ensure_workers, get_job_queue, job_run_id
+from results_store import ResultsStore
+from planner import compare_to_plan, plan_run, usage_from_trials
+from itertools import islice
+import os
 import json
+import time
+
+# Trial runs are executed by worker processes fed from a SQLite job queue
+JOB_QUEUE_PATH = 'jobs.sqlite'
+JOB_WORKERS = 4  # Runs executing at once, across all users
+CONCURRENCY_BUDGET = 200  # Requests in flight, across all running jobs
+JOB_POLL_INTERVAL = 2.0  # Seconds between refreshes of a run in progress
+# Trials of every finished run, queried by the History page
+RESULTS_STORE_PATH = 'results_store'
+HISTORY_GROUPS = {
+    "Model": ['model'],
+    "Day and Model": ['date', 'model'],
+    "Prompt and Model": ['prompt_hash', 'model'],
+    "Temperature and Model": ['temperature', 'model'],
+    "Run": ['run_id', 'model'],
+}
 
 def main():
     st.title("LLM Profile Analysis & Benchmarking")
@@ -56,6 +79,12 @@ def main():
                     st.warning("Incorrect Username/Password")
 
 def app_body():
+    page = st.sidebar.radio("Page", ["Run Trials", "History"])
+    if page == "History":
+        show_history()
+        return
+    job_queue = get_job_queue(JOB_QUEUE_PATH, concurrency_budget=CONCURRENCY_BUDGET)
+
     # Model Settings
     st.sidebar.subheader("Model Settings")
     provider = st.sidebar.selectbox("Provider", ["OpenAI", "Anthropic"])
@@ -85,20 +114,32 @@ def app_body():
 
     temperature = st.sidebar.slider("Temperature", 0.0, 1.0, 1.0)  # Default set to 1.0
     max_tokens = st.sidebar.number_input("Max Tokens", min_value=1, max_value=2048, value=150)
+    # Provider limits for this model; 0 leaves pacing to the adaptive concurrency limit
+    rpm_limit = st.sidebar.number_input("Requests/min Limit (0 = none)", min_value=0, value=0)
+    tpm_limit = st.sidebar.number_input("Tokens/min Limit (0 = none)", min_value=0, value=0)
 
     # Prompt and Task Settings
     st.subheader("Prompt Settings")
     prompt = st.text_area("Enter your prompt here")
-    task_type = st.selectbox("Task Type", ["string_match", "entity_recognition"])
+    task_type = st.selectbox("Task Type", ["string_match", "entity_recognition", "edit_distance", "token_jaccard",
+                                           "numeric"])
     expected_output = st.text_area("Expected Output for Evaluation")
+    threshold = None
+    tolerance = DEFAULT_TOLERANCE
+    if task_type in DEFAULT_THRESHOLDS:
+        threshold = st.slider("Similarity Threshold", 0.0, 1.0, DEFAULT_THRESHOLDS[task_type],
+                              help="Minimum similarity for a response to count as correct (algorithmic evaluation)")
+    elif task_type == "numeric":
+        tolerance = st.number_input("Numeric Tolerance", min_value=0.0, value=DEFAULT_TOLERANCE, format="%g",
+                                    help="Largest relative or absolute difference from the expected number")
 
     # Evaluation Settings
     st.subheader("Evaluation Settings")
     evaluation_method = st.selectbox("Evaluation Method", ["Algorithmic", "LLM"])
 
-    evaluator_model_manager = None  # Initialize to None
     evaluator_api_key = ''
     evaluator_prompt = ''  # Initialize evaluator prompt
+    judge_batch_size = 1
 
     if evaluation_method == "LLM":
         evaluator_provider = st.selectbox("Evaluator LLM Provider", ["OpenAI", "Anthropic"])
@@ -150,15 +191,79 @@ def app_body():
 
             Based on the expected output and the actual response, does the response meet the expectations? Ignore capitalization or ordering errors, unless specifically asked to do so (e.g., alphabetical order, sort in ascending/descending order). Reply with 'Yes' if it meets the expectations, or 'No' if it does not, followed by a brief explanation.
             """)
+        # Several distinct responses per judge call, answered as a JSON array of verdicts
+        judge_batch_size = st.number_input("Responses per Judge Call", min_value=1, max_value=50, value=1)
 
 
 
     # Trial Settings
-    num_trials = st.number_input("Number of Trials", min_value=1, max_value=1000, value=50)
-    max_workers = st.number_input("Number of Threads", min_value=1, max_value=100, value=5)
+    execution_mode = st.selectbox("Execution Mode", ["Threaded", "Async", "Batch API"])
+    if execution_mode == "Batch API":
+        # Batch jobs are processed by the provider within 24h, outside interactive rate limits
+        num_trials = st.number_input("Number of Trials", min_value=1, max_value=100000, value=1000)
+        max_workers = 1
+    else:
+        num_trials = st.number_input("Number of Trials", min_value=1, max_value=1000, value=50)
+    if execution_mode == "Async":
+        # A single event loop keeps many requests in flight without one thread each
+        max_workers = st.number_input("Max Concurrent Requests", min_value=1, max_value=5000, value=50)
+    elif execution_mode == "Threaded":
+        max_workers = st.number_input("Number of Threads", min_value=1, max_value=100, value=5)
+    streaming = False
+    if execution_mode != "Batch API":
+        # Records time to first token; algorithmic evaluation can cancel a response once it is decided
+        streaming = st.checkbox("Stream responses", value=False)
+    samples_per_request = 1
+    if execution_mode != "Batch API" and not streaming:
+        # OpenAI chat models can return several samples per call; other models fall back to one
+        samples_per_request = st.number_input("Samples per Request", min_value=1, max_value=128, value=1)
+    evaluation_workers = 0
+    if evaluation_method == "Algorithmic" and execution_mode != "Batch API":
+        # 0 scores responses on the request threads; more runs scoring on separate processes
+        evaluation_workers = st.number_input("Evaluation Processes", min_value=0, max_value=os.cpu_count() or 1, value=0)
+
+    stop_ci_width = None
+    if execution_mode != "Batch API" and st.checkbox("Stop early once the success rate is pinned down", value=False):
+        # Trials stop once the 95% Wilson interval on the success rate is narrower than this
+        stop_ci_width = st.slider("Target Confidence Interval Width", 0.02, 0.5, 0.1)
+
+    use_cache = st.checkbox("Reuse cached responses from previous identical runs", value=False)
+    # Per-phase spans in OTLP/JSON, readable by the OpenTelemetry Collector
+    export_traces = st.checkbox("Export trace spans", value=False)
+
+    # Pre-flight estimate of tokens, cost and the concurrency the rate limits allow
+    judged = evaluation_method == "LLM"
+    plan = plan_run(
+        provider, model_name, prompt, int(num_trials), int(max_tokens),
+        samples_per_request=int(samples_per_request),
+        evaluator=Evaluator(task_type, expected_output, evaluation_method=evaluation_method.lower(),
+                            evaluator_prompt=evaluator_prompt, judge_batch_size=int(judge_batch_size)),
+        judge_provider=evaluator_provider if judged else None,
+        judge_model_name=evaluator_model_name if judged else None,
+        rpm=int(rpm_limit) or None,
+        tpm=int(tpm_limit) or None,
+        max_concurrency=5000 if execution_mode == "Async" else 100,
+        batch=execution_mode == "Batch API"
+    )
+    show_plan(plan)
+    rpm, tpm = int(rpm_limit) or None, int(tpm_limit) or None
+    use_plan = execution_mode != "Batch API" and st.checkbox("Use the planned concurrency and pacing", value=False)
+    if use_plan:
+        max_workers = plan['concurrency']
+        rpm, tpm = plan['rpm'], plan['tpm']
 
-    if st.button("Start Trials"):
-        if not api_key:
+    start_trials = st.button("Start Trials")
+    # Re-score the stored responses of the last run with the evaluation settings above
+    rescore = st.button("Re-evaluate Last Results")
+
+    if start_trials or rescore:
+        # The last run that got to write results
+        results_file = next((job['results_path'] for job in job_queue.jobs(st.session_state['username'])
+                             if job['status'] in FINAL_STATES and os.path.exists(job['results_path'])), None)
+        if rescore and not results_file:
+            st.error("No previous results to re-evaluate.")
+            return
+        if start_trials and not api_key:
             st.error(f"API key for {provider} is missing.")
             return
         if evaluation_method == "LLM":
@@ -187,88 +292,273 @@ def app_body():
                 'max_tokens': int(max_tokens),
             }
 
-        model_manager = ModelManager(
-            model_name=model_name,
-            api_key=api_key,
-            provider=provider
-        )
-
+        judge = None
         if evaluation_method == "LLM":
-            evaluator_model_manager = ModelManager(
-                model_name=evaluator_model_name,
-                api_key=evaluator_api_key,
-                provider=evaluator_provider
+            judge = {'model_name': evaluator_model_name, 'api_key': evaluator_api_key, 'provider': evaluator_provider}
+            if use_plan:
+                judge.update(rpm=plan.get('judge_rpm'), tpm=plan.get('judge_tpm'))
+        evaluator_spec = {
+            'task_type': task_type,
+            'expected_output': expected_output,
+            'evaluation_method': evaluation_method.lower(),
+            'evaluator_prompt': evaluator_prompt,  # Pass the custom evaluator prompt
+            'judge_batch_size': int(judge_batch_size),
+            'threshold': threshold,
+            'tolerance': tolerance,
+        }
+
+        if rescore:
+            evaluator = Evaluator(
+                evaluator_model_manager=ModelManager(
+                    cache=get_response_cache() if use_cache else None,
+                    max_connections=int(max_workers),
+                    **judge
+                ) if judge else None,
+                **evaluator_spec
             )
-        else:
-            evaluator_model_manager = None
-
-        evaluator = Evaluator(
-            task_type,
-            expected_output,
-            evaluation_method=evaluation_method.lower(),
-            evaluator_model_manager=evaluator_model_manager,
-            evaluator_prompt=evaluator_prompt  # Pass the custom evaluator prompt
-        )
-
-        trial_manager = TrialManager(
-            model_manager=model_manager,
-            evaluator=evaluator,
-            num_trials=int(num_trials),
-            max_workers=int(max_workers),
-            prompt=prompt,
-            **kwargs
-        )
-
-        with st.spinner("Running trials..."):
-            trial_manager.run_trials()
-
-        st.success("Trials completed")
-        trial_manager.metrics_logger.export_csv(filename=f'{st.session_state["username"]}_results.csv')
-        st.markdown(get_table_download_link(f'{st.session_state["username"]}_results.csv'), unsafe_allow_html=True)
-
-        # Display the CSV data preview
-        import pandas as pd
-        df = pd.read_csv(f'{st.session_state["username"]}_results.csv')
-        # Calculate metrics
-        correct_count = df['correct'].sum() if 'correct' in df.columns else 0
-        total_count = len(df)
-        correct_percentage = (correct_count / total_count * 100) if total_count > 0 else 0
-        
-        # Add metrics to dataframe for CSV export
-        metrics_df = pd.DataFrame({
-            'metric': ['total_trials', 'correct_count', 'correct_percentage'],
-            'value': [total_count, correct_count, f'{correct_percentage:.2f}%']
-        })
-        
-        # Append metrics to existing CSV
-        with open(f'{st.session_state["username"]}_results.csv', 'a') as f:
-            f.write("\n\n# Summary Metrics\n")
-        metrics_df.to_csv(f'{st.session_state["username"]}_results.csv', mode='a', index=False)
-        
-        # Display metrics prominently
-        st.subheader("Results Summary")
-        col1, col2, col3 = st.columns(3)
+            rescored_file = results_file.rsplit('.', 1)[0] + '_rescored.jsonl'
+            with st.spinner("Re-evaluating stored responses..."):
+                rescored_logger = reevaluate(results_file, evaluator, output_path=rescored_file,
+                                             max_workers=int(max_workers) if evaluation_method == "LLM" else None)
+            st.success("Re-evaluation completed")
+            show_results(rescored_logger, evaluator.memo_stats())
+            return
+
+        # The run is executed by a job queue worker, so it survives reruns and
+        # disconnects, and runs of all users share one concurrency budget
+        run_name = f'{st.session_state["username"]}_{time.strftime("%Y%m%d-%H%M%S")}'
+        spec = {
+            'model': {
+                'model_name': model_name,
+                'api_key': api_key,
+                'provider': provider,
+                'rpm': rpm,
+                'tpm': tpm,
+            },
+            'evaluator': {**evaluator_spec, 'model': judge},
+            'trial': {
+                'num_trials': int(num_trials),
+                'max_workers': int(max_workers),
+                'prompt': prompt,
+                'async_mode': (execution_mode == "Async"),
+                'samples_per_request': int(samples_per_request),
+                'evaluation_workers': int(evaluation_workers),
+                'stop_ci_width': stop_ci_width,
+                'streaming': streaming,
+                'kwargs': kwargs,
+            },
+            'execution_mode': 'batch' if execution_mode == "Batch API" else 'online',
+            'results_path': os.path.abspath(f'{run_name}_results.jsonl'),
+            'trace_path': os.path.abspath(f'{run_name}_traces.jsonl') if export_traces else None,
+            'use_cache': use_cache,
+            'results_store': os.path.abspath(RESULTS_STORE_PATH),
+            'plan': plan,
+        }
+        ensure_workers(JOB_WORKERS, JOB_QUEUE_PATH, CONCURRENCY_BUDGET)
+        st.session_state['job_id'] = job_queue.submit(st.session_state['username'], spec)
+
+    show_jobs(job_queue)
+
+
+def show_jobs(job_queue):
+    """
+    List the user's runs and follow the selected one, polling while it is
+    queued or running and showing its partial results as they stream in.
+    """
+    import pandas as pd
+
+    jobs = job_queue.jobs(st.session_state['username'])
+    if not jobs:
+        return
+    st.subheader("Your Runs")
+    st.dataframe(pd.DataFrame([{
+        'job': job['id'],
+        'model': job['spec']['model']['model_name'],
+        'status': job['status'],
+        'progress': f"{job['progress'] * 100:.0f}%",
+        'submitted': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(job['created_at'])),
+    } for job in jobs]), hide_index=True)
+
+    job_ids = [job['id'] for job in jobs]
+    selected = st.session_state.get('job_id')
+    job_id = st.selectbox("Run", job_ids, index=job_ids.index(selected) if selected in job_ids else 0)
+    job = job_queue.get(job_id)
+
+    if job['status'] == 'failed':
+        st.error(f"Run failed: {job['error']}")
+        return
+    if job['status'] not in FINAL_STATES:
+        ensure_workers(JOB_WORKERS, JOB_QUEUE_PATH, CONCURRENCY_BUDGET)  # Replaces workers that died
+        st.progress(job['progress'], text=f"Run {job_id} is {job['status']}")
+        if st.button("Cancel Run"):
+            job_queue.cancel(job_id)
+        if os.path.exists(job['results_path']):
+            # Partial results, read from the results file the worker streams to
+            partial = MetricsLogger.read(job['results_path'], run_id=job_run_id(job))
+            summary = partial.summary()
+            st.caption(f"{summary['correct_count']} of {summary['total_trials']} trials correct so far "
+                       f"({summary['correct_percentage']:.1f}%)")
+            if job['spec'].get('plan'):
+                usage, completed = usage_from_trials(partial.iter_trials())
+                show_plan_comparison(compare_to_plan(job['spec']['plan'], usage, completed,
+                                                     time.time() - (job['started_at'] or job['created_at'])))
+            st.dataframe(pd.DataFrame(list(islice(partial.iter_trials(), 100))))
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+
+    st.success(f"Run {job_id} {job['status']}")
+    if job['summary'] and job['summary'].get('stopped_early'):
+        st.info(f"Stopped early after {job['summary']['total_trials']} of {job['spec']['trial']['num_trials']} "
+                "trials: the success rate confidence interval reached the target width.")
+    if job['summary'] and job['spec'].get('plan'):
+        elapsed = (job['finished_at'] or time.time()) - (job['started_at'] or job['created_at'])
+        show_plan_comparison(compare_to_plan(job['spec']['plan'], job['summary'], job['summary']['total_trials'],
+                                             elapsed))
+    if os.path.exists(job['results_path']):
+        show_results(MetricsLogger.read(job['results_path'], run_id=job_run_id(job)), job['summary'])
+    trace_file = job['spec'].get('trace_path')
+    if trace_file and os.path.exists(trace_file):
+        with open(trace_file, 'rb') as f:
+            st.download_button("Download Trace Spans", data=f, file_name=os.path.basename(trace_file),
+                               mime='application/jsonl')
+
+
+def show_history():
+    """
+    Success rate and latency percentiles of the user's stored runs, grouped
+    and filtered on demand; aggregated by the results store, not in pandas.
+    """
+    store = ResultsStore(RESULTS_STORE_PATH)
+    st.subheader("Run History")
+    group = st.selectbox("Group By", list(HISTORY_GROUPS))
+    models = st.multiselect("Models", store.models())
+    col1, col2 = st.columns(2)
+    with col1:
+        since = st.date_input("From", value=None)
+    with col2:
+        until = st.date_input("To", value=None)
+
+    started = time.time()
+    summary = store.summarize(group_by=HISTORY_GROUPS[group], username=st.session_state['username'],
+                              models=models, since=since, until=until)
+    if summary.empty:
+        st.info("No stored runs match these filters yet.")
+        return
+    st.caption(f"{int(summary['trials'].sum())} trials aggregated in {(time.time() - started) * 1000:.0f} ms")
+    st.dataframe(summary, hide_index=True)
+    if group == "Day and Model":
+        st.line_chart(summary.pivot(index='date', columns='model', values='success_rate'))
+        st.line_chart(summary.pivot(index='date', columns='model', values='p95_response_time'))
+
+
+def show_plan(plan):
+    """
+    The planner's token, cost, concurrency and duration estimates for the settings above.
+    """
+    with st.expander("Run Plan", expanded=True):
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Total Trials", total_count)
+            st.metric("Input Tokens", f"{plan['target_input_tokens'] + plan['judge_input_tokens']:,}")
         with col2:
-            st.metric("Correct Responses", int(correct_count))
+            st.metric("Output Tokens (max)", f"{plan['target_output_tokens'] + plan['judge_output_tokens']:,}")
         with col3:
-            st.metric("Success Rate", f"{correct_percentage:.2f}%")
-            
-        st.subheader("Data Preview")
-        st.dataframe(df.head(100)) # Display first 100 rows as a preview
+            st.metric("Estimated Cost", f"${plan['cost']:.2f}" if plan['cost'] is not None else "unknown")
+        with col4:
+            if plan['concurrency'] is not None:
+                st.metric("Planned Concurrency", plan['concurrency'])
+        if plan['judge_calls']:
+            st.caption(f"Includes {plan['judge_calls']} judge calls to {plan['judge_model_name']}.")
+        if plan['duration_seconds'] is not None:
+            st.caption(f"About {plan['trials_per_second']:.2f} trials/s, {plan['duration_seconds'] / 60:.1f} min, "
+                       f"limited by {plan['bottleneck']} (at {plan['rpm'] or 'no'} requests/min, "
+                       f"{plan['tpm'] or 'no'} tokens/min; {plan['latency']:.1f}s per request).")
+        if plan['tokenizer'] != 'tiktoken':
+            st.caption("Prompt tokens are estimated from its length; install tiktoken for exact counts.")
+
+
+def show_plan_comparison(comparison):
+    """
+    A run's actual token usage and throughput against its plan.
+    """
+    if not comparison['tokens']:
+        return
+    lines = [f"{name.replace('_', ' ')}: {values['projected']:,} projected vs {values['planned']:,} planned"
+             for name, values in comparison['tokens'].items()]
+    if comparison.get('projected_cost') is not None:
+        lines.append(f"projected cost: ${comparison['projected_cost']:.2f}")
+    st.caption("Plan check: " + "; ".join(lines))
+    for note in comparison['notes']:
+        st.info(note)
 
 
-def get_table_download_link(csv_file):
+def show_results(metrics_logger, run_stats=None):
     """
-    Generates a link to download the CSV file.
+    Export a run's streamed results to CSV and display its summary, download button and preview.
+    run_stats adds the evaluation memo and token usage figures of the run.
     """
-    import base64
+    import pandas as pd
+
+    summary = metrics_logger.summary()
+    summary.update(run_stats or {})
+    memo = 'memo_hits' in summary  # Verdicts reused for identical responses
+    prompt_cache = 'target_cache_read_tokens' in summary
+    csv_file = metrics_logger.path.rsplit('.', 1)[0] + '.csv'
+    # Streams from the JSONL results file, so memory stays flat
+    metrics_logger.export_csv(filename=csv_file)
+
+    # Add metrics to dataframe for CSV export
+    metrics_df = pd.DataFrame({
+        'metric': ['total_trials', 'correct_count', 'correct_percentage'],
+        'value': [summary['total_trials'], summary['correct_count'], f"{summary['correct_percentage']:.2f}%"]
+    })
+    if memo:
+        metrics_df = pd.concat([metrics_df, pd.DataFrame({
+            'metric': ['memo_hits', 'memo_misses'],
+            'value': [summary['memo_hits'], summary['memo_misses']]
+        })], ignore_index=True)
+    if prompt_cache:
+        token_metrics = [name for name in summary if name.startswith(('target_', 'judge_')) and name.endswith('_tokens')]
+        metrics_df = pd.concat([metrics_df, pd.DataFrame({
+            'metric': token_metrics,
+            'value': [summary[name] for name in token_metrics]
+        })], ignore_index=True)
+    
+    # Append metrics to existing CSV
+    with open(csv_file, 'a') as f:
+        f.write("\n\n# Summary Metrics\n")
+    metrics_df.to_csv(csv_file, mode='a', index=False)
+
+    # Served from disk rather than embedded in the page as a data URI
     with open(csv_file, 'rb') as f:
-        data = f.read()
-    b64 = base64.b64encode(data).decode()
-    href = f'<a href="data:file/csv;base64,{b64}" download="{csv_file}">Download Results CSV File</a>'
-    return href
+        st.download_button("Download Results CSV File", data=f, file_name=os.path.basename(csv_file), mime='text/csv')
+    with open(metrics_logger.path, 'rb') as f:
+        st.download_button("Download Results JSONL File", data=f, file_name=os.path.basename(metrics_logger.path),
+                           mime='application/jsonl')
+    
+    # Display metrics prominently
+    st.subheader("Results Summary")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Total Trials", summary['total_trials'])
+    with col2:
+        st.metric("Correct Responses", int(summary['correct_count']))
+    with col3:
+        st.metric("Success Rate", f"{summary['correct_percentage']:.2f}%")
+    st.caption(f"95% confidence interval: {summary['success_rate_ci_low'] * 100:.1f}% – "
+               f"{summary['success_rate_ci_high'] * 100:.1f}%")
+    if memo:
+        st.caption(f"Evaluation memo: {summary['memo_hits']} hits, {summary['memo_misses']} misses "
+                   f"({summary['memo_hit_rate'] * 100:.0f}% of responses reused a verdict)")
+    if prompt_cache:
+        for role in ('target', 'judge'):
+            if summary.get(f'{role}_input_tokens'):
+                st.caption(f"{role.capitalize()} prompt cache: {summary[f'{role}_cache_read_tokens']} of "
+                           f"{summary[f'{role}_input_tokens']} input tokens read from the cache, "
+                           f"{summary[f'{role}_cache_write_tokens']} written")
+        
+    st.subheader("Data Preview")
+    # Display first 100 rows as a preview
+    st.dataframe(pd.DataFrame(list(islice(metrics_logger.iter_trials(), 100))))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,350 @@
+# benchmarks/mock_server.py
+# Local stand-in for the OpenAI and Anthropic HTTP APIs, used to measure the
+# harness's own overhead. Run standalone with:
+#   python -m benchmarks.mock_server --port 8099 --latency 0.2 --failure-rate 0.05
+
+import argparse
+import email
+import email.policy
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """
+    Answers chat completions, completions and messages requests after a
+    configurable latency, failing a configurable fraction with 429s.
+    Streaming requests get server-sent events, one ~4 character token every
+    token_interval seconds.
+
+    Also serves the OpenAI files and batches APIs and the Anthropic message
+    batches API. A batch finishes batch_duration seconds after it is created
+    with batch_status: 'completed' (each request failing at failure_rate),
+    or 'failed' or 'expired' with no results.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # Headers and body are written separately
+    latency = 0.1
+    jitter = 0.0
+    failure_rate = 0.0
+    response_size = 64
+    token_interval = 0.0
+    batch_duration = 0.0
+    batch_status = 'completed'
+    # Uploaded files and batches, shared by the handlers of one server
+    files = {}
+    batches = {}
+    state_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_events(self, events):
+        """
+        Write (event name or None, payload) pairs as a chunked SSE response.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for index, (name, payload) in enumerate(events):
+                if index and self.token_interval:
+                    time.sleep(self.token_interval)
+                data = payload if isinstance(payload, str) else json.dumps(payload)
+                event = (f'event: {name}\n' if name else '') + f'data: {data}\n\n'
+                body = event.encode('utf-8')
+                self.wfile.write(f'{len(body):x}\r\n'.encode() + body + b'\r\n')
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client cancelled the stream
+
+    def _stream_response(self, model, text):
+        tokens = [text[i:i + 4] for i in range(0, len(text), 4)]
+        usage = {'prompt_tokens': 10, 'completion_tokens': len(tokens), 'total_tokens': 10 + len(tokens)}
+        if self.path.endswith('/messages'):
+            events = [('message_start', {'type': 'message_start', 'message': {
+                'id': 'msg-mock', 'type': 'message', 'role': 'assistant', 'model': model, 'content': [],
+                'stop_reason': None, 'stop_sequence': None, 'usage': {'input_tokens': 10, 'output_tokens': 1}}}),
+                ('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                         'content_block': {'type': 'text', 'text': ''}})]
+            events += [('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                                'delta': {'type': 'text_delta', 'text': token}}) for token in tokens]
+            events += [('content_block_stop', {'type': 'content_block_stop', 'index': 0}),
+                       ('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                          'usage': {'output_tokens': len(tokens)}}),
+                       ('message_stop', {'type': 'message_stop'})]
+        elif self.path.endswith('/chat/completions'):
+            chunk = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model}
+            events = [(None, {**chunk, 'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]})
+                      for token in tokens]
+            events += [(None, {**chunk, 'choices': [], 'usage': usage}), (None, '[DONE]')]
+        else:
+            chunk = {'id': 'cmpl-mock', 'object': 'text_completion', 'created': int(time.time()), 'model': model}
+            events = [(None, {**chunk, 'choices': [{'index': 0, 'text': token, 'finish_reason': None, 'logprobs': None}]})
+                      for token in tokens]
+            events += [(None, {**chunk, 'choices': [], 'usage': usage}), (None, '[DONE]')]
+        self._send_events(events)
+
+    def _response_text(self):
+        return ('lorem ipsum ' * (self.response_size // 12 + 1))[:self.response_size]
+
+    def _response_payload(self, path, request):
+        text = self._response_text()
+        model = request.get('model', 'mock')
+        if path.endswith('/chat/completions'):
+            return {
+                'id': 'chatcmpl-mock', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [
+                    {'index': i, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': text}}
+                    for i in range(request.get('n', 1))
+                ],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': len(text) // 4, 'total_tokens': 10 + len(text) // 4},
+            }
+        if path.endswith('/completions'):
+            return {
+                'id': 'cmpl-mock', 'object': 'text_completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'text': text, 'logprobs': None}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': len(text) // 4, 'total_tokens': 10 + len(text) // 4},
+            }
+        if path.endswith('/messages'):
+            return {
+                'id': 'msg-mock', 'type': 'message', 'role': 'assistant', 'model': model,
+                'content': [{'type': 'text', 'text': text}],
+                'stop_reason': 'end_turn', 'stop_sequence': None,
+                'usage': {'input_tokens': 10, 'output_tokens': len(text) // 4},
+            }
+        return None
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        path = self.path.split('?', 1)[0]
+        if path == '/v1/files':
+            self._upload_file(body)
+            return
+        if path.endswith('/batches') or path.endswith('/cancel'):
+            self._batch_request(path, json.loads(body or b'{}'))
+            return
+
+        request = json.loads(body or b'{}')
+        time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+        if random.random() < self.failure_rate:
+            self._send_json(429, {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'Rate limited'}},
+                            headers={'retry-after': '0.05'})
+            return
+
+        if request.get('stream'):
+            self._stream_response(request.get('model', 'mock'), self._response_text())
+            return
+        payload = self._response_payload(path, request)
+        if payload is None:
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+        else:
+            self._send_json(200, payload)
+
+    def do_GET(self):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        with self.state_lock:
+            if parts[:2] == ['v1', 'files'] and len(parts) == 4 and parts[3] == 'content' and parts[2] in self.files:
+                body = self.files[parts[2]]['content']
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            batch = self.batches.get(parts[-2] if parts[-1] == 'results' else parts[-1])
+            if batch is None:
+                self._send_json(404, {'error': {'type': 'not_found_error', 'message': f'Unknown path {self.path}'}})
+            elif parts[-1] == 'results':
+                body = '\n'.join(json.dumps(line) for line in self._batch_results(batch)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/binary')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send_json(200, self._batch_object(batch))
+
+    def _upload_file(self, body):
+        # Multipart form with the file and its purpose
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body, policy=email.policy.HTTP)
+        fields = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+        file_id = f'file-{uuid.uuid4().hex}'
+        content = fields['file'].get_payload(decode=True)
+        record = {'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+                  'filename': fields['file'].get_filename(), 'purpose': fields['purpose'].get_content(),
+                  'status': 'processed'}
+        with self.state_lock:
+            self.files[file_id] = {**record, 'content': content}
+        self._send_json(200, record)
+
+    def _batch_request(self, path, request):
+        with self.state_lock:
+            if path.endswith('/cancel'):
+                batch = self.batches.get(path.split('/')[-2])
+                if batch is None:
+                    self._send_json(404, {'error': {'type': 'not_found_error', 'message': f'Unknown path {path}'}})
+                    return
+                if not self._batch_ended(batch):
+                    batch['cancelled'] = True
+                self._send_json(200, self._batch_object(batch))
+                return
+            if path == '/v1/messages/batches':
+                batch = {'id': f'msgbatch_{uuid.uuid4().hex}', 'provider': 'anthropic', 'endpoint': '/v1/messages',
+                         'requests': [(item['custom_id'], item['params']) for item in request['requests']]}
+            else:
+                input_file = self.files.get(request.get('input_file_id'))
+                if input_file is None:
+                    self._send_json(400, {'error': {'message': f"No such file: {request.get('input_file_id')}"}})
+                    return
+                lines = [json.loads(line) for line in input_file['content'].decode('utf-8').splitlines() if line.strip()]
+                batch = {'id': f'batch_{uuid.uuid4().hex}', 'provider': 'openai', 'endpoint': request['endpoint'],
+                         'input_file_id': input_file['id'], 'requests': [(line['custom_id'], line['body']) for line in lines]}
+            batch.update(created_at=time.time(), cancelled=False, results=None)
+            self.batches[batch['id']] = batch
+            self._send_json(200, self._batch_object(batch))
+
+    def _batch_ended(self, batch):
+        return batch['cancelled'] or time.time() - batch['created_at'] >= self.batch_duration
+
+    def _batch_outcomes(self, batch):
+        """
+        (custom_id, payload or None) per request of an ended batch, drawn once.
+        """
+        if batch['results'] is None:
+            batch['results'] = [
+                (custom_id, None if batch['cancelled'] or self.batch_status != 'completed'
+                 or random.random() < self.failure_rate else self._response_payload(batch['endpoint'], params))
+                for custom_id, params in batch['requests']
+            ]
+        return batch['results']
+
+    def _batch_results(self, batch):
+        # Anthropic results lines
+        if not self._batch_ended(batch):
+            return []
+        failure = 'canceled' if batch['cancelled'] else {'completed': 'errored', 'failed': 'errored'}.get(
+            self.batch_status, self.batch_status)
+        lines = []
+        for custom_id, payload in self._batch_outcomes(batch):
+            if payload is not None:
+                result = {'type': 'succeeded', 'message': payload}
+            elif failure == 'errored':
+                result = {'type': 'errored', 'error': {'type': 'error', 'error': {'type': 'api_error',
+                                                                                    'message': 'Mock failure'}}}
+            else:
+                result = {'type': failure}
+            lines.append({'custom_id': custom_id, 'result': result})
+        return lines
+
+    def _batch_object(self, batch):
+        total = len(batch['requests'])
+        ended = self._batch_ended(batch)
+        elapsed = time.time() - batch['created_at']
+        processed = total if ended else int(total * elapsed / self.batch_duration)
+        outcomes = self._batch_outcomes(batch) if ended else []
+        succeeded = sum(payload is not None for _, payload in outcomes)
+        if batch['provider'] == 'anthropic':
+            def timestamp(seconds):
+                return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace('+00:00', 'Z')
+            failures = dict.fromkeys(('errored', 'canceled', 'expired'), 0)
+            for line in self._batch_results(batch):
+                if line['result']['type'] in failures:
+                    failures[line['result']['type']] += 1
+            return {
+                'id': batch['id'], 'type': 'message_batch', 'processing_status': 'ended' if ended else 'in_progress',
+                'request_counts': {'processing': total - processed if not ended else 0, 'succeeded': succeeded,
+                                   **failures},
+                'created_at': timestamp(batch['created_at']), 'expires_at': timestamp(batch['created_at'] + 86400),
+                'ended_at': timestamp(time.time()) if ended else None, 'archived_at': None,
+                'cancel_initiated_at': timestamp(time.time()) if batch['cancelled'] else None,
+                'results_url': f"http://{self.headers['Host']}/v1/messages/batches/{batch['id']}/results" if ended else None,
+            }
+
+        status = 'in_progress'
+        output_file_id = error_file_id = None
+        errors = None
+        if batch['cancelled']:
+            status = 'cancelled'
+        elif ended:
+            status = self.batch_status
+        if status == 'failed':
+            errors = {'object': 'list', 'data': [{'code': 'mock_failure', 'message': 'Mock batch failure',
+                                                  'param': None, 'line': None}]}
+        elif ended and status != 'expired':
+            output = [{'id': f'batch_req_{index}', 'custom_id': custom_id, 'error': None,
+                       'response': {'status_code': 200, 'request_id': f'req_{index}', 'body': payload}}
+                      for index, (custom_id, payload) in enumerate(outcomes) if payload is not None]
+            failed = [{'id': f'batch_req_{index}', 'custom_id': custom_id, 'error': None,
+                       'response': {'status_code': 500, 'request_id': f'req_{index}',
+                                    'body': {'error': {'message': 'Mock failure', 'type': 'server_error'}}}}
+                      for index, (custom_id, payload) in enumerate(outcomes) if payload is None]
+            for lines, key in ((output, 'output_file_id'), (failed, 'error_file_id')):
+                if lines:
+                    file_id = batch.setdefault(key, f'file-{uuid.uuid4().hex}')
+                    content = '\n'.join(json.dumps(line) for line in lines).encode('utf-8') + b'\n'
+                    self.files[file_id] = {'id': file_id, 'content': content}
+            output_file_id, error_file_id = batch.get('output_file_id'), batch.get('error_file_id')
+        return {
+            'id': batch['id'], 'object': 'batch', 'endpoint': batch['endpoint'], 'errors': errors,
+            'input_file_id': batch['input_file_id'], 'completion_window': '24h', 'status': status,
+            'output_file_id': output_file_id, 'error_file_id': error_file_id, 'created_at': int(batch['created_at']),
+            'request_counts': {'total': total, 'completed': succeeded,
+                               'failed': processed - succeeded if ended else 0},
+        }
+
+
+def start_mock_server(port=0, latency=0.1, jitter=0.0, failure_rate=0.0, response_size=64, token_interval=0.0,
+                      batch_duration=0.0, batch_status='completed'):
+    """
+    Start the mock server on a background thread. Returns (server, base_url).
+    """
+    handler = type('ConfiguredMockLLMHandler', (MockLLMHandler,), {
+        'latency': latency, 'jitter': jitter, 'failure_rate': failure_rate, 'response_size': response_size,
+        'token_interval': token_interval, 'batch_duration': batch_duration, 'batch_status': batch_status,
+        'files': {}, 'batches': {}, 'state_lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic-compatible server")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.1, help="Mean response latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Standard deviation of the latency")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--response-size', type=int, default=64, help="Response length in characters")
+    parser.add_argument('--token-interval', type=float, default=0.0, help="Delay between streamed tokens in seconds")
+    parser.add_argument('--batch-duration', type=float, default=0.0, help="Seconds a batch takes to finish")
+    parser.add_argument('--batch-status', choices=('completed', 'failed', 'expired'), default='completed',
+                        help="Final status of every batch")
+    args = parser.parse_args()
+    server, base_url = start_mock_server(args.port, args.latency, args.jitter, args.failure_rate, args.response_size,
+                                         args.token_interval, args.batch_duration, args.batch_status)
+    print(f"Mock LLM server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
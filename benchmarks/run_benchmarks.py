@@ -0,0 +1,187 @@
+# benchmarks/run_benchmarks.py
+# Measures the trial engine's own throughput and overhead against the local
+# mock server. Run from the repository root with:
+#   python -m benchmarks.run_benchmarks --workers 1,5,20,100 --trials 500
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Relative changes beyond this are reported as regressions
+REGRESSION_THRESHOLD = 0.10
+
+PROVIDER_SETTINGS = {
+    'openai': {'model_name': 'gpt-4o-mini', 'path': '/v1', 'kwargs': {'max_completion_tokens': 64}},
+    'anthropic': {'model_name': 'claude-3-5-haiku-20241022', 'path': '', 'kwargs': {'max_tokens': 64}},
+}
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def _serve(port, latency, jitter, failure_rate, response_size):
+    from benchmarks.mock_server import start_mock_server
+    start_mock_server(port, latency, jitter, failure_rate, response_size)
+    threading.Event().wait()
+
+def _run_config(config):
+    """
+    Run one TrialManager configuration and measure it. Executed in a fresh
+    process so memory high-water marks and shared limiter state are per run.
+    """
+    import resource
+    from evaluator import Evaluator
+    from model_manager import ModelManager
+    from trial_manager import TrialManager
+
+    settings = PROVIDER_SETTINGS[config['provider']]
+    model_manager = ModelManager(
+        model_name=settings['model_name'],
+        api_key='benchmark-key',
+        provider=config['provider'],
+        base_url=config['base_url'] + settings['path']
+    )
+    evaluator = Evaluator('string_match', 'lorem ipsum')
+    trial_manager = TrialManager(
+        model_manager=model_manager,
+        evaluator=evaluator,
+        num_trials=config['trials'],
+        max_workers=config['max_workers'],
+        prompt='Benchmark prompt',
+        async_mode=config['async_mode'],
+        **settings['kwargs']
+    )
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    trial_manager.run_trials()
+    wall_time = time.perf_counter() - wall_start
+    cpu_time = time.process_time() - cpu_start
+
+    latencies = sorted(trial['response_time'] for trial in trial_manager.metrics_logger.trials)
+    completed = len(latencies)
+    return {
+        **{key: config[key] for key in ('provider', 'max_workers', 'async_mode', 'trials')},
+        'completed': completed,
+        'wall_time_s': wall_time,
+        'trials_per_sec': completed / wall_time if wall_time else None,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000 if latencies else None,
+        'latency_p95_ms': percentile(latencies, 0.95) * 1000 if latencies else None,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        # Harness overhead on top of the server's configured latency
+        'overhead_p50_ms': (percentile(latencies, 0.50) - config['latency']) * 1000 if latencies else None,
+        'cpu_ms_per_trial': cpu_time / completed * 1000 if completed else None,
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # ru_maxrss is in KiB on Linux
+    }
+
+def find_regressions(current, previous):
+    """
+    Compare rows of two benchmark result sets that share a configuration.
+    """
+    key = lambda row: (row['provider'], row['max_workers'], row['async_mode'], row['trials'])
+    baseline = {key(row): row for row in previous['results']}
+    # metric -> True when higher is better
+    metrics = {'trials_per_sec': True, 'latency_p95_ms': False, 'cpu_ms_per_trial': False, 'max_rss_mb': False}
+    regressions = []
+    for row in current['results']:
+        old = baseline.get(key(row))
+        if not old:
+            continue
+        for metric, higher_is_better in metrics.items():
+            if not old.get(metric) or row.get(metric) is None:
+                continue
+            change = (row[metric] - old[metric]) / old[metric]
+            if (-change if higher_is_better else change) > REGRESSION_THRESHOLD:
+                regressions.append(f"{key(row)} {metric}: {old[metric]:.2f} -> {row[metric]:.2f} ({change:+.0%})")
+    return regressions
+
+def _latest_result(settings):
+    """
+    Most recent saved result produced with the same server and trial settings.
+    """
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, 'benchmark-*.json')), reverse=True):
+        with open(path, encoding='utf-8') as f:
+            result = json.load(f)
+        if result.get('settings') == settings:
+            return path, result
+    return None, None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trial engine against a local mock LLM server")
+    parser.add_argument('--provider', choices=sorted(PROVIDER_SETTINGS), default='openai')
+    parser.add_argument('--trials', type=int, default=200)
+    parser.add_argument('--workers', default='1,5,20,100', help="Comma-separated max_workers values")
+    parser.add_argument('--async-mode', action='store_true', help="Benchmark the asyncio engine")
+    parser.add_argument('--latency', type=float, default=0.05, help="Mock server mean latency in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--response-size', type=int, default=256)
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+
+    settings = {
+        'provider': args.provider, 'trials': args.trials, 'async_mode': args.async_mode,
+        'latency': args.latency, 'jitter': args.jitter, 'failure_rate': args.failure_rate,
+        'response_size': args.response_size,
+    }
+
+    # The server gets its own process so its CPU use is not charged to the harness
+    context = multiprocessing.get_context('spawn')
+    server = context.Process(
+        target=_serve,
+        args=(args.port, args.latency, args.jitter, args.failure_rate, args.response_size),
+        daemon=True
+    )
+    server.start()
+    time.sleep(1.0)
+
+    results = []
+    try:
+        for max_workers in [int(value) for value in args.workers.split(',')]:
+            config = {
+                'provider': args.provider, 'trials': args.trials, 'max_workers': max_workers,
+                'async_mode': args.async_mode, 'latency': args.latency,
+                'base_url': f'http://127.0.0.1:{args.port}',
+            }
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                row = executor.submit(_run_config, config).result()
+            results.append(row)
+            print(f"workers={max_workers:>4}  {row['trials_per_sec']:8.1f} trials/s  "
+                  f"p50={row['latency_p50_ms']:.1f}ms p95={row['latency_p95_ms']:.1f}ms p99={row['latency_p99_ms']:.1f}ms  "
+                  f"cpu={row['cpu_ms_per_trial']:.2f}ms/trial  rss={row['max_rss_mb']:.0f}MB")
+    finally:
+        server.terminate()
+
+    current = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'settings': settings, 'results': results}
+    previous_path, previous = _latest_result(settings)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output_path = os.path.join(RESULTS_DIR, f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(current, f, indent=2)
+    print(f"Saved results to {output_path}")
+
+    if previous:
+        regressions = find_regressions(current, previous)
+        if regressions:
+            print(f"Regressions against {os.path.basename(previous_path)}:")
+            for regression in regressions:
+                print(f"  {regression}")
+        else:
+            print(f"No regressions against {os.path.basename(previous_path)}")
+
+
+if __name__ == '__main__':
+    main()
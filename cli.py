@@ -0,0 +1,122 @@
+# cli.py
+
+import argparse
+import json
+import os
+import sys
+import time
+from matrix_runner import MatrixRunner
+from model_manager import ModelManager
+from planner import plan_trial_manager
+from results_store import ResultsStore
+from tracing import FileSpanExporter, add_hook, remove_hook
+
+def _with_api_key(model):
+    """
+    Model settings with the API key filled in from the environment unless the
+    suite gives one: api_key_env names the variable, <PROVIDER>_API_KEY by default.
+    """
+    model = dict(model)
+    env_var = model.pop('api_key_env', f"{model['provider'].upper()}_API_KEY")
+    if not model.get('api_key'):
+        model['api_key'] = os.environ.get(env_var)
+        if not model['api_key']:
+            raise ValueError(f"No API key for {model['provider']}/{model['model_name']}: set {env_var}")
+    return model
+
+def load_suite(path):
+    """
+    Read a suite file: a JSON object with 'prompts', 'models' and
+    'temperatures' plus any other MatrixRunner.from_suite argument, and an
+    optional 'evaluator' model used when evaluation_method is 'llm'.
+    """
+    with open(path, encoding='utf-8') as f:
+        suite = json.load(f)
+    suite['models'] = [_with_api_key(model) for model in suite['models']]
+    evaluator = suite.pop('evaluator', None)
+    if evaluator:
+        suite['evaluator_model_manager'] = ModelManager(**_with_api_key(evaluator))
+    return suite
+
+def _print_progress(fraction):
+    sys.stderr.write(f"\r{fraction:6.1%} of trials completed")
+    sys.stderr.flush()
+
+def print_plan(runner):
+    """
+    Planner estimates per cell; cells of one provider share its rate limits,
+    so their planned concurrencies do not add up.
+    """
+    total_cost = 0.0
+    for cell in runner.cells:
+        plan = plan_trial_manager(cell.trial_manager)
+        tokens = sum(plan[name] for name in ('target_input_tokens', 'target_output_tokens', 'judge_input_tokens',
+                                             'judge_output_tokens'))
+        cost = f"${plan['cost']:.2f}" if plan['cost'] is not None else 'unknown'
+        print(f"{cell.name:<60} {tokens:>10,} tokens  {cost:>9}  concurrency {plan['concurrency']:>3}  "
+              f"~{plan['duration_seconds'] / 60:.1f} min ({plan['bottleneck']})")
+        if plan['cost'] is None or total_cost is None:
+            total_cost = None
+        else:
+            total_cost += plan['cost']
+    print(f"Estimated total cost: {f'${total_cost:.2f}' if total_cost is not None else 'unknown'}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cli', description="Run a prompts x models x temperatures suite")
+    parser.add_argument('suite', help="Suite JSON file")
+    parser.add_argument('--results-dir', help="Directory for the per-cell JSONL results and summary.json "
+                                              "(default: the suite's results_dir, or results/)")
+    parser.add_argument('--traces', help="Also export trace spans to this OTLP/JSON lines file")
+    parser.add_argument('--store', default='results_store',
+                        help="Results store directory the trials are added to for cross-run queries "
+                             "(default: results_store/; an empty value disables it)")
+    parser.add_argument('--username', help="User the runs are stored under in the results store")
+    parser.add_argument('--plan', action='store_true',
+                        help="Print each cell's planned tokens, cost and concurrency, and exit without running")
+    parser.add_argument('--quiet', action='store_true', help="Do not report progress")
+    args = parser.parse_args(argv)
+
+    try:
+        suite = load_suite(args.suite)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading suite {args.suite}: {e}", file=sys.stderr)
+        return 2
+    suite_results_dir = suite.pop('results_dir', None)
+    results_dir = args.results_dir or suite_results_dir or 'results'
+    runner = MatrixRunner.from_suite(results_dir=results_dir, **suite)
+    if args.plan:
+        print_plan(runner)
+        return 0
+
+    trace_exporter = None
+    if args.traces:
+        trace_exporter = FileSpanExporter(args.traces)
+        add_hook(trace_exporter)
+    started_at = time.time()
+    try:
+        summary = runner.run(progress_callback=None if args.quiet else _print_progress)
+    finally:
+        if trace_exporter:
+            remove_hook(trace_exporter)
+            trace_exporter.close()
+    if not args.quiet:
+        sys.stderr.write('\n')
+
+    summary_path = os.path.join(results_dir, 'summary.json')
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump({'suite': os.path.abspath(args.suite), 'elapsed_seconds': time.time() - started_at,
+                   'cells': summary, 'token_usage': runner.token_usage()}, f, indent=2)
+    if args.store:
+        store = ResultsStore(args.store)
+        for cell in runner.cells:
+            store.add_trial_manager(cell.trial_manager, username=args.username, started_at=started_at)
+    for row in summary:
+        print(f"{row['cell']:<60} {row['correct_count']:>5}/{row['total_trials']:<5} "
+              f"{row['correct_percentage']:6.1f}%  "
+              f"[{row['success_rate_ci_low']:.2f}, {row['success_rate_ci_high']:.2f}]")
+    print(f"Saved results to {results_dir}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# client_pool.py
+
+import asyncio
+import importlib.util
+import threading
+
+# Connection pool size of clients created without an explicit max_connections
+DEFAULT_MAX_CONNECTIONS = 100
+# Idle connections are kept open this long (seconds) for the next request
+KEEPALIVE_EXPIRY = 120.0
+
+# HTTP/2 needs the optional h2 package (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+class _PooledClient:
+    def __init__(self, client, max_connections):
+        self.client = client
+        self.max_connections = max_connections
+
+def _http_client_options(max_connections):
+    import httpx
+    return dict(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY
+        )
+    )
+
+def _build_client(provider, api_key, base_url, max_connections, is_async):
+    # Retries are handled by the shared rate limiter, not the SDK clients
+    # Provider SDKs are imported on first use: they dominate start-up time
+    options = _http_client_options(max_connections)
+    if provider == 'openai':
+        import openai
+        if is_async:
+            return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                                      http_client=openai.DefaultAsyncHttpxClient(**options))
+        return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                             http_client=openai.DefaultHttpxClient(**options))
+    if provider == 'anthropic':
+        import anthropic
+        if is_async:
+            return anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url, max_retries=0,
+                                            http_client=anthropic.DefaultAsyncHttpxClient(**options))
+        return anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=0,
+                                   http_client=anthropic.DefaultHttpxClient(**options))
+    raise ValueError("Unsupported provider")
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _get(key, provider, api_key, base_url, max_connections, is_async):
+    with _clients_lock:
+        pooled = _clients.get(key)
+        if pooled is None or (max_connections and pooled.max_connections < max_connections):
+            # A larger pool replaces the old client; managers still holding
+            # the old one keep using it until they are discarded
+            size = max(max_connections or DEFAULT_MAX_CONNECTIONS, pooled.max_connections if pooled else 0)
+            pooled = _clients[key] = _PooledClient(
+                _build_client(provider, api_key, base_url, size, is_async), size)
+        return pooled.client
+
+def get_client(provider, api_key, base_url=None, max_connections=None):
+    """
+    Process-wide SDK client for (provider, API key, endpoint).
+
+    The client and its keep-alive (HTTP/2 when available) connections are
+    shared by every ModelManager using the same credentials, target and
+    evaluator alike, and survive Streamlit reruns. max_connections grows the
+    pool when a caller needs more connections than it currently allows.
+    """
+    provider = provider.lower()
+    return _get((provider, api_key, base_url, False), provider, api_key, base_url, max_connections, False)
+
+def get_async_client(provider, api_key, base_url=None, max_connections=None):
+    """
+    Async counterpart of get_client for the running event loop.
+
+    Async connections cannot be shared between event loops, so clients are
+    pooled per loop and dropped once their loop has been closed.
+    """
+    provider = provider.lower()
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        for key in [key for key in _clients if isinstance(key[-1], asyncio.AbstractEventLoop) and key[-1].is_closed()]:
+            del _clients[key]
+    return _get((provider, api_key, base_url, loop), provider, api_key, base_url, max_connections, True)
@@ -1,89 +1,685 @@
 # evaluator.py
 
+import asyncio
+import json
+import math
 import re
+import threading
 import unicodedata
+from collections import OrderedDict
+import tracing
+
+WORD_PATTERN = re.compile(r'\b\w+\b')
+# Integers, decimals and scientific notation, with optional thousands separators
+NUMBER_PATTERN = re.compile(r'(?<![\w.])[-+]?(?:\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?|\.\d+)(?:[eE][-+]?\d+)?')
+
+# Algorithmic task types scored by similarity or tolerance rather than equality,
+# with the default minimum similarity of the first two
+FUZZY_TASK_TYPES = ('edit_distance', 'token_jaccard', 'numeric')
+DEFAULT_THRESHOLDS = {'edit_distance': 0.9, 'token_jaccard': 0.8}
+DEFAULT_TOLERANCE = 1e-6
+# Fewest responses for which edit distances are computed as NumPy arrays
+VECTORIZE_MIN_BATCH = 8
+
+# A batched judge reply's JSON array, and its objects one by one as a fallback
+JSON_ARRAY_PATTERN = re.compile(r'\[.*\]', re.DOTALL)
+JSON_OBJECT_PATTERN = re.compile(r'\{[^{}]*\}')
+VERDICT_WORDS = {'yes': True, 'pass': True, 'correct': True, 'true': True,
+                 'no': False, 'fail': False, 'incorrect': False, 'false': False}
+
+# ASCII control characters (category Cc): str.translate is fastest on ASCII
+# text, a compiled regex on everything else
+ASCII_CONTROL_TABLE = dict.fromkeys(list(range(32)) + [127])
+ASCII_CONTROL_PATTERN = re.compile('[\x00-\x1f\x7f]+')
 
 def remove_non_printable(s):
+    # Strip ASCII controls at C speed; str.isprintable() then proves the
+    # common case has no other category 'C' characters left to remove
+    if s.isascii():
+        return s.translate(ASCII_CONTROL_TABLE)
+    s = ASCII_CONTROL_PATTERN.sub('', s)
+    if s.isprintable():
+        return s
     return ''.join(c for c in s if unicodedata.category(c)[0] != 'C')
 
 def normalize_unicode(s):
     return unicodedata.normalize('NFKC', s)
 
+def parse_judge_verdicts(text, count):
+    """
+    Verdicts of a batched judge reply as {position: (is_correct, explanation)}
+    for responses numbered 1..count. The JSON array may be wrapped in other
+    text or a code fence; if it is malformed, each well-formed object is read
+    on its own. Items that cannot be read are left out.
+    """
+    items = None
+    match = JSON_ARRAY_PATTERN.search(text)
+    if match:
+        try:
+            items = json.loads(match.group())
+        except ValueError:
+            items = None
+    if not isinstance(items, list):
+        items = []
+        for match in JSON_OBJECT_PATTERN.finditer(text):
+            try:
+                items.append(json.loads(match.group()))
+            except ValueError:
+                continue
+
+    verdicts = {}
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        verdict = item.get('verdict')
+        if isinstance(verdict, str):
+            verdict = VERDICT_WORDS.get(verdict.strip().lower())
+        if not isinstance(verdict, bool):
+            continue
+        try:
+            index = int(item.get('index', position + 1))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= index <= count:
+            verdicts[index - 1] = (verdict, '' if verdict else str(item.get('explanation', '')).strip())
+    return verdicts
+
+def normalized_lines(s):
+    """
+    Non-empty, stripped, lower-cased lines of s after Unicode normalization,
+    as compared by the string_match task.
+    """
+    lines = normalize_unicode(remove_non_printable(s)).splitlines()
+    return [word.strip().lower() for word in lines if word.strip()]
+
+def normalized_text(s):
+    """
+    s after Unicode normalization, lower-cased, with control characters
+    removed and whitespace runs collapsed to single spaces.
+    """
+    return remove_non_printable(' '.join(normalize_unicode(s).lower().split()))
+
+def parse_number(s):
+    """
+    The last number written in s, as a float, or None if there is none.
+    """
+    numbers = NUMBER_PATTERN.findall(s)
+    if not numbers:
+        return None
+    return float(numbers[-1].replace(',', ''))
+
+def _pattern_masks(pattern):
+    # Bit i of a character's mask is set where pattern[i] is that character
+    masks = {}
+    for position, char in enumerate(pattern):
+        masks[char] = masks.get(char, 0) | (1 << position)
+    return masks
+
+def edit_distance(pattern, text):
+    """
+    Levenshtein distance between pattern and text, by Myers' bit-parallel
+    algorithm (in Hyyrö's formulation): one pass over text, with a column of
+    the dynamic programming matrix held as bits of a Python int.
+    """
+    length = len(pattern)
+    if not length:
+        return len(text)
+    masks = _pattern_masks(pattern)
+    full = (1 << length) - 1
+    top = 1 << (length - 1)
+    pv, mv, distance = full, 0, length
+    for char in text:
+        eq = masks.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & top:
+            distance += 1
+        elif mh & top:
+            distance -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return distance
+
+def edit_distances(pattern, texts):
+    """
+    edit_distance from pattern to each of texts. Patterns of up to 64
+    characters are matched against a batch of texts at once: each text
+    position is one NumPy operation over uint64 bit vectors of all texts
+    still that long.
+    """
+    if not pattern or len(pattern) > 64 or len(texts) < VECTORIZE_MIN_BATCH:
+        return [edit_distance(pattern, text) for text in texts]
+    import numpy as np
+
+    length = len(pattern)
+    masks = _pattern_masks(pattern)
+    # Longest text first, so the texts still running at any position are a prefix
+    order = np.argsort([-len(text) for text in texts], kind='stable')
+    lengths = np.array([len(texts[i]) for i in order])
+    longest = int(lengths[0])
+    if not longest:
+        return [length] * len(texts)
+
+    # Pattern mask of every character of every text, looked up by code point
+    chars = sorted(masks)
+    keys = np.array([ord(char) for char in chars], dtype=np.uint32)
+    values = np.array([masks[char] for char in chars], dtype=np.uint64)
+    code_points = np.frombuffer(''.join(texts[i] for i in order).encode('utf-32-le'), dtype=np.uint32)
+    positions = np.minimum(np.searchsorted(keys, code_points), len(keys) - 1)
+    found = keys[positions] == code_points
+    eq = np.zeros((longest, len(texts)), dtype=np.uint64)  # One row per text position
+    eq.T[np.arange(longest) < lengths[:, None]] = np.where(found, values[positions], 0)
+    running = np.searchsorted(-lengths, -np.arange(longest), side='left')
+
+    # Bits above the pattern length only ever carry and shift upwards, so they
+    # never reach the bits read
+    one = np.uint64(1)
+    top = np.uint64(1 << (length - 1))
+    pv = np.full(len(texts), (1 << length) - 1, dtype=np.uint64)
+    mv = np.zeros(len(texts), dtype=np.uint64)
+    distances = np.full(len(texts), length, dtype=np.int64)
+    for position in range(longest):
+        count = running[position]
+        eq_column, pv_column, mv_column = eq[position, :count], pv[:count], mv[:count]
+        xv = eq_column | mv_column
+        xh = (((eq_column & pv_column) + pv_column) ^ pv_column) | eq_column
+        ph = mv_column | ~(xh | pv_column)
+        mh = pv_column & xh
+        distances[:count] += (ph & top).astype(bool).astype(np.int64) - (mh & top).astype(bool)
+        ph = (ph << one) | one
+        mh = mh << one
+        pv[:count] = mh | ~(xv | ph)
+        mv[:count] = ph & xv
+
+    result = np.empty(len(texts), dtype=np.int64)
+    result[order] = distances
+    return result.tolist()
+
 class Evaluator:
     """
     Evaluates the model's response based on the task type.
+
+    With judge_batch_size > 1, evaluate_many packs that many distinct
+    responses into each LLM judge call, which answers with a JSON array of
+    verdicts; responses whose verdict cannot be read are judged one by one.
+
+    Verdicts are memoized: a response identical (after stripping) to one
+    already scored under the same configuration reuses its verdict and log
+    instead of rerunning the comparison or the judge call. The memo is an
+    LRU bounded to memo_size entries (0 disables it).
+
+    Besides exact string_match and subset entity_recognition, algorithmic
+    evaluation offers fuzzy task types, scored in batches by evaluate_many:
+    edit_distance (1 - Levenshtein distance / longer length of the normalized
+    texts) and token_jaccard (overlap of the word sets) pass at a similarity
+    of at least threshold; numeric passes when the last number in the
+    response is within tolerance of the expected one (relative or absolute,
+    as math.isclose).
     """
-    def __init__(self, task_type, expected_output, evaluation_method='algorithmic', evaluator_model_manager=None, evaluator_prompt=None):
+    def __init__(self, task_type, expected_output, evaluation_method='algorithmic', evaluator_model_manager=None,
+                 evaluator_prompt=None, judge_batch_size=1, memo_size=10000, threshold=None,
+                 tolerance=DEFAULT_TOLERANCE):
         self.task_type = task_type
         self.expected_output = expected_output.strip()
         self.evaluation_method = evaluation_method.lower()
         self.evaluator_model_manager = evaluator_model_manager
         self.evaluator_prompt = evaluator_prompt  # Custom evaluator prompt
+        self.judge_batch_size = judge_batch_size  # Responses scored per LLM judge call
+        self.threshold = threshold  # Minimum similarity, None for the task type's default
+        self.tolerance = tolerance  # Numeric tolerance
         self.log_messages = []  # For logging differences
+        self._compiled_for = None  # (task_type, expected_output) the expected side was compiled from
+        self.memo_size = memo_size
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks cannot be pickled; worker processes start with an empty memo
+        state = self.__dict__.copy()
+        del state['_memo_lock']
+        state['_memo'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._memo_lock = threading.Lock()
+
+    def _memo_key(self, response):
+        # Everything the verdict depends on besides the response itself
+        judge = self.evaluator_model_manager
+        return (self.task_type, self.expected_output, self.evaluation_method, self.evaluator_prompt,
+                self.threshold, self.tolerance, getattr(judge, 'provider', None), getattr(judge, 'model_name', None),
+                response)
+
+    def _memo_get(self, key):
+        if not self.memo_size:
+            return None
+        with self._memo_lock:
+            verdict = self._memo.get(key)
+            if verdict is None:
+                self.memo_misses += 1
+                return None
+            self._memo.move_to_end(key)
+            self.memo_hits += 1
+            return verdict
+
+    def _memo_put(self, key, is_correct, log_message):
+        if not self.memo_size:
+            return
+        # A failed judge call ("" or "Error: ...") is not a verdict worth reusing
+        if self.evaluation_method == 'llm' and not is_correct and (
+                not log_message or log_message.startswith("Error: ")):
+            return
+        with self._memo_lock:
+            self._memo[key] = (is_correct, log_message)
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def memo_stats(self):
+        """
+        Verdict memo counters, for the results summary.
+        """
+        lookups = self.memo_hits + self.memo_misses
+        return {
+            'memo_hits': self.memo_hits,
+            'memo_misses': self.memo_misses,
+            'memo_hit_rate': self.memo_hits / lookups if lookups else 0.0,
+        }
+
+    def _compile_expected(self):
+        """
+        Precompute the expected side of the algorithmic comparison once, and
+        again only if task_type or expected_output are changed afterwards.
+        """
+        if self._compiled_for == (self.task_type, self.expected_output):
+            return
+        if self.task_type == "string_match":
+            self._expected_words = normalized_lines(self.expected_output)
+            self._expected_word_set = set(self._expected_words)
+        elif self.task_type == "entity_recognition":
+            self._expected_entities = set(WORD_PATTERN.findall(self.expected_output.lower()))  # Extract words as entities
+        elif self.task_type == "edit_distance":
+            self._expected_text = normalized_text(self.expected_output)
+        elif self.task_type == "token_jaccard":
+            self._expected_tokens = set(WORD_PATTERN.findall(normalized_text(self.expected_output)))
+        elif self.task_type == "numeric":
+            self._expected_number = parse_number(self.expected_output)
+        self._compiled_for = (self.task_type, self.expected_output)
 
     def evaluate(self, response):
         response = response.strip()
-        if self.evaluation_method == 'algorithmic':
-            return self.algorithmic_evaluate(response)
-        elif self.evaluation_method == 'llm':
-            return self.llm_evaluate(response)
-        else:
-            # Default to False if evaluation method is unknown
-            return False
+        key = self._memo_key(response)
+        memoized = self._memo_get(key)
+        if memoized is not None:
+            return self._replay(memoized)
+        with tracing.span('evaluation', method=self.evaluation_method):
+            if self.evaluation_method == 'algorithmic':
+                verdict = self._algorithmic_verdict(response)
+            elif self.evaluation_method == 'llm':
+                verdict = self._verdict(self._judge(response))
+            else:
+                # Default to False if evaluation method is unknown
+                return False
+        self._memo_put(key, *verdict)
+        return self._replay(verdict)
+
+    def _replay(self, memoized):
+        # Log the explanation as the evaluation that produced the verdict did
+        is_correct, log_message = memoized
+        if log_message:
+            self.log_messages.append(log_message)
+        return is_correct
+
+    def evaluate_many(self, responses):
+        """
+        Evaluate a batch of responses, returning (is_correct, evaluation_log) pairs.
+        """
+        if self.evaluation_method == 'llm' and self.judge_batch_size > 1:
+            return self.llm_evaluate_many(responses)
+        if self.evaluation_method == 'algorithmic' and self.task_type in FUZZY_TASK_TYPES:
+            return self.algorithmic_evaluate_many(responses)
+        results = []
+        for response in responses:
+            is_correct = self.evaluate(response)
+            results.append((is_correct, '\n'.join(self.log_messages)))
+            self.log_messages.clear()
+        return results
+
+    async def aevaluate_many(self, responses):
+        """
+        Async counterpart of evaluate_many.
+        """
+        if self.evaluation_method == 'llm' and self.judge_batch_size > 1:
+            return await self.allm_evaluate_many(responses)
+        if self.evaluation_method == 'algorithmic' and self.task_type in FUZZY_TASK_TYPES:
+            return self.algorithmic_evaluate_many(responses)
+        results = []
+        for response in responses:
+            is_correct = await self.aevaluate(response)
+            results.append((is_correct, '\n'.join(self.log_messages)))
+            self.log_messages.clear()
+        return results
 
     def algorithmic_evaluate(self, response):
-        if self.task_type == "string_match":
-            # Normalize Unicode and remove non-printable characters
-            expected_normalized = normalize_unicode(remove_non_printable(self.expected_output))
-            response_normalized = normalize_unicode(remove_non_printable(response))
+        return self._replay(self._algorithmic_verdict(response))
+
+    def algorithmic_evaluate_many(self, responses):
+        """
+        Score responses with the algorithmic comparison in one batch, returning
+        (is_correct, evaluation_log) pairs. Identical responses are scored once.
+        """
+        responses = [response.strip() for response in responses]
+        verdicts, unique = self.lookup_memo(responses)
+        with tracing.span('evaluation', method=self.evaluation_method, responses=len(unique)):
+            verdicts.update(self.remember(dict(zip(unique, self._algorithmic_verdicts(unique)))))
+        return [verdicts[response] for response in responses]
 
-            # Process the expected output
-            expected_lines = expected_normalized.splitlines()
-            expected_words = [word.strip().lower() for word in expected_lines if word.strip()]
+    def _algorithmic_verdicts(self, responses):
+        """
+        (is_correct, log) of the algorithmic comparison of each response.
+        """
+        self._compile_expected()
+        threshold = self.threshold if self.threshold is not None else DEFAULT_THRESHOLDS.get(self.task_type)
+        if self.task_type == "edit_distance":
+            texts = [normalized_text(response) for response in responses]
+            distances = edit_distances(self._expected_text, texts)
+            similarities = [1 - distance / max(len(self._expected_text), len(text), 1)
+                            for distance, text in zip(distances, texts)]
+            return [(True, '') if similarity >= threshold else
+                    (False, f"Edit similarity {similarity:.3f} is below the threshold {threshold}")
+                    for similarity in similarities]
+        elif self.task_type == "token_jaccard":
+            verdicts = []
+            for response in responses:
+                tokens = set(WORD_PATTERN.findall(normalized_text(response)))
+                union = tokens | self._expected_tokens
+                similarity = len(tokens & self._expected_tokens) / len(union) if union else 1.0
+                if similarity >= threshold:
+                    verdicts.append((True, ''))
+                else:
+                    verdicts.append((False, f"Token similarity {similarity:.3f} is below the threshold {threshold}\n"
+                                            f"Missing tokens: {self._expected_tokens - tokens}\n"
+                                            f"Extra tokens in response: {tokens - self._expected_tokens}"))
+            return verdicts
+        elif self.task_type == "numeric":
+            expected = self._expected_number
+            if expected is None:
+                return [(False, "Expected output contains no number")] * len(responses)
+            verdicts = []
+            for response in responses:
+                actual = parse_number(response)
+                if actual is None:
+                    verdicts.append((False, "No number in response"))
+                elif math.isclose(actual, expected, rel_tol=self.tolerance, abs_tol=self.tolerance):
+                    verdicts.append((True, ''))
+                else:
+                    verdicts.append((False, f"Response number {actual:g} differs from {expected:g} "
+                                            f"by more than the tolerance {self.tolerance:g}"))
+            return verdicts
+        return [self._algorithmic_verdict(response) for response in responses]
 
-            # Process the actual response
-            actual_lines = response_normalized.splitlines()
-            actual_words = [word.strip().lower() for word in actual_lines if word.strip()]
+    def _algorithmic_verdict(self, response):
+        """
+        (is_correct, log) of the algorithmic comparison.
+        """
+        if self.task_type in FUZZY_TASK_TYPES:
+            return self._algorithmic_verdicts([response])[0]
+        self._compile_expected()
+        if self.task_type == "string_match":
+            expected_words = self._expected_words
+            # Normalize Unicode, remove non-printable characters and split the actual response
+            actual_words = normalized_lines(response)
 
             # Compare the lists
             if expected_words == actual_words:
-                return True
+                return True, ''
             else:
                 # Log differences
-                missing_in_response = set(expected_words) - set(actual_words)
-                extra_in_response = set(actual_words) - set(expected_words)
+                actual_word_set = set(actual_words)
+                missing_in_response = self._expected_word_set - actual_word_set
+                extra_in_response = actual_word_set - self._expected_word_set
                 log_message = f"Words missing in response: {missing_in_response}\nExtra words in response: {extra_in_response}"
-                self.log_messages.append(log_message)
-                return False
+                return False, log_message
         elif self.task_type == "entity_recognition":
-            expected_entities = set(re.findall(r'\b\w+\b', self.expected_output.lower()))  # Extract words as entities
-            response_entities = set(re.findall(r'\b\w+\b', response.lower()))
+            expected_entities = self._expected_entities
+            response_entities = set(WORD_PATTERN.findall(response.lower()))
             
             # Check if response contains at least the expected entities
             missing_entities = expected_entities - response_entities
             extra_entities = response_entities - expected_entities
             
             if not missing_entities:  # If all expected entities are in response
-                return True
+                return True, ''
             else:
                 log_message = f"Missing entities: {missing_entities}\nExtra entities in response: {extra_entities}"
-                self.log_messages.append(log_message)
+                return False, log_message
+        return None, ''
+
+    def decide_partial(self, partial_response):
+        """
+        Outcome of the algorithmic evaluation if it is already determined by
+        this prefix of a streamed response, whatever follows; None otherwise.
+
+        A string_match response is decided wrong as soon as it diverges from
+        the expected line; an entity_recognition response is decided right
+        once every expected entity has appeared as a complete word.
+        """
+        if self.evaluation_method != 'algorithmic':
+            return None
+        self._compile_expected()
+        if self.task_type == "string_match":
+            # Newlines are stripped as non-printable, so the comparison is
+            # normally one line; only that case is decided early
+            if len(self._expected_words) > 1:
+                return None
+            expected_line = self._expected_words[0] if self._expected_words else ''
+            # Cut before the last printable ASCII character: nothing before it
+            # can still combine under NFKC with characters yet to arrive
+            match = re.search(r'[ -~][^ -~]*$', partial_response)
+            if match is None:
+                return None
+            prefix = normalize_unicode(remove_non_printable(partial_response[:match.start()])).strip()
+            if not prefix or prefix.splitlines() != [prefix]:
+                return None
+            # Lower-casing sigma depends on what follows (final form), so both
+            # forms compare equal here
+            if not expected_line.replace('ς', 'σ').startswith(prefix.lower().replace('ς', 'σ')):
                 return False
+            return None
+        elif self.task_type == "entity_recognition":
+            # Words followed by whitespace are complete and lower-case the
+            # same whatever follows
+            match = re.search(r'\s\S*$', partial_response)
+            if match is None:
+                return None
+            complete_words = set(WORD_PATTERN.findall(partial_response[:match.start()].lower()))
+            if self._expected_entities <= complete_words:
+                return True
+            return None
+        return None
+
+    async def aevaluate(self, response):
+        """
+        Async counterpart of evaluate; only LLM evaluation performs I/O.
+        """
+        response = response.strip()
+        if self.evaluation_method == 'llm':
+            key = self._memo_key(response)
+            memoized = self._memo_get(key)
+            if memoized is not None:
+                return self._replay(memoized)
+            with tracing.span('evaluation', method=self.evaluation_method):
+                verdict = self._verdict(await self._ajudge(response))
+            self._memo_put(key, *verdict)
+            return self._replay(verdict)
+        return self.evaluate(response)
 
     def llm_evaluate(self, response):
+        return self._process_evaluation_result(self._judge(response))
+
+    async def allm_evaluate(self, response):
+        return self._process_evaluation_result(await self._ajudge(response))
+
+    def _judge(self, response):
+        if not self.evaluator_model_manager:
+            raise ValueError("Evaluator ModelManager is not provided for LLM evaluation.")
+
+        # Generate evaluation using the evaluator LLM
+        return self.evaluator_model_manager.generate_response(
+            self.build_evaluation_prompt(response), cache_prefix=self._judge_prefix())
+
+    async def _ajudge(self, response):
         if not self.evaluator_model_manager:
             raise ValueError("Evaluator ModelManager is not provided for LLM evaluation.")
 
-            # Use the custom evaluator prompt if provided, otherwise use the default
+        return await self.evaluator_model_manager.agenerate_response(
+            self.build_evaluation_prompt(response), cache_prefix=self._judge_prefix())
+
+    def _judge_prefix(self):
+        """
+        The part of every single-response judge prompt before the response,
+        which the provider can serve from its prompt cache.
+        """
+        marker = '\0response\0'
+        return self.build_evaluation_prompt(marker).split(marker, 1)[0]
+
+    def llm_evaluate_many(self, responses):
+        """
+        Judge responses judge_batch_size at a time, returning (is_correct,
+        evaluation_log) pairs. Identical responses are judged once.
+
+        Does not use self.log_messages, so concurrent calls are safe.
+        """
+        if not self.evaluator_model_manager:
+            raise ValueError("Evaluator ModelManager is not provided for LLM evaluation.")
+        responses = [response.strip() for response in responses]
+        verdicts, unique = self.lookup_memo(responses)
+        with tracing.span('evaluation', method=self.evaluation_method, responses=len(unique)):
+            for start in range(0, len(unique), self.judge_batch_size):
+                verdicts.update(self.remember(self._judge_batch(unique[start:start + self.judge_batch_size])))
+        return [verdicts[response] for response in responses]
+
+    async def allm_evaluate_many(self, responses):
+        """
+        Async counterpart of llm_evaluate_many; the judge calls run concurrently.
+        """
+        if not self.evaluator_model_manager:
+            raise ValueError("Evaluator ModelManager is not provided for LLM evaluation.")
+        responses = [response.strip() for response in responses]
+        verdicts, unique = self.lookup_memo(responses)
+        with tracing.span('evaluation', method=self.evaluation_method, responses=len(unique)):
+            batches = await asyncio.gather(*(self._ajudge_batch(unique[start:start + self.judge_batch_size])
+                                             for start in range(0, len(unique), self.judge_batch_size)))
+        for batch_verdicts in batches:
+            verdicts.update(self.remember(batch_verdicts))
+        return [verdicts[response] for response in responses]
+
+    def lookup_memo(self, responses):
+        """
+        Split stripped responses into memoized verdicts {response: (is_correct, log)}
+        and the distinct responses still to be judged.
+        """
+        verdicts = {}
+        unique = []
+        for response in dict.fromkeys(responses):
+            memoized = self._memo_get(self._memo_key(response))
+            if memoized is not None:
+                verdicts[response] = memoized
+            else:
+                unique.append(response)
+        # Repeats within the batch are served by the first occurrence's verdict
+        with self._memo_lock:
+            self.memo_hits += len(responses) - len(verdicts) - len(unique)
+        return verdicts, unique
+
+    def remember(self, verdicts):
+        for response, (is_correct, log_message) in verdicts.items():
+            self._memo_put(self._memo_key(response), is_correct, log_message)
+        return verdicts
+
+    def _judge_batch(self, batch):
+        """
+        Verdicts {response: (is_correct, log)} for distinct responses, from one judge call.
+        """
+        if len(batch) == 1:
+            return {batch[0]: self._verdict(self._judge(batch[0]))}
+        reply = self.evaluator_model_manager.generate_response(
+            self.build_batch_evaluation_prompt(batch), cache_prefix=self._batch_prefix())
+        parsed = parse_judge_verdicts(reply, len(batch))
+        verdicts = {}
+        for position, response in enumerate(batch):
+            if position in parsed:
+                verdicts[response] = parsed[position]
+            else:
+                # Fall back to judging the unreadable items one by one
+                verdicts[response] = self._verdict(self._judge(response))
+        return verdicts
+
+    async def _ajudge_batch(self, batch):
+        """
+        Async counterpart of _judge_batch.
+        """
+        if len(batch) == 1:
+            return {batch[0]: self._verdict(await self._ajudge(batch[0]))}
+        reply = await self.evaluator_model_manager.agenerate_response(
+            self.build_batch_evaluation_prompt(batch), cache_prefix=self._batch_prefix())
+        parsed = parse_judge_verdicts(reply, len(batch))
+        missing = [response for position, response in enumerate(batch) if position not in parsed]
+        fallbacks = await asyncio.gather(*(self._ajudge(response) for response in missing))
+        verdicts = {response: parsed[position] for position, response in enumerate(batch) if position in parsed}
+        verdicts.update({response: self._verdict(result) for response, result in zip(missing, fallbacks)})
+        return verdicts
+
+    def build_batch_evaluation_prompt(self, responses):
+        """
+        Judge prompt covering several numbered responses, answered with a JSON array.
+        """
+        numbered = '\n\n'.join(f"### Response {index}:\n{response}"
+                                for index, response in enumerate(responses, start=1))
+        return (
+            f"{self._batch_prefix()}"
+            f"{numbered}\n\n"
+            f"Judge each of the {len(responses)} responses independently. Reply with only a JSON array "
+            f"containing one object per response, in order, of the form "
+            f'{{"index": <response number>, "verdict": "yes" or "no", "explanation": "<brief reason>"}}.'
+        )
+
+    def _batch_prefix(self):
+        """
+        Instructions and expected output that open every batched judge
+        prompt, ahead of the responses, so they can be served from the
+        provider's prompt cache.
+        """
         if self.evaluator_prompt and self.evaluator_prompt.strip():
-            evaluation_prompt = self.evaluator_prompt.format(
+            # The custom prompt's criteria apply to each response below
+            criteria = self.evaluator_prompt.format(
                 task_type=self.task_type,
                 expected_output=self.expected_output,
-                response=response
+                response='(each of the numbered responses below)'
             )
         else:
-            # Default evaluation prompt
-            evaluation_prompt = f"""
+            criteria = (f"Compare each actual response below with the expected output, and determine if it "
+                        f"meets the expectations for the task '{self.task_type}'.\n\n"
+                        f"### Expected Output:\n{self.expected_output}")
+        return f"You are an expert evaluator. {criteria}\n\n"
+
+    def build_evaluation_prompt(self, response):
+        # Use the custom evaluator prompt if provided, otherwise use the default
+        if self.evaluator_prompt and self.evaluator_prompt.strip():
+            return self.evaluator_prompt.format(
+                task_type=self.task_type,
+                expected_output=self.expected_output,
+                response=response
+            )
+        # Default evaluation prompt
+        return f"""
         You are an expert evaluator. Compare the following expected output and actual response, and determine if the response meets the expectations for the task '{self.task_type}'.
 
         ### Expected Output:
@@ -95,13 +691,29 @@ class Evaluator:
         Based on the expected output and the actual response, does the response meet the expectations? Reply with 'Yes' if it meets the expectations, or 'No' if it does not, followed by a brief explanation.
         """
 
-            # Generate evaluation using the evaluator LLM
-        evaluation_result = self.evaluator_model_manager.generate_response(evaluation_prompt)
+    @staticmethod
+    def _verdict(evaluation_result):
+        """
+        (is_correct, log) of a single-response judge reply.
+        """
+        if 'yes' in evaluation_result.lower():
+            return True, ''
+        # The evaluator's explanation
+        return False, evaluation_result.strip()
 
+    def _process_evaluation_result(self, evaluation_result):
         # Process the evaluation result
-        if 'yes' in evaluation_result.lower():
-            return True
-        else:
+        is_correct, log_message = self._verdict(evaluation_result)
+        if not is_correct:
             # Log the evaluator's explanation
-            self.log_messages.append(evaluation_result.strip())
-            return False
+            self.log_messages.append(log_message)
+        return is_correct
+
+
+def score_chunk(evaluator, responses):
+    """
+    Evaluate a list of responses, returning (is_correct, evaluation_log) pairs.
+
+    Module-level so it can run in a worker process with a pickled Evaluator.
+    """
+    return evaluator.evaluate_many(responses)
@@ -0,0 +1,413 @@
+# job_queue.py
+
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+# Requests in flight across all running jobs of the deployment
+DEFAULT_CONCURRENCY_BUDGET = 100
+# Seconds an idle worker waits before polling the queue again
+POLL_INTERVAL = 1.0
+# Seconds between progress writes of a running job
+PROGRESS_INTERVAL = 1.0
+# Workers heartbeat this often; one silent for HEARTBEAT_TIMEOUT is presumed dead
+HEARTBEAT_INTERVAL = 5.0
+HEARTBEAT_TIMEOUT = 30.0
+
+ACTIVE_STATES = ('running', 'cancelling')
+FINAL_STATES = ('completed', 'cancelled', 'failed')
+# Spec fields holding API keys, dropped as soon as a job reaches a final state
+SECRET_PATHS = ('$.model.api_key', '$.evaluator.model.api_key')
+
+class JobQueue:
+    """
+    Trial runs queued in SQLite and executed by worker processes.
+
+    Each job records the request concurrency it needs (its max_workers). A
+    worker only claims the oldest queued job once the jobs already running
+    leave enough of the global concurrency_budget for it, so the deployment
+    never has more than concurrency_budget requests in flight however many
+    users submit runs. Jobs are claimed first come, first served.
+    """
+    def __init__(self, path='jobs.sqlite', concurrency_budget=DEFAULT_CONCURRENCY_BUDGET):
+        self.path = path
+        self.concurrency_budget = concurrency_budget
+        self.lock = threading.Lock()
+        # Autocommit; claim() opens its own write transaction
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                spec TEXT NOT NULL,
+                concurrency INTEGER NOT NULL,
+                results_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress REAL NOT NULL DEFAULT 0,
+                summary TEXT,
+                error TEXT,
+                worker_pid INTEGER,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_username ON jobs (username, id)')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS workers (
+                pid INTEGER PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+        """)
+        # Keys left behind by jobs that were finalized before every final state scrubbed them
+        self.conn.execute(f"UPDATE jobs SET spec = json_remove(spec, {', '.join('?' * len(SECRET_PATHS))}) "
+                          f"WHERE status IN ({', '.join('?' * len(FINAL_STATES))})", (*SECRET_PATHS, *FINAL_STATES))
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['spec'] = json.loads(job['spec'])
+        job['summary'] = json.loads(job['summary']) if job['summary'] else None
+        return job
+
+    def submit(self, username, spec):
+        """
+        Queue a run described by spec (see build_trial_manager) and return its job id.
+        """
+        concurrency = max(1, min(int(spec['trial'].get('max_workers', 1)), self.concurrency_budget))
+        with self.lock:
+            cursor = self.conn.execute(
+                'INSERT INTO jobs (username, spec, concurrency, results_path, status, created_at) '
+                "VALUES (?, ?, ?, ?, 'queued', ?)",
+                (username, json.dumps(spec), concurrency, spec['results_path'], time.time())
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker_pid):
+        """
+        Mark the oldest queued job as running on worker_pid and return it, or
+        None when the queue is empty or the budget cannot fit that job yet.
+        """
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                in_use = self.conn.execute(
+                    'SELECT COALESCE(SUM(concurrency), 0) FROM jobs WHERE status IN (?, ?)', ACTIVE_STATES
+                ).fetchone()[0]
+                row = self.conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is None or in_use + row['concurrency'] > self.concurrency_budget:
+                    self.conn.execute('COMMIT')
+                    return None
+                now = time.time()
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, progress = 0 WHERE id = ?",
+                    (worker_pid, now, row['id'])
+                )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        job = self._row(row)
+        job.update(status='running', worker_pid=worker_pid, started_at=now)
+        return job
+
+    def report_progress(self, job_id, progress):
+        """
+        Record a running job's progress and return its status, which is
+        'cancelling' once the user asked for it to stop.
+        """
+        with self.lock:
+            self.conn.execute('UPDATE jobs SET progress = ? WHERE id = ?', (progress, job_id))
+            return self.conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+    def _finalize(self, status, condition, params, summary=None, error=None):
+        """
+        Move the jobs matching condition to a final status, dropping the API
+        keys from their stored spec in the same UPDATE. Call with self.lock held.
+        """
+        self.conn.execute(
+            f"UPDATE jobs SET status = ?, spec = json_remove(spec, {', '.join('?' * len(SECRET_PATHS))}), "
+            f"summary = COALESCE(?, summary), error = COALESCE(?, error), finished_at = ? WHERE {condition}",
+            (status, *SECRET_PATHS, json.dumps(summary) if summary is not None else None, error, time.time(), *params)
+        )
+
+    def finish(self, job_id, status, summary=None, error=None):
+        """
+        Record a job's final status. API keys are dropped from the stored spec.
+        """
+        with self.lock:
+            self._finalize(status, 'id = ?', (job_id,), summary=summary, error=error)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job, or ask the worker running it to stop.
+        """
+        with self.lock:
+            self._finalize('cancelled', "id = ? AND status = 'queued'", (job_id,))
+            self.conn.execute("UPDATE jobs SET status = 'cancelling' WHERE id = ? AND status = 'running'", (job_id,))
+
+    def get(self, job_id):
+        with self.lock:
+            return self._row(self.conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def jobs(self, username=None, limit=20):
+        """
+        Most recent jobs first, optionally only those of one user.
+        """
+        with self.lock:
+            if username is None:
+                rows = self.conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+            else:
+                rows = self.conn.execute('SELECT * FROM jobs WHERE username = ? ORDER BY id DESC LIMIT ?',
+                                         (username, limit)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def heartbeat(self, worker_pid):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO workers (pid, heartbeat_at) VALUES (?, ?)',
+                              (worker_pid, time.time()))
+
+    def remove_worker(self, worker_pid):
+        with self.lock:
+            self.conn.execute('DELETE FROM workers WHERE pid = ?', (worker_pid,))
+
+    def live_workers(self):
+        """
+        Pids of workers with a recent heartbeat; silent ones are forgotten.
+        """
+        with self.lock:
+            self.conn.execute('DELETE FROM workers WHERE heartbeat_at < ?', (time.time() - HEARTBEAT_TIMEOUT,))
+            return [row[0] for row in self.conn.execute('SELECT pid FROM workers')]
+
+    def requeue_orphaned(self):
+        """
+        Put jobs whose worker died back in the queue; the worker that claims
+        one next resumes its run from the results checkpointed so far.
+        Returns the number of jobs requeued.
+        """
+        live = self.live_workers()
+        with self.lock:
+            # NOT IN (NULL) matches nothing, so an empty list needs no condition
+            orphaned = f"worker_pid NOT IN ({','.join('?' * len(live))})" if live else '1'
+            self._finalize('cancelled', f"status = 'cancelling' AND {orphaned}", live)
+            return self.conn.execute(
+                f"UPDATE jobs SET status = 'queued', worker_pid = NULL, progress = 0 "
+                f"WHERE status = 'running' AND {orphaned}",
+                live
+            ).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def build_trial_manager(spec, max_workers=None, progress_callback=None, run_id=None):
+    """
+    TrialManager for a job spec: a JSON object with
+
+    model: ModelManager arguments (model_name, api_key, provider, rpm, tpm, ...)
+    evaluator: Evaluator arguments, with the judge's ModelManager arguments under 'model'
+    trial: TrialManager arguments, with the sampling arguments under 'kwargs'
+    results_path: JSONL file the trials are streamed to
+    use_cache: whether to reuse cached responses
+
+    plus optional execution_mode ('batch' runs through the provider's batch API)
+    and trace_path (OTLP/JSON span export).
+    """
+    from evaluator import Evaluator
+    from model_manager import ModelManager
+    from response_cache import get_response_cache
+    from trial_manager import TrialManager
+
+    cache = get_response_cache() if spec.get('use_cache') else None
+    trial = dict(spec['trial'])
+    max_workers = max_workers or trial.get('max_workers', 5)
+    evaluator_spec = dict(spec['evaluator'])
+    judge = evaluator_spec.pop('model', None)
+    evaluator = Evaluator(
+        evaluator_model_manager=ModelManager(cache=cache, max_connections=max_workers, **judge) if judge else None,
+        **evaluator_spec
+    )
+    model_manager = ModelManager(cache=cache, max_connections=max_workers, **spec['model'])
+    kwargs = trial.pop('kwargs', {})
+    trial.update(max_workers=max_workers, max_concurrency=max_workers)
+    return TrialManager(model_manager=model_manager, evaluator=evaluator, results_path=spec['results_path'],
+                        progress_callback=progress_callback, run_id=run_id, **trial, **kwargs)
+
+def job_run_id(job):
+    """
+    Run id a job's trials are logged under in its results file, which later
+    jobs with the same run name share.
+    """
+    return f"job-{job['id']}"
+
+def run_job(queue, job):
+    """
+    Execute a claimed job, keeping its progress and final status up to date.
+    """
+    from tracing import FileSpanExporter, add_hook, remove_hook
+
+    spec = job['spec']
+    last_report = [0.0]
+    trial_manager = None
+
+    def progress_callback(fraction):
+        now = time.time()
+        if fraction < 1 and now - last_report[0] < PROGRESS_INTERVAL:
+            return
+        last_report[0] = now
+        if queue.report_progress(job['id'], fraction) == 'cancelling':
+            trial_manager.stop()
+
+    trace_exporter = None
+    try:
+        # A job requeued after its worker died picks up where that worker stopped
+        trial_manager = build_trial_manager(spec, job['concurrency'], progress_callback, run_id=job_run_id(job))
+        if spec.get('trace_path'):
+            trace_exporter = FileSpanExporter(spec['trace_path'])
+            add_hook(trace_exporter)
+        trial_manager.resume(batch=spec.get('execution_mode') == 'batch')
+    except Exception as e:
+        print(f"Error running job {job['id']}: {e}")
+        queue.finish(job['id'], 'failed', error=str(e))
+        return
+    finally:
+        if trace_exporter:
+            remove_hook(trace_exporter)
+            trace_exporter.close()
+    summary = {
+        **trial_manager.metrics_logger.summary(),
+        **trial_manager.evaluator.memo_stats(),
+        **trial_manager.token_usage(),
+        'stopped_early': trial_manager.stopped_early,
+    }
+    _store_results(job, trial_manager)
+    if trial_manager.stop_requested:
+        queue.finish(job['id'], 'cancelled', summary=summary)
+        return
+    queue.report_progress(job['id'], 1.0)
+    queue.finish(job['id'], 'completed', summary=summary)
+
+def _store_results(job, trial_manager):
+    """
+    Add the job's trials to the results store its spec names, if any.
+    """
+    store_path = job['spec'].get('results_store')
+    if not store_path:
+        return
+    from results_store import ResultsStore
+
+    try:
+        ResultsStore(store_path).add_trial_manager(trial_manager, username=job['username'],
+                                                   started_at=job['created_at'])
+    except Exception as e:
+        print(f"Error adding job {job['id']} to the results store: {e}")
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def get_job_queue(path='jobs.sqlite', **kwargs):
+    """
+    Process-wide JobQueue instance for `path`.
+    """
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = JobQueue(path, **kwargs)
+        return _queues[path]
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def worker_loop(path='jobs.sqlite', concurrency_budget=DEFAULT_CONCURRENCY_BUDGET, parent_pid=None,
+                poll_interval=POLL_INTERVAL):
+    """
+    Run queued jobs one at a time until stopped. With parent_pid, the worker
+    exits once that process is gone and the worker is idle.
+    """
+    queue = JobQueue(path, concurrency_budget)
+    pid = os.getpid()
+    stopped = threading.Event()
+
+    def heartbeat():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            queue.heartbeat(pid)
+
+    queue.heartbeat(pid)
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        while parent_pid is None or _pid_alive(parent_pid):
+            queue.requeue_orphaned()
+            job = queue.claim(pid)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            run_job(queue, job)
+    finally:
+        stopped.set()
+        queue.remove_worker(pid)
+        queue.close()
+
+def _worker_command(path, concurrency_budget, parent_pid=None):
+    command = [sys.executable, '-m', 'job_queue', '--db', os.path.abspath(path),
+               '--budget', str(concurrency_budget), '--workers', '1']
+    if parent_pid is not None:
+        command += ['--parent-pid', str(parent_pid)]
+    return command
+
+_spawn_lock = threading.Lock()
+
+def ensure_workers(num_workers, path='jobs.sqlite', concurrency_budget=DEFAULT_CONCURRENCY_BUDGET):
+    """
+    Start worker processes until num_workers are alive for the queue at path.
+    Workers started here exit once this process is gone and they are idle.
+    """
+    # Workers share this process's working directory, so relative paths in
+    # job specs resolve the same way
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    queue = get_job_queue(path, concurrency_budget=concurrency_budget)
+    with _spawn_lock:
+        for _ in range(num_workers - len(queue.live_workers())):
+            process = subprocess.Popen(_worker_command(path, concurrency_budget, os.getpid()), env=env)
+            queue.heartbeat(process.pid)  # Counted as alive until it heartbeats itself
+
+def main():
+    parser = argparse.ArgumentParser(description="Run trial jobs from the SQLite job queue")
+    parser.add_argument('--db', default='jobs.sqlite', help="Job queue database")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes, each running one job at a time")
+    parser.add_argument('--budget', type=int, default=DEFAULT_CONCURRENCY_BUDGET,
+                        help="Requests in flight across all running jobs")
+    parser.add_argument('--parent-pid', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        worker_loop(args.db, args.budget, args.parent_pid)
+        return
+    processes = [subprocess.Popen(_worker_command(args.db, args.budget)) for _ in range(args.workers)]
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
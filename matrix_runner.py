@@ -0,0 +1,179 @@
+# matrix_runner.py
+
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import product
+from evaluator import DEFAULT_TOLERANCE, Evaluator
+from model_manager import ModelManager
+from trial_manager import TrialManager
+
+# Default number of requests in flight per provider
+DEFAULT_PROVIDER_LIMITS = {'openai': 20, 'anthropic': 20}
+
+def provider_kwargs(provider, temperature, max_tokens):
+    """
+    Sampling arguments in the form each provider's API expects.
+    """
+    if provider.lower() == 'openai':
+        return {'temperature': temperature, 'max_completion_tokens': int(max_tokens)}
+    return {'temperature': temperature, 'max_tokens': int(max_tokens)}
+
+class MatrixCell:
+    """
+    One (prompt, model, temperature) combination of a suite and its scheduling state.
+    """
+    def __init__(self, name, provider, trial_manager):
+        self.name = name
+        self.provider = provider
+        self.trial_manager = trial_manager
+        self.pending = deque(trial_manager.trial_groups())
+        self.in_flight = 0
+
+class MatrixRunner:
+    """
+    Runs every cell of a prompts x models x temperatures suite through one
+    global scheduler.
+
+    All trials share a single thread pool. Each provider has its own
+    concurrency limit, so OpenAI and Anthropic work proceeds in parallel, and
+    within a provider a freed slot always goes to the cell with the fewest
+    requests in flight, so a slow model cannot starve the others.
+    """
+    def __init__(self, cells, provider_limits=None):
+        self.cells = cells
+        self.provider_limits = dict(DEFAULT_PROVIDER_LIMITS)
+        self.provider_limits.update(provider_limits or {})
+        self.provider_in_flight = dict.fromkeys(self.provider_limits, 0)
+
+    @classmethod
+    def from_suite(cls, prompts, models, temperatures, num_trials=50, max_tokens=150,
+                   evaluation_method='algorithmic', evaluator_model_manager=None, evaluator_prompt=None,
+                   results_dir=None, provider_limits=None):
+        """
+        Build a runner for every combination of the given prompts, models and temperatures.
+
+        prompts: dicts with 'prompt', 'expected_output' and optional 'task_type', 'name' and
+            'threshold' or 'tolerance' (fuzzy task types)
+        models: dicts with 'provider', 'model_name' and 'api_key' (plus optional ModelManager arguments)
+        """
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+        limits = dict(DEFAULT_PROVIDER_LIMITS)
+        limits.update(provider_limits or {})
+        # One ModelManager per model, shared by all of its cells, with a
+        # connection pool as large as its provider's concurrency limit
+        model_managers = {}
+        for model in models:
+            provider = model['provider'].lower()
+            model_managers[(provider, model['model_name'])] = ModelManager(
+                **{'max_connections': limits.get(provider), **model})
+
+        cells = []
+        for (prompt_index, prompt), model, temperature in product(enumerate(prompts), models, temperatures):
+            provider = model['provider'].lower()
+            name = f"{prompt.get('name', f'prompt{prompt_index}')}|{provider}/{model['model_name']}|t={temperature}"
+            evaluator = Evaluator(
+                prompt.get('task_type', 'string_match'),
+                prompt['expected_output'],
+                evaluation_method=evaluation_method,
+                evaluator_model_manager=evaluator_model_manager,
+                evaluator_prompt=evaluator_prompt,
+                threshold=prompt.get('threshold'),
+                tolerance=prompt.get('tolerance', DEFAULT_TOLERANCE)
+            )
+            results_path = None
+            if results_dir:
+                safe_name = ''.join(c if c.isalnum() or c in '-_.=' else '_' for c in name)
+                results_path = os.path.join(results_dir, f'{safe_name}.jsonl')
+            trial_manager = TrialManager(
+                model_manager=model_managers[(provider, model['model_name'])],
+                evaluator=evaluator,
+                num_trials=num_trials,
+                prompt=prompt['prompt'],
+                results_path=results_path,
+                **provider_kwargs(provider, temperature, max_tokens)
+            )
+            cells.append(MatrixCell(name, provider, trial_manager))
+        return cls(cells, provider_limits=provider_limits)
+
+    def _next_cell(self, provider):
+        # Least-loaded cell of this provider that still has trials to run
+        candidates = [cell for cell in self.cells if cell.provider == provider and cell.pending]
+        return min(candidates, key=lambda cell: cell.in_flight, default=None)
+
+    def _dispatch(self, executor, running):
+        """
+        Fill every provider's free slots with trials from its least-loaded cells.
+        """
+        for provider, limit in self.provider_limits.items():
+            while self.provider_in_flight[provider] < limit:
+                cell = self._next_cell(provider)
+                if cell is None:
+                    break
+                group = cell.pending.popleft()
+                running[executor.submit(cell.trial_manager.run_trial_group, group, time.time())] = cell
+                cell.in_flight += 1
+                self.provider_in_flight[provider] += 1
+
+    def run(self, progress_callback=None):
+        """
+        Run all cells to completion. progress_callback, if given, is called
+        with the fraction of all trials completed.
+        """
+        for cell in self.cells:
+            # Providers without a configured limit get the default budget
+            self.provider_limits.setdefault(cell.provider, max(DEFAULT_PROVIDER_LIMITS.values()))
+            self.provider_in_flight.setdefault(cell.provider, 0)
+        total_trials = sum(cell.trial_manager.num_trials for cell in self.cells)
+        completed_trials = 0
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=sum(self.provider_limits.values())) as executor:
+            self._dispatch(executor, running)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cell = running.pop(future)
+                    cell.in_flight -= 1
+                    self.provider_in_flight[cell.provider] -= 1
+                    try:
+                        completed_trials += len(future.result())
+                    except Exception as e:
+                        print(f"Error during trial ({cell.name}): {e}")
+                    if progress_callback and total_trials:
+                        progress_callback(completed_trials / total_trials)
+                self._dispatch(executor, running)
+
+        for cell in self.cells:
+            cell.trial_manager.metrics_logger.close()
+        return self.summary()
+
+    def token_usage(self):
+        """
+        Provider-reported token usage, prompt cache reads and writes
+        included, of every model in the suite.
+        """
+        managers = {}
+        for cell in self.cells:
+            model_manager = cell.trial_manager.model_manager
+            managers[f'{cell.provider}/{model_manager.model_name}'] = model_manager
+        return {name: dict(model_manager.usage) for name, model_manager in managers.items()}
+
+    def summary(self):
+        """
+        Per-cell summary metrics, in suite order.
+        """
+        rows = []
+        for cell in self.cells:
+            trial_manager = cell.trial_manager
+            rows.append({
+                'cell': cell.name,
+                'provider': cell.provider,
+                'model_name': trial_manager.model_manager.model_name,
+                'temperature': trial_manager.kwargs.get('temperature'),
+                **trial_manager.metrics_logger.summary(),
+                **trial_manager.evaluator.memo_stats(),
+            })
+        return rows
@@ -1,17 +1,163 @@
 # metrics_logger.py
 
+import json
+import math
+import os
+import threading
+from statistics import NormalDist
+
+def wilson_interval(successes, total, confidence=0.95):
+    """
+    Wilson score interval for a binomial success rate, as (low, high).
+    """
+    if total == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+    p = successes / total
+    denominator = 1 + z * z / total
+    center = (p + z * z / (2 * total)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
 class MetricsLogger:
-    def __init__(self):
+    """
+    Collects trial results and summary metrics.
+
+    Without a path, trials are kept in memory in `self.trials`. With a path,
+    each trial is appended to that JSONL file and flushed as soon as it is
+    logged, and only the running summary is kept in memory, so memory use
+    stays flat regardless of the number of trials or response length. Each
+    line is complete on disk once log_trial returns, so the file doubles as
+    a checkpoint of the run that survives the process dying.
+
+    Unless append is set, an existing file at path is replaced by the first
+    trial logged (and ignored until then).
+    """
+    def __init__(self, path=None, append=False):
+        self.path = path
         self.trials = []
+        self.total_count = 0
+        self.correct_count = 0
+        self.response_time_total = 0.0
+        self.timed_count = 0
+        self._file = None
+        self._fresh = bool(path) and not append  # Truncate on first write
+        self.read_only = False
+        self.run_id = None  # Set to restrict a shared file's trials to one run
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, run_id=None):
+        """
+        Logger for an existing JSONL results file, with its summary rebuilt
+        from the trials already on disk; further trials are appended. A line
+        cut short by a crash is dropped from the file, so only the process
+        that continues the run should load it; others use read(). Given a
+        run_id, trials of other runs in the file are left out of the summary
+        and of iter_trials().
+        """
+        metrics_logger = cls(path=path, append=True)
+        metrics_logger.run_id = run_id
+        if not os.path.exists(path):
+            return metrics_logger
+        with open(path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    f.truncate(offset)  # Torn final write
+                    break
+                offset += len(line)
+                if line.strip():
+                    trial = json.loads(line)
+                    if run_id is None or trial.get('run_id') == run_id:
+                        metrics_logger._update_summary(trial)
+        return metrics_logger
+
+    @classmethod
+    def read(cls, path, run_id=None):
+        """
+        Read-only logger for a results file another process may still be
+        appending to: a last line not yet complete is skipped, and the file
+        is never written to. run_id restricts it to one run's trials, as in load().
+        """
+        metrics_logger = cls(path=path, append=True)
+        metrics_logger.read_only = True
+        metrics_logger.run_id = run_id
+        for trial in metrics_logger.iter_trials():
+            metrics_logger._update_summary(trial)
+        return metrics_logger
 
     def log_trial(self, trial_data):
-        self.trials.append(trial_data)
+        if self.read_only:
+            raise ValueError(f"Results file {self.path} was opened read-only")
+        with self._lock:
+            self._update_summary(trial_data)
+            if self.path is None:
+                self.trials.append(trial_data)
+                return
+            if self._file is None:
+                self._file = open(self.path, 'w' if self._fresh else 'a', encoding='utf-8')
+                self._fresh = False
+            self._file.write(json.dumps(trial_data, default=str) + '\n')
+            self._file.flush()
+
+    def _update_summary(self, trial_data):
+        self.total_count += 1
+        if trial_data.get('correct'):
+            self.correct_count += 1
+        if trial_data.get('response_time') is not None:
+            self.response_time_total += trial_data['response_time']
+            self.timed_count += 1
+
+    def summary(self, confidence=0.95):
+        """
+        Summary metrics computed incrementally as trials were logged.
+        """
+        ci_low, ci_high = wilson_interval(self.correct_count, self.total_count, confidence)
+        return {
+            'total_trials': self.total_count,
+            'correct_count': self.correct_count,
+            'correct_percentage': (self.correct_count / self.total_count * 100) if self.total_count else 0,
+            'success_rate_ci_low': ci_low,
+            'success_rate_ci_high': ci_high,
+            'mean_response_time': (self.response_time_total / self.timed_count) if self.timed_count else None,
+        }
+
+    def iter_trials(self):
+        """
+        Iterate over logged trials, streaming them from disk when file-backed.
+        """
+        if self.path is None:
+            yield from self.trials
+            return
+        if self._fresh or not os.path.exists(self.path):
+            return
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                # A line without its newline is still being written
+                if line.endswith('\n') and line.strip():
+                    trial = json.loads(line)
+                    if self.run_id is None or trial.get('run_id') == self.run_id:
+                        yield trial
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
 
     def export_csv(self, filename='results.csv'):
         import csv
-        keys = self.trials[0].keys()
+        trials = self.iter_trials()
+        first = next(trials, None)
+        if first is None:
+            return
+        keys = first.keys()
         with open(filename, 'w', newline='', encoding='utf-8') as output_file:
-            dict_writer = csv.DictWriter(output_file, fieldnames=keys)
+            dict_writer = csv.DictWriter(output_file, fieldnames=keys, extrasaction='ignore')
             dict_writer.writeheader()
-            dict_writer.writerows(self.trials)
-
+            dict_writer.writerow(first)
+            dict_writer.writerows(trials)
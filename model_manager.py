@@ -1,118 +1,733 @@
 # model_manager.py
 
-from openai import OpenAI
-import requests
-import anthropic
-import streamlit as st
+import asyncio
+import json
+import threading
+import time
+from rate_limiter import get_rate_limiter, is_retryable_error, is_throttle_error
+from client_pool import get_async_client, get_client
+import tracing
+
+# Models served through the chat completions endpoint
+CHAT_MODELS = [
+    "gpt-4.5-preview",
+    "gpt-4.5-preview-2025-02-27",
+    "o1",
+    "o1-mini", 
+    "o3-mini",
+    "o1-mini-2024-09-12",
+    "o1-preview-2024-09-12",
+    "gpt-4o-mini",
+    "gpt-4o",
+    "gpt-4-turbo",
+    "gpt-4",
+    "gpt-3.5-turbo"
+]
+
+# Maximum number of requests the providers accept in a single batch job
+BATCH_LIMITS = {'openai': 50000, 'anthropic': 100000}
 
 class ModelManager:
     """
     A class to manage different language models.
+
+    Prompts are sent with their static part first, so providers can serve it
+    from their prompt cache. A call may pass cache_prefix, the leading part of
+    its prompt that repeats across calls (by default the whole prompt is
+    taken to repeat, as a trial's prompt does). With prompt_caching, Anthropic
+    requests put a cache_control breakpoint after that prefix; OpenAI caches
+    long byte-identical prefixes automatically. Cache read and write tokens
+    are counted in self.usage and in each trial's trace.
     """
-    def __init__(self, model_name, api_key, provider='openai'):
+    def __init__(self, model_name, api_key, provider='openai', rpm=None, tpm=None, cache=None, base_url=None,
+                 max_connections=None, prompt_caching=True):
         self.model_name = model_name
         self.api_key = api_key
         self.provider = provider.lower()
+        self.base_url = base_url  # Override the provider endpoint, e.g. for a local stand-in server
+        self.cache = cache  # Optional ResponseCache consulted before every call
+        # Connection pool size needed, normally the number of concurrent requests
+        self.max_connections = max_connections
+        self.prompt_caching = prompt_caching
+        self._async_clients = {}  # Async clients keyed by event loop, created lazily
+        # Provider-reported token usage of every call made through this manager
+        # (input tokens include those read from or written to the prompt cache)
+        self.usage = {'requests': 0, 'input_tokens': 0, 'output_tokens': 0,
+                      'cache_read_tokens': 0, 'cache_write_tokens': 0}
+        self._usage_lock = threading.Lock()
+
+        # Pooled process-wide, so warm connections outlive this manager
+        with tracing.span('client_setup', provider=self.provider):
+            self.client = get_client(self.provider, self.api_key, self.base_url, self.max_connections)
+
+        # Shared by every ModelManager targeting the same provider and model
+        self.rate_limiter = get_rate_limiter(self.provider, self.model_name, rpm=rpm, tpm=tpm)
+
+    @property
+    def async_client(self):
+        """
+        Async client for the running event loop.
+
+        Async HTTP connections cannot be shared between event loops, so each
+        loop (e.g. each asyncio.run in TrialManager) gets its own pooled client.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            # Drop clients belonging to loops that have since been closed
+            self._async_clients = {l: c for l, c in self._async_clients.items() if not l.is_closed()}
+            with tracing.span('client_setup', provider=self.provider):
+                client = get_async_client(self.provider, self.api_key, self.base_url, self.max_connections)
+            self._async_clients[loop] = client
+        return client
+
+    def generate_response(self, prompt, sample_index=None, **kwargs):
+        """
+        Generate a response from the specified model.
+
+        sample_index distinguishes repeated samples of the same request in the
+        response cache, so trial i of a rerun reuses trial i's response.
+        """
+        key = self._cache_key(prompt, sample_index, kwargs)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
 
         if self.provider == 'openai':
-            self.client = OpenAI(api_key=self.api_key)
+            response = self._generate_openai_response(prompt, **kwargs)
         elif self.provider == 'anthropic':
-            self.client = anthropic.Client(api_key=self.api_key)
+            response = self._generate_anthropic_response(prompt, **kwargs)
         else:
-            raise ValueError("Unsupported provider")
+            return ""
 
-    def generate_response(self, prompt, **kwargs):
+        self._cache_store(key, response)
+        return response
+
+    async def agenerate_response(self, prompt, sample_index=None, **kwargs):
         """
-        Generate a response from the specified model.
+        Async counterpart of generate_response, for use inside an event loop.
         """
+        key = self._cache_key(prompt, sample_index, kwargs)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
         if self.provider == 'openai':
-            return self._generate_openai_response(prompt, **kwargs)
+            response = await self._agenerate_openai_response(prompt, **kwargs)
         elif self.provider == 'anthropic':
-            return self._generate_anthropic_response(prompt, **kwargs)
+            response = await self._agenerate_anthropic_response(prompt, **kwargs)
         else:
             return ""
 
+        self._cache_store(key, response)
+        return response
+
+    def supports_multi_sample(self):
+        """
+        Whether one request can return several samples (OpenAI's `n`).
+        Anthropic and the o-series reasoning models only return one.
+        """
+        return (self.provider == 'openai' and self.model_name in CHAT_MODELS
+                and not self.model_name.startswith(('o1', 'o3')))
+
+    def generate_responses(self, prompt, n, sample_indices=None, **kwargs):
+        """
+        Generate n samples of the same request, in a single call where the
+        model supports it and one call per sample otherwise.
+        """
+        sample_indices = sample_indices if sample_indices is not None else [None] * n
+        keys, responses, missing = self._cached_samples(prompt, sample_indices, kwargs)
+        if missing:
+            if self.supports_multi_sample():
+                fresh = self._generate_openai_responses(prompt, len(missing), **kwargs)
+            elif self.provider == 'openai':
+                fresh = [self._generate_openai_response(prompt, **kwargs) for _ in missing]
+            else:
+                fresh = [self._generate_anthropic_response(prompt, **kwargs) for _ in missing]
+            for position, response in zip(missing, fresh):
+                responses[position] = response
+                self._cache_store(keys[position], response)
+        return responses
+
+    async def agenerate_responses(self, prompt, n, sample_indices=None, **kwargs):
+        """
+        Async counterpart of generate_responses.
+        """
+        sample_indices = sample_indices if sample_indices is not None else [None] * n
+        keys, responses, missing = self._cached_samples(prompt, sample_indices, kwargs)
+        if missing:
+            if self.supports_multi_sample():
+                fresh = await self._agenerate_openai_responses(prompt, len(missing), **kwargs)
+            elif self.provider == 'openai':
+                fresh = await asyncio.gather(*(self._agenerate_openai_response(prompt, **kwargs) for _ in missing))
+            else:
+                fresh = await asyncio.gather(*(self._agenerate_anthropic_response(prompt, **kwargs) for _ in missing))
+            for position, response in zip(missing, fresh):
+                responses[position] = response
+                self._cache_store(keys[position], response)
+        return responses
+
+    def _cached_samples(self, prompt, sample_indices, kwargs):
+        """
+        Look up each sample in the cache; returns (keys, responses, missing positions).
+        Samples without an index are never cached, as they are indistinguishable.
+        """
+        keys = [self._cache_key(prompt, index, kwargs) if index is not None else None
+                for index in sample_indices]
+        responses = [self.cache.get(key) if key is not None else None for key in keys]
+        missing = [position for position, response in enumerate(responses) if response is None]
+        return keys, responses, missing
+
+    def _cache_key(self, prompt, sample_index, kwargs):
+        if self.cache is None:
+            return None
+        # Where the prompt cache breakpoint goes does not change the response
+        kwargs = {name: value for name, value in kwargs.items() if name != 'cache_prefix'}
+        return self.cache.make_key(self.provider, self.model_name, prompt, kwargs, sample_index)
+
+    def _cache_store(self, key, response):
+        # Failed calls come back as "" or "Error: ..." and must not be replayed
+        if key is not None and response and not response.startswith("Error: "):
+            self.cache.put(key, response)
+
+    def _record_usage(self, usage):
+        """
+        Add a response's token usage to the current trial's trace and to self.usage.
+        """
+        if usage is None:
+            return
+        self._add_usage(*self._usage_counts(usage))
+
+    @staticmethod
+    def _usage_counts(usage):
+        """
+        (input, output, cache read, cache write) tokens of a provider usage object.
+        """
+        if usage is None:
+            return 0, 0, 0, 0
+        if hasattr(usage, 'prompt_tokens'):
+            # OpenAI: prompt tokens include the cached ones; cache writes are not reported
+            details = getattr(usage, 'prompt_tokens_details', None)
+            cache_read = getattr(details, 'cached_tokens', None) or 0
+            return usage.prompt_tokens or 0, usage.completion_tokens or 0, cache_read, 0
+        # Anthropic: input tokens exclude those read from or written to the cache
+        cache_read = getattr(usage, 'cache_read_input_tokens', None) or 0
+        cache_write = getattr(usage, 'cache_creation_input_tokens', None) or 0
+        input_tokens = (getattr(usage, 'input_tokens', None) or 0) + cache_read + cache_write
+        return input_tokens, getattr(usage, 'output_tokens', None) or 0, cache_read, cache_write
+
+    def _add_usage(self, input_tokens, output_tokens, cache_read_tokens=0, cache_write_tokens=0):
+        tracing.record_usage(input_tokens, output_tokens,
+                             cache_read_tokens=cache_read_tokens, cache_write_tokens=cache_write_tokens)
+        with self._usage_lock:
+            self.usage['requests'] += 1
+            self.usage['input_tokens'] += input_tokens
+            self.usage['output_tokens'] += output_tokens
+            self.usage['cache_read_tokens'] += cache_read_tokens
+            self.usage['cache_write_tokens'] += cache_write_tokens
+
+    @staticmethod
+    def _cache_prefix(prompt, kwargs):
+        """
+        Pop the cache_prefix call argument; the whole prompt when not given,
+        None when it is not actually a prefix of the prompt.
+        """
+        prefix = kwargs.pop('cache_prefix', None)
+        if prefix is None:
+            return prompt
+        return prefix if prompt.startswith(prefix) else None
+
+    @staticmethod
+    def _estimate_tokens(prompt, params):
+        """
+        Rough token cost of a request, for tokens/min pacing.
+        """
+        max_tokens = params.get('max_tokens') or params.get('max_completion_tokens') or 256
+        return len(prompt) // 4 + max_tokens * params.get('n', 1)
+
+    def _openai_request(self, prompt, kwargs):
+        """
+        Build the endpoint name and parameters for an OpenAI call.
+        """
+        # The prompt is sent as is: its static prefix already comes first, and
+        # OpenAI caches it automatically once it is long enough
+        self._cache_prefix(prompt, kwargs)
+        if self.model_name in CHAT_MODELS:
+            messages = kwargs.get('messages', [
+                {'role': 'user', 'content': prompt}
+            ])
+            # Remove 'messages' from kwargs if it exists
+            kwargs.pop('messages', None)
+            return 'chat', dict(model=self.model_name, messages=messages, **kwargs)
+        # For completion models
+        return 'completions', dict(model=self.model_name, prompt=prompt, **kwargs)
+
+    @staticmethod
+    def _parse_openai_choices(endpoint, response):
+        if endpoint != 'chat':
+            return [choice.text.strip() for choice in response.choices]
+        contents = []
+        for choice in response.choices:
+            if choice.message.content:
+                contents.append(choice.message.content.strip())
+            else:
+                print("Received empty response from OpenAI.")
+                contents.append("")
+        return contents
+
     def _generate_openai_response(self, prompt, **kwargs):
         """
         Generate a response using OpenAI's API.
         """
+        return self._generate_openai_responses(prompt, 1, **kwargs)[0]
+
+    async def _agenerate_openai_response(self, prompt, **kwargs):
+        """
+        Generate a response using OpenAI's async client.
+        """
+        return (await self._agenerate_openai_responses(prompt, 1, **kwargs))[0]
+
+    def _generate_openai_responses(self, prompt, n, **kwargs):
+        """
+        Generate n choices for one prompt in a single OpenAI call.
+        """
         try:
-            # Determine if the model is a chat model
-            chat_models = [
-                "gpt-4.5-preview",
-                "gpt-4.5-preview-2025-02-27",
-                "o1",
-                "o1-mini", 
-                "o3-mini",
-                "o1-mini-2024-09-12",
-                "o1-preview-2024-09-12",
-                "gpt-4o-mini",
-                "gpt-4o",
-                "gpt-4-turbo",
-                "gpt-4",
-                "gpt-3.5-turbo"
-            ]
-
-            if self.model_name in chat_models:
-                messages = kwargs.get('messages', [
-                    {'role': 'user', 'content': prompt}
-                ])
-                # Remove 'messages' from kwargs if it exists
-                kwargs.pop('messages', None)
-
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    **kwargs
-                )
-                return response.choices[0].message.content.strip()
+            if n > 1:
+                kwargs['n'] = n
+            endpoint, params = self._openai_request(prompt, kwargs)
+            if endpoint == 'chat':
+                create = self.client.chat.completions.create
             else:
-                # For completion models
-                response = self.client.completions.create(
-                    model=self.model_name,
-                    prompt=prompt,
-                    **kwargs
-                )
-                return response.choices[0].text.strip()
-            content = response.choices[0].message.content
-            if content:
-                return content.strip()
-            else:
-                print("Received empty response from OpenAI.")
-                return ""
+                create = self.client.completions.create
+            response = self.rate_limiter.call(lambda: create(**params), self._estimate_tokens(prompt, params))
+            self._record_usage(response.usage)
+            return self._parse_openai_choices(endpoint, response)
         except Exception as e:
             print(f"OpenAI API error: {e}")
+            if is_retryable_error(e):
+                # Throttling that outlived the retries is not a model answer
+                raise
             # Return the error message for visibility
-            return f"Error: {e}"
+            return [f"Error: {e}"] * n
+
+    async def _agenerate_openai_responses(self, prompt, n, **kwargs):
+        """
+        Async counterpart of _generate_openai_responses.
+        """
+        try:
+            if n > 1:
+                kwargs['n'] = n
+            endpoint, params = self._openai_request(prompt, kwargs)
+            if endpoint == 'chat':
+                create = self.async_client.chat.completions.create
+            else:
+                create = self.async_client.completions.create
+            response = await self.rate_limiter.acall(lambda: create(**params), self._estimate_tokens(prompt, params))
+            self._record_usage(response.usage)
+            return self._parse_openai_choices(endpoint, response)
+        except Exception as e:
+            print(f"OpenAI API error: {e}")
+            if is_retryable_error(e):
+                raise
+            return [f"Error: {e}"] * n
+
+    def _anthropic_request(self, prompt, kwargs):
+        """
+        Build the parameters for an Anthropic Messages API call.
+        """
+        # Prepare parameters
+        max_tokens = kwargs.pop('max_tokens', 256)
+        temperature = kwargs.pop('temperature', 1.0)
+        prefix = self._cache_prefix(prompt, kwargs)
+
+        # Define the message structure for Anthropic's Messages API
+        messages = [
+            {"role": "user", "content": self._anthropic_content(prompt, prefix)}
+        ]
+
+        return dict(
+            model=self.model_name,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            **kwargs  # Remaining kwargs
+        )
+
+    def _anthropic_content(self, prompt, prefix):
+        """
+        Message content with a cache breakpoint after the static prefix.
+        Prefixes shorter than the model's minimum cacheable length are
+        simply not cached by the API.
+        """
+        if not self.prompt_caching or not prefix or not prefix.strip():
+            return prompt
+        rest = prompt[len(prefix):]
+        if not rest.strip():
+            # Whitespace-only text blocks are rejected, so keep it with the prefix
+            return [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+        return [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": rest}
+        ]
+
+    @staticmethod
+    def _parse_anthropic_response(response):
+        # Access the assistant's reply from 'response'
+        if isinstance(response.content, list):
+            return "\n".join([block.text for block in response.content]).strip()
+        else:
+            return response.content.strip()
 
     def _generate_anthropic_response(self, prompt, **kwargs):
         """
         Generate a response using Anthropic's Messages API.
         """
         try:
-            # Prepare parameters
-            max_tokens = kwargs.pop('max_tokens', 256)
-            temperature = kwargs.pop('temperature', 1.0)
-
-            # Define the message structure for Anthropic's Messages API
-            messages = [
-                {"role": "user", "content": prompt}
-            ]
-
-            response = self.client.messages.create(
-                model=self.model_name,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                **kwargs  # Remaining kwargs
-            )
-
-            # Access the assistant's reply from 'response'
-            if isinstance(response.content, list):
-                return "\n".join([block.text for block in response.content]).strip()
-            else:
-                return response.content.strip()
+            params = self._anthropic_request(prompt, kwargs)
+            response = self.rate_limiter.call(lambda: self.client.messages.create(**params),
+                                              self._estimate_tokens(prompt, params))
+            self._record_usage(response.usage)
+            return self._parse_anthropic_response(response)
+        except Exception as e:
+            print(f"Anthropic API error: {e}")
+            if is_retryable_error(e):
+                # Throttling that outlived the retries is not a model answer
+                raise
+            return ""
 
+    async def _agenerate_anthropic_response(self, prompt, **kwargs):
+        """
+        Generate a response using Anthropic's async client.
+        """
+        try:
+            params = self._anthropic_request(prompt, kwargs)
+            client = self.async_client
+            response = await self.rate_limiter.acall(lambda: client.messages.create(**params),
+                                                     self._estimate_tokens(prompt, params))
+            self._record_usage(response.usage)
+            return self._parse_anthropic_response(response)
         except Exception as e:
             print(f"Anthropic API error: {e}")
+            if is_retryable_error(e):
+                raise
             return ""
+
+    def generate_streaming_response(self, prompt, sample_index=None, should_stop=None, **kwargs):
+        """
+        Streaming counterpart of generate_response.
+
+        should_stop, if given, is called with the text received so far after
+        every chunk; once it returns True the generation is cancelled and the
+        partial text returned. Cancelled responses are not cached.
+        """
+        key = self._cache_key(prompt, sample_index, kwargs)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        pieces = []
+        aborted = False
+        stream = self.stream_response(prompt, **kwargs)
+        try:
+            for piece in stream:
+                pieces.append(piece)
+                if should_stop is not None and should_stop(''.join(pieces)):
+                    aborted = True
+                    break
+        except Exception as e:
+            return self._stream_error(e)
+        finally:
+            stream.close()  # Closes the HTTP stream, which stops the generation
+
+        response = ''.join(pieces).strip()
+        if aborted:
+            tracing.record('aborted_generations', 1)
+        else:
+            self._cache_store(key, response)
+        return response
+
+    async def agenerate_streaming_response(self, prompt, sample_index=None, should_stop=None, **kwargs):
+        """
+        Async counterpart of generate_streaming_response.
+        """
+        key = self._cache_key(prompt, sample_index, kwargs)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        pieces = []
+        aborted = False
+        stream = self.astream_response(prompt, **kwargs)
+        try:
+            async for piece in stream:
+                pieces.append(piece)
+                if should_stop is not None and should_stop(''.join(pieces)):
+                    aborted = True
+                    break
+        except Exception as e:
+            return self._stream_error(e)
+        finally:
+            await stream.aclose()
+
+        response = ''.join(pieces).strip()
+        if aborted:
+            tracing.record('aborted_generations', 1)
+        else:
+            self._cache_store(key, response)
+        return response
+
+    def _stream_error(self, error):
+        # Same contract as the non-streaming calls
+        if self.provider == 'openai':
+            print(f"OpenAI API error: {error}")
+        else:
+            print(f"Anthropic API error: {error}")
+        if is_retryable_error(error):
+            raise error
+        return f"Error: {error}" if self.provider == 'openai' else ""
+
+    def _stream_request(self, prompt, kwargs):
+        """
+        Build the create function and parameters of a streaming call.
+        """
+        if self.provider == 'openai':
+            endpoint, params = self._openai_request(prompt, kwargs)
+            # Usage is only reported on a stream's last chunk when asked for
+            params.update(stream=True, stream_options={'include_usage': True})
+            return endpoint, params
+        params = self._anthropic_request(prompt, kwargs)
+        params['stream'] = True
+        return 'messages', params
+
+    def _stream_create(self, client, endpoint):
+        if endpoint == 'chat':
+            return client.chat.completions.create
+        if endpoint == 'completions':
+            return client.completions.create
+        return client.messages.create
+
+    @classmethod
+    def _parse_stream_event(cls, event):
+        """
+        Return (text, usage) carried by one stream event, usage being the
+        (input, output, cache read, cache write) token counts it reports.
+        """
+        usage = getattr(event, 'usage', None)
+        if hasattr(event, 'choices'):  # OpenAI chunk
+            text = ''
+            if event.choices:
+                choice = event.choices[0]
+                delta = getattr(choice, 'delta', None)
+                text = (delta.content if delta is not None else choice.text) or ''
+            return text, cls._usage_counts(usage)
+        # Anthropic event: input and cache tokens come first, output tokens last
+        if event.type == 'message_start':
+            input_tokens, _, cache_read, cache_write = cls._usage_counts(event.message.usage)
+            return '', (input_tokens, 0, cache_read, cache_write)
+        if event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+            return event.delta.text, (0, 0, 0, 0)
+        if event.type == 'message_delta' and usage is not None:
+            return '', (0, usage.output_tokens or 0, 0, 0)
+        return '', (0, 0, 0, 0)
+
+    def _record_stream(self, sent_at, first_token_at, chunks, usage):
+        """
+        Record time to first token, output tokens/sec and usage of a finished
+        or cancelled stream. Cancelled streams report no usage, so their
+        output is counted in chunks (about one token each).
+        """
+        finished_at = time.perf_counter()
+        input_tokens, output_tokens, cache_read, cache_write = usage
+        output_tokens = output_tokens or chunks
+        if first_token_at is not None:
+            tracing.record_phase('ttft', first_token_at - sent_at)
+            tracing.record_phase('stream', finished_at - first_token_at)
+            if finished_at > first_token_at:
+                tracing.record('output_tokens_per_sec', output_tokens / (finished_at - first_token_at))
+        self._add_usage(input_tokens, output_tokens, cache_read, cache_write)
+
+    def stream_response(self, prompt, **kwargs):
+        """
+        Yield the response text in pieces as the provider streams it.
+
+        Time to first token is measured from the attempt that succeeded, so
+        rate limiting and retries are not counted in it. The stream holds a
+        concurrency slot until it ends or is closed; closing the generator
+        early cancels the generation.
+        """
+        endpoint, params = self._stream_request(prompt, kwargs)
+        create = self._stream_create(self.client, endpoint)
+        sent_at = None
+
+        def open_stream():
+            nonlocal sent_at
+            sent_at = time.perf_counter()
+            return create(**params)
+
+        stream = self.rate_limiter.call(open_stream, self._estimate_tokens(prompt, params), keep_slot=True)
+        first_token_at = None
+        chunks = 0
+        usage = (0, 0, 0, 0)
+        throttled = False
+        try:
+            for event in stream:
+                text, event_usage = self._parse_stream_event(event)
+                usage = tuple(map(sum, zip(usage, event_usage)))
+                if text:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunks += 1
+                    yield text
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            try:
+                stream.close()
+            finally:
+                self.rate_limiter.concurrency.release(throttled=throttled)
+                self._record_stream(sent_at, first_token_at, chunks, usage)
+
+    async def astream_response(self, prompt, **kwargs):
+        """
+        Async counterpart of stream_response.
+        """
+        endpoint, params = self._stream_request(prompt, kwargs)
+        create = self._stream_create(self.async_client, endpoint)
+        sent_at = None
+
+        def open_stream():
+            nonlocal sent_at
+            sent_at = time.perf_counter()
+            return create(**params)
+
+        stream = await self.rate_limiter.acall(open_stream, self._estimate_tokens(prompt, params), keep_slot=True)
+        first_token_at = None
+        chunks = 0
+        usage = (0, 0, 0, 0)
+        throttled = False
+        try:
+            async for event in stream:
+                text, event_usage = self._parse_stream_event(event)
+                usage = tuple(map(sum, zip(usage, event_usage)))
+                if text:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunks += 1
+                    yield text
+        except Exception as e:
+            throttled = is_throttle_error(e)
+            raise
+        finally:
+            try:
+                await stream.close()
+            finally:
+                self.rate_limiter.concurrency.release(throttled=throttled)
+                self._record_stream(sent_at, first_token_at, chunks, usage)
+
+    def submit_batches(self, requests):
+        """
+        Submit (custom_id, prompt, kwargs) requests to the provider's batch API,
+        split into as many jobs as the provider's batch size limit requires.
+        Returns the list of batch IDs.
+        """
+        limit = BATCH_LIMITS[self.provider]
+        return [self.submit_batch(requests[i:i + limit]) for i in range(0, len(requests), limit)]
+
+    def submit_batch(self, requests):
+        """
+        Submit one batch job and return its ID.
+        """
+        if self.provider == 'openai':
+            lines = []
+            for custom_id, prompt, kwargs in requests:
+                endpoint, params = self._openai_request(prompt, dict(kwargs))
+                url = '/v1/chat/completions' if endpoint == 'chat' else '/v1/completions'
+                lines.append(json.dumps({'custom_id': custom_id, 'method': 'POST', 'url': url, 'body': params}))
+            # OpenAI batches are uploaded as a JSONL file, one request per line
+            batch_file = self.client.files.create(
+                file=('batch.jsonl', '\n'.join(lines).encode('utf-8')),
+                purpose='batch'
+            )
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint=url,
+                completion_window='24h'
+            )
+        else:
+            batch = self.client.messages.batches.create(requests=[
+                {'custom_id': custom_id, 'params': self._anthropic_request(prompt, dict(kwargs))}
+                for custom_id, prompt, kwargs in requests
+            ])
+        return batch.id
+
+    def get_batch_progress(self, batch_id):
+        """
+        Return (finished, processed_count, total_count) for a batch job.
+        """
+        if self.provider == 'openai':
+            batch = self.client.batches.retrieve(batch_id)
+            counts = batch.request_counts
+            finished = batch.status in ('completed', 'failed', 'expired', 'cancelled')
+            if counts is None:
+                return finished, 0, 0
+            return finished, counts.completed + counts.failed, counts.total
+        batch = self.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        processed = counts.succeeded + counts.errored + counts.canceled + counts.expired
+        return batch.processing_status == 'ended', processed, processed + counts.processing
+
+    def cancel_batch(self, batch_id):
+        """
+        Ask the provider to cancel a batch job. It finishes once cancelled,
+        keeping the results of requests already processed.
+        """
+        if self.provider == 'openai':
+            self.client.batches.cancel(batch_id)
+        else:
+            self.client.messages.batches.cancel(batch_id)
+
+    def iter_batch_results(self, batch_id):
+        """
+        Stream (custom_id, response) pairs from a finished batch job.
+
+        Requests that failed inside the batch yield a response of None; a
+        batch that ended without any results raises RuntimeError.
+        """
+        if self.provider == 'openai':
+            batch = self.client.batches.retrieve(batch_id)
+            if not batch.output_file_id and not batch.error_file_id:
+                errors = '; '.join(error.message or error.code for error in (batch.errors.data or [])) \
+                    if batch.errors else ''
+                raise RuntimeError(f"OpenAI batch {batch_id} {batch.status} without results"
+                                   + (f": {errors}" if errors else ''))
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if not file_id:
+                    continue
+                for line in self.client.files.content(file_id).iter_lines():
+                    if not line.strip():
+                        continue
+                    yield self._parse_openai_batch_line(json.loads(line))
+        else:
+            for entry in self.client.messages.batches.results(batch_id):
+                if entry.result.type == 'succeeded':
+                    yield entry.custom_id, self._parse_anthropic_response(entry.result.message)
+                else:
+                    print(f"Anthropic batch request {entry.custom_id} {entry.result.type}")
+                    yield entry.custom_id, None
+
+    @staticmethod
+    def _parse_openai_batch_line(line):
+        custom_id = line.get('custom_id')
+        response = line.get('response') or {}
+        if line.get('error') or response.get('status_code') != 200:
+            print(f"OpenAI batch request {custom_id} failed: {line.get('error') or response.get('body')}")
+            return custom_id, None
+        choice = response['body']['choices'][0]
+        if 'message' in choice:
+            return custom_id, (choice['message'].get('content') or '').strip()
+        return custom_id, choice.get('text', '').strip()
@@ -0,0 +1,329 @@
+# planner.py
+
+import math
+from functools import lru_cache
+
+# Default (requests/min, tokens/min) per model, at the providers' entry usage
+# tiers; pass rpm/tpm for an organization's actual limits. Keys match model
+# names by prefix, so dated snapshots share their family's entry.
+MODEL_LIMITS = {
+    ('openai', 'gpt-4.5-preview'): (1000, 125000),
+    ('openai', 'o1-mini'): (500, 200000),
+    ('openai', 'o1-preview'): (500, 30000),
+    ('openai', 'o1'): (500, 30000),
+    ('openai', 'o3-mini'): (1000, 100000),
+    ('openai', 'gpt-4o-mini'): (500, 200000),
+    ('openai', 'gpt-4o'): (500, 30000),
+    ('openai', 'gpt-4-turbo'): (500, 30000),
+    ('openai', 'gpt-4'): (500, 10000),
+    ('openai', 'gpt-3.5-turbo'): (3500, 200000),
+    ('anthropic', 'claude-3-7-sonnet'): (50, 28000),
+    ('anthropic', 'claude-3-5-sonnet'): (50, 48000),
+    ('anthropic', 'claude-3-5-haiku'): (50, 60000),
+}
+# USD per million (input, output) tokens
+MODEL_PRICES = {
+    ('openai', 'gpt-4.5-preview'): (75.00, 150.00),
+    ('openai', 'o1-mini'): (1.10, 4.40),
+    ('openai', 'o1-preview'): (15.00, 60.00),
+    ('openai', 'o1'): (15.00, 60.00),
+    ('openai', 'o3-mini'): (1.10, 4.40),
+    ('openai', 'gpt-4o-mini'): (0.15, 0.60),
+    ('openai', 'gpt-4o'): (2.50, 10.00),
+    ('openai', 'gpt-4-turbo'): (10.00, 30.00),
+    ('openai', 'gpt-4'): (30.00, 60.00),
+    ('openai', 'gpt-3.5-turbo'): (0.50, 1.50),
+    ('anthropic', 'claude-3-7-sonnet'): (3.00, 15.00),
+    ('anthropic', 'claude-3-5-sonnet'): (3.00, 15.00),
+    ('anthropic', 'claude-3-5-haiku'): (0.80, 4.00),
+}
+BATCH_DISCOUNT = 0.5  # Batch API price relative to online requests
+CHARS_PER_TOKEN = 4  # Token estimate when no tokenizer is available
+REQUEST_OVERHEAD_TOKENS = 7  # Chat formatting around a single user message
+JUDGE_OUTPUT_TOKENS = 50  # Verdict and brief explanation, per judged response
+# Request latency model when none is measured: fixed overhead plus decoding time
+BASE_LATENCY = 0.6
+OUTPUT_TOKENS_PER_SECOND = 50.0
+MAX_CONCURRENCY = 100
+DEFAULT_MAX_TOKENS = 256  # Planned output when a run sets no max_tokens
+# Relative departure from the plan worth pointing out
+PLAN_TOLERANCE = 0.25
+TOKEN_FIELDS = ('target_input_tokens', 'target_output_tokens', 'judge_input_tokens', 'judge_output_tokens')
+
+def _lookup(table, provider, model_name):
+    # Longest matching prefix, so 'gpt-4o-mini' is not read as 'gpt-4o'
+    provider = provider.lower()
+    matches = [key for key in table if key[0] == provider and model_name.startswith(key[1])]
+    return table[max(matches, key=lambda key: len(key[1]))] if matches else None
+
+def model_limits(provider, model_name):
+    """
+    Default (rpm, tpm) for a model, or (None, None) when it is not listed.
+    """
+    return _lookup(MODEL_LIMITS, provider, model_name) or (None, None)
+
+def estimate_cost(provider, model_name, input_tokens, output_tokens, batch=False):
+    """
+    USD cost of the tokens at the model's list price, or None when it is not listed.
+    """
+    prices = _lookup(MODEL_PRICES, provider, model_name)
+    if prices is None:
+        return None
+    cost = (input_tokens * prices[0] + output_tokens * prices[1]) / 1e6
+    return cost * BATCH_DISCOUNT if batch else cost
+
+@lru_cache(maxsize=None)
+def _encoding(model_name):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # Models tiktoken does not know, other providers' included, are
+            # approximated with the current OpenAI encoding
+            return tiktoken.get_encoding('o200k_base')
+    except Exception as e:
+        # The encoding is downloaded once, then read from tiktoken's local cache
+        print(f"Error loading tokenizer for {model_name}: {e}")
+        return None
+
+def has_tokenizer(model_name):
+    return _encoding(model_name) is not None
+
+@lru_cache(maxsize=1024)
+def count_tokens(text, model_name='gpt-4o'):
+    """
+    Tokens in text: tiktoken's count for the model when tiktoken is
+    installed, about one per CHARS_PER_TOKEN characters otherwise. Counts
+    are memoized, so re-planning with the same prompt does not re-tokenize it.
+    """
+    encoding = _encoding(model_name)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def request_latency(output_tokens):
+    """
+    Expected seconds per request generating up to output_tokens.
+    """
+    return BASE_LATENCY + output_tokens / OUTPUT_TOKENS_PER_SECOND
+
+def _judge_prompt(evaluator, batch_size):
+    """
+    A judge call's prompt without the responses, which are counted at
+    max_tokens each. A custom prompt that cannot be formatted (a literal
+    brace, say) is counted as written, next to the expected output.
+    """
+    try:
+        if batch_size > 1:
+            return evaluator.build_batch_evaluation_prompt([''] * batch_size)
+        return evaluator.build_evaluation_prompt('')
+    except (KeyError, IndexError, ValueError):
+        return f"{evaluator.evaluator_prompt}\n{evaluator.expected_output}"
+
+def plan_run(provider, model_name, prompt, num_trials, max_tokens, samples_per_request=1, evaluator=None,
+             judge_provider=None, judge_model_name=None, rpm=None, tpm=None, judge_rpm=None, judge_tpm=None,
+             latency=None, max_concurrency=MAX_CONCURRENCY, batch=False):
+    """
+    Pre-flight estimate of a run's tokens, cost, concurrency and duration.
+
+    Output tokens are planned at max_tokens per sample, which is also what
+    providers reserve against tokens/min limits. With an evaluator whose
+    evaluation_method is 'llm', judge calls (judge_batch_size responses
+    each) are included. rpm/tpm default to the model's MODEL_LIMITS entry;
+    the trial rate is the lowest that every model's limits allow, and the
+    concurrency is the number of requests that must be in flight, at
+    `latency` seconds each (estimated from max_tokens by default), to reach
+    it. A judge that is the target model shares its limits.
+
+    Returns a JSON-serializable dict; with batch=True the cost is at Batch
+    API prices and concurrency does not apply.
+    """
+    provider = provider.lower()
+    samples_per_request = max(1, samples_per_request)
+    requests = math.ceil(num_trials / samples_per_request)
+    prompt_tokens = count_tokens(prompt, model_name) + REQUEST_OVERHEAD_TOKENS
+    plan = {
+        'provider': provider,
+        'model_name': model_name,
+        'num_trials': num_trials,
+        'max_tokens': max_tokens,
+        'tokenizer': 'tiktoken' if has_tokenizer(model_name) else 'estimate',
+        'prompt_tokens': prompt_tokens,
+        'requests': requests,
+        'target_input_tokens': requests * prompt_tokens,
+        'target_output_tokens': num_trials * max_tokens,
+        'judge_provider': None,
+        'judge_model_name': None,
+        'judge_calls': 0,
+        'judge_input_tokens': 0,
+        'judge_output_tokens': 0,
+    }
+
+    judged = evaluator is not None and evaluator.evaluation_method == 'llm' and judge_model_name
+    if judged:
+        judge_provider = judge_provider.lower()
+        batch_size = max(1, evaluator.judge_batch_size)
+        judge_prompt = _judge_prompt(evaluator, batch_size)
+        plan['judge_provider'] = judge_provider
+        plan['judge_model_name'] = judge_model_name
+        plan['judge_calls'] = math.ceil(num_trials / batch_size)
+        plan['judge_input_tokens'] = (plan['judge_calls'] * (count_tokens(judge_prompt, judge_model_name)
+                                                             + REQUEST_OVERHEAD_TOKENS)
+                                      + num_trials * max_tokens)
+        plan['judge_output_tokens'] = num_trials * JUDGE_OUTPUT_TOKENS
+
+    target_cost = estimate_cost(provider, model_name, plan['target_input_tokens'], plan['target_output_tokens'], batch)
+    judge_cost = 0.0
+    if judged:
+        judge_cost = estimate_cost(judge_provider, judge_model_name, plan['judge_input_tokens'],
+                                   plan['judge_output_tokens'], batch)
+    plan['cost'] = None if target_cost is None or judge_cost is None else target_cost + judge_cost
+
+    default_rpm, default_tpm = model_limits(provider, model_name)
+    plan['rpm'] = rpm or default_rpm
+    plan['tpm'] = tpm or default_tpm
+    # Requests and tokens per trial drawn from each model's limits
+    budgets = {(provider, model_name): {
+        'rpm': plan['rpm'], 'tpm': plan['tpm'], 'requests': requests / num_trials,
+        'tokens': (plan['target_input_tokens'] + plan['target_output_tokens']) / num_trials,
+    }}
+    if judged:
+        default_rpm, default_tpm = model_limits(judge_provider, judge_model_name)
+        plan['judge_rpm'] = judge_rpm or default_rpm
+        plan['judge_tpm'] = judge_tpm or default_tpm
+        budget = budgets.setdefault((judge_provider, judge_model_name), {
+            'rpm': plan['judge_rpm'], 'tpm': plan['judge_tpm'], 'requests': 0.0, 'tokens': 0.0})
+        budget['requests'] += plan['judge_calls'] / num_trials
+        budget['tokens'] += (plan['judge_input_tokens'] + plan['judge_output_tokens']) / num_trials
+
+    # Highest trials/sec every model's limits allow, and which limit sets it
+    trial_rate = None
+    plan['bottleneck'] = None
+    for (budget_provider, budget_model), budget in budgets.items():
+        for limit, per_trial, label in (('rpm', budget['requests'], 'requests/min'),
+                                        ('tpm', budget['tokens'], 'tokens/min')):
+            if budget[limit] and per_trial:
+                rate = budget[limit] / 60.0 / per_trial
+                if trial_rate is None or rate < trial_rate:
+                    trial_rate = rate
+                    plan['bottleneck'] = f'{budget_provider}/{budget_model} {label}'
+
+    if batch:
+        plan.update(latency=None, concurrency=None, trials_per_second=None, duration_seconds=None)
+        return plan
+    if latency is None:
+        latency = request_latency(max_tokens * samples_per_request)
+        if judged and evaluator.judge_batch_size <= 1:
+            # Each trial's worker also waits for its judge call
+            latency += request_latency(JUDGE_OUTPUT_TOKENS)
+    plan['latency'] = latency
+    requests_per_trial = requests / num_trials
+    if trial_rate is None:
+        concurrency = max_concurrency
+    else:
+        concurrency = math.ceil(trial_rate * requests_per_trial * latency)
+    concurrency = max(1, min(concurrency, max_concurrency, requests))
+    if trial_rate is None or concurrency / latency / requests_per_trial < trial_rate:
+        trial_rate = concurrency / latency / requests_per_trial
+        plan['bottleneck'] = 'concurrency'
+    plan['concurrency'] = concurrency
+    plan['trials_per_second'] = trial_rate
+    plan['duration_seconds'] = num_trials / trial_rate
+    return plan
+
+def plan_trial_manager(trial_manager, batch=False):
+    """
+    plan_run for a configured TrialManager, at its models' configured rate limits.
+    """
+    model_manager = trial_manager.model_manager
+    evaluator = trial_manager.evaluator
+    judge = evaluator.evaluator_model_manager
+    kwargs = trial_manager.kwargs
+    return plan_run(
+        model_manager.provider, model_manager.model_name, trial_manager.prompt, trial_manager.num_trials,
+        kwargs.get('max_tokens') or kwargs.get('max_completion_tokens') or DEFAULT_MAX_TOKENS,
+        samples_per_request=trial_manager.samples_per_request,
+        evaluator=evaluator,
+        judge_provider=judge.provider if judge else None,
+        judge_model_name=judge.model_name if judge else None,
+        rpm=model_manager.rate_limiter.rpm,
+        tpm=model_manager.rate_limiter.tpm,
+        judge_rpm=judge.rate_limiter.rpm if judge else None,
+        judge_tpm=judge.rate_limiter.tpm if judge else None,
+        batch=batch
+    )
+
+def usage_from_trials(trials):
+    """
+    Target token usage summed over results rows, with the number of trials.
+    Rows of one multi-sample request each carry the whole request's usage
+    under a shared trace_id, so it is counted once.
+    """
+    usage = dict.fromkeys(TOKEN_FIELDS[:2], 0)
+    count = 0
+    seen_traces = set()
+    for trial in trials:
+        count += 1
+        trace_id = trial.get('trace_id')
+        if trace_id is not None:
+            if trace_id in seen_traces:
+                continue
+            seen_traces.add(trace_id)
+        for name in usage:
+            usage[name] += trial.get(name) or 0
+    return usage, count
+
+def compare_to_plan(plan, usage, completed_trials, elapsed_seconds=None):
+    """
+    Actual usage of a run (in progress or finished) against its plan.
+
+    usage holds the token counts seen so far (target_* and, once known,
+    judge_*), over completed_trials trials. Each is projected to the full run
+    at the observed per-trial rate, next to the planned figure; notes point
+    out departures of more than PLAN_TOLERANCE and what they imply.
+    """
+    comparison = {'completed_trials': completed_trials, 'tokens': {}, 'notes': []}
+    if not completed_trials:
+        return comparison
+    num_trials = plan['num_trials']
+    for name in TOKEN_FIELDS:
+        if name not in usage or not plan[name]:
+            continue
+        comparison['tokens'][name] = {
+            'planned': plan[name],
+            'projected': round(usage[name] / completed_trials * num_trials),
+        }
+    projected = {name: values['projected'] for name, values in comparison['tokens'].items()}
+
+    # Judge tokens are only known once the run has finished; until then the plan stands
+    target_cost = estimate_cost(plan['provider'], plan['model_name'],
+                                projected.get('target_input_tokens', plan['target_input_tokens']),
+                                projected.get('target_output_tokens', plan['target_output_tokens']))
+    judge_cost = 0.0
+    if plan['judge_calls']:
+        judge_cost = estimate_cost(plan['judge_provider'], plan['judge_model_name'],
+                                   projected.get('judge_input_tokens', plan['judge_input_tokens']),
+                                   projected.get('judge_output_tokens', plan['judge_output_tokens']))
+    comparison['projected_cost'] = None if target_cost is None or judge_cost is None else target_cost + judge_cost
+
+    output = comparison['tokens'].get('target_output_tokens')
+    if output and output['projected'] < output['planned'] * (1 - PLAN_TOLERANCE):
+        used = output['projected'] / num_trials
+        comparison['notes'].append(
+            f"Responses average {used:.0f} of max_tokens {plan['max_tokens']} output tokens; a lower max_tokens "
+            f"frees tokens/min headroom for more concurrency")
+    for name, values in comparison['tokens'].items():
+        if values['projected'] > values['planned'] * (1 + PLAN_TOLERANCE):
+            comparison['notes'].append(f"{name} is running {values['projected'] / values['planned'] - 1:.0%} "
+                                       f"above plan")
+    if elapsed_seconds and plan.get('trials_per_second'):
+        comparison['trials_per_second'] = completed_trials / elapsed_seconds
+        if comparison['trials_per_second'] < plan['trials_per_second'] * (1 - PLAN_TOLERANCE):
+            comparison['notes'].append(
+                f"Running at {comparison['trials_per_second']:.2f} trials/s against the planned "
+                f"{plan['trials_per_second']:.2f}: requests are slower or more throttled than planned")
+    return comparison
@@ -0,0 +1,273 @@
+# rate_limiter.py
+
+import asyncio
+import collections
+import email.utils
+import random
+import threading
+import time
+import tracing
+
+# HTTP statuses worth retrying: throttling, overload and transient server errors
+THROTTLE_STATUSES = {429, 529}
+RETRYABLE_STATUSES = THROTTLE_STATUSES | {408, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {'APIConnectionError', 'APITimeoutError'}
+
+def status_code_of(error):
+    """
+    HTTP status of a provider SDK error, if it has one.
+    """
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status
+
+def is_throttle_error(error):
+    return status_code_of(error) in THROTTLE_STATUSES
+
+def is_retryable_error(error):
+    return status_code_of(error) in RETRYABLE_STATUSES or type(error).__name__ in RETRYABLE_ERRORS
+
+def retry_after_seconds(error):
+    """
+    Delay requested by the provider through Retry-After / retry-after-ms, or None.
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP-date form
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+
+    reserve() always succeeds and returns how long the caller must wait before
+    using the reservation, so the same bucket serves threads and coroutines.
+    """
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit: grows by one slot per limit's worth of successes
+    and halves (at most once per cooldown) when the provider throttles.
+    """
+    def __init__(self, max_limit=10000, min_limit=1, decrease_cooldown=1.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.decrease_cooldown = decrease_cooldown
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+        # (loop, future) of coroutines waiting in aacquire, oldest first
+        self.async_waiters = collections.deque()
+
+    def _free_slots(self):
+        return max(self.min_limit, int(self.limit)) - self.in_flight
+
+    def try_acquire(self):
+        with self.condition:
+            if self._free_slots() > 0:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self.condition:
+            while self._free_slots() <= 0:
+                self.condition.wait()
+            self.in_flight += 1
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self._free_slots() > 0:
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self.async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self.condition:
+                    try:
+                        self.async_waiters.remove(waiter)
+                    except ValueError:
+                        # Already woken: hand the wake-up to the next waiter
+                        self._wake_async_waiters()
+                raise
+
+    def _wake_async_waiters(self):
+        # Called with the condition held; wakes one waiter per free slot, on its own loop
+        for _ in range(min(self._free_slots(), len(self.async_waiters))):
+            loop, future = self.async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # Its loop has closed
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    # Halve relative to what was actually in flight, not the ceiling
+                    self.limit = max(self.min_limit, min(self.limit, self.in_flight + 1) / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            self.condition.notify_all()
+            self._wake_async_waiters()
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    """
+    Requests/min and tokens/min limits plus adaptive concurrency for one
+    (provider, model). Calls are retried with jittered exponential backoff,
+    honouring Retry-After, when the provider throttles or fails transiently.
+    """
+    def __init__(self, rpm=None, tpm=None, max_concurrency=10000, max_retries=6,
+                 backoff_base=1.0, backoff_cap=60.0):
+        self.concurrency = AdaptiveConcurrency(max_limit=max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.configure(rpm=rpm, tpm=tpm)
+
+    def configure(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+
+    def _pacing_delay(self, estimated_tokens):
+        delay = 0.0
+        if self.request_bucket:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket:
+            delay = max(delay, self.token_bucket.reserve(estimated_tokens))
+        return delay
+
+    def _backoff_delay(self, attempt, error):
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def call(self, fn, estimated_tokens=0, keep_slot=False):
+        """
+        Run fn() under the limits, retrying retryable provider errors.
+
+        With keep_slot the concurrency slot stays taken once fn() succeeds,
+        for a result (such as a stream) still using the connection; the
+        caller releases it with concurrency.release().
+        """
+        attempt = 0
+        while True:
+            with tracing.span('rate_limit_wait'):
+                delay = self._pacing_delay(estimated_tokens)
+                if delay:
+                    time.sleep(delay)
+                self.concurrency.acquire()
+            try:
+                with tracing.span('network', attempt=attempt):
+                    result = fn()
+            except Exception as e:
+                self.concurrency.release(throttled=is_throttle_error(e))
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                tracing.record('retries', 1)
+                with tracing.span('backoff', status=status_code_of(e) or 0):
+                    time.sleep(self._backoff_delay(attempt, e))
+                attempt += 1
+                continue
+            if not keep_slot:
+                self.concurrency.release()
+            return result
+
+    async def acall(self, fn, estimated_tokens=0, keep_slot=False):
+        """
+        Async counterpart of call; fn() must return an awaitable.
+        """
+        attempt = 0
+        while True:
+            with tracing.span('rate_limit_wait'):
+                delay = self._pacing_delay(estimated_tokens)
+                if delay:
+                    await asyncio.sleep(delay)
+                await self.concurrency.aacquire()
+            try:
+                with tracing.span('network', attempt=attempt):
+                    result = await fn()
+            except asyncio.CancelledError:
+                self.concurrency.release()
+                raise
+            except Exception as e:
+                self.concurrency.release(throttled=is_throttle_error(e))
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    raise
+                tracing.record('retries', 1)
+                with tracing.span('backoff', status=status_code_of(e) or 0):
+                    await asyncio.sleep(self._backoff_delay(attempt, e))
+                attempt += 1
+                continue
+            if not keep_slot:
+                self.concurrency.release()
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider, model_name, rpm=None, tpm=None):
+    """
+    Process-wide limiter shared by every ModelManager for (provider, model).
+
+    Passing rpm/tpm (re)configures the shared limits.
+    """
+    key = (provider.lower(), model_name)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter(rpm=rpm, tpm=tpm)
+        elif (rpm or tpm) and (rpm, tpm) != (limiter.rpm, limiter.tpm):
+            limiter.configure(rpm=rpm, tpm=tpm)
+        return limiter
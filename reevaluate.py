@@ -0,0 +1,114 @@
+# reevaluate.py
+
+import asyncio
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from evaluator import score_chunk
+from metrics_logger import MetricsLogger
+
+def load_trials(results_path):
+    """
+    Yield the trial rows of a JSONL results file written by MetricsLogger, or
+    of a results CSV, stopping at the summary block appended after the trials.
+    """
+    if results_path.endswith('.jsonl'):
+        with open(results_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    csv.field_size_limit(sys.maxsize)
+    with open(results_path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            # The summary block starts with a marker line, read into the first column
+            if (next(iter(row.values()), None) or '').startswith('# Summary'):
+                break
+            if row.get('response') is None:
+                continue
+            yield row
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+async def _ascore(evaluator, responses, max_concurrency):
+    if evaluator.judge_batch_size > 1:
+        # One judge call per judge_batch_size distinct responses of the chunk
+        return await evaluator.aevaluate_many(responses)
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def score(response):
+        async with semaphore:
+            is_correct = await evaluator.aevaluate(response)
+            # Collect the log before yielding to another judge call
+            log_message = '\n'.join(evaluator.log_messages)
+            evaluator.log_messages.clear()
+            return is_correct, log_message
+
+    return await asyncio.gather(*(score(response) for response in responses))
+
+def _score_stream(evaluator, trial_chunks, max_workers):
+    """
+    Yield (trial_chunk, scores) pairs in order, keeping only a bounded number
+    of chunks in flight so memory does not grow with the size of the run.
+    """
+    if evaluator.evaluation_method == 'llm':
+        for chunk in trial_chunks:
+            responses = [trial['response'] for trial in chunk]
+            yield chunk, asyncio.run(_ascore(evaluator, responses, max_workers or 20))
+        return
+
+    def merged(chunk, known, missing, future):
+        verdicts = evaluator.remember(dict(zip(missing, future.result())))
+        verdicts.update(known)
+        return chunk, [verdicts[trial['response'].strip()] for trial in chunk]
+
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for chunk in trial_chunks:
+            # Worker processes start with empty memos, so reuse verdicts here
+            known, missing = evaluator.lookup_memo([trial['response'].strip() for trial in chunk])
+            in_flight.append((chunk, known, missing, executor.submit(score_chunk, evaluator, missing)))
+            if len(in_flight) >= 2 * max_workers:
+                yield merged(*in_flight.popleft())
+        while in_flight:
+            yield merged(*in_flight.popleft())
+
+def reevaluate(results_path, evaluator, output_path=None, max_workers=None, chunk_size=256):
+    """
+    Re-score the responses of a previous run with a new Evaluator, without
+    calling the target model.
+
+    Responses are streamed from the results file in chunks. Algorithmic
+    evaluation is spread over a process pool; LLM evaluation runs up to
+    max_workers judge calls concurrently on an event loop. Returns a
+    MetricsLogger holding the new scored result set, streamed to output_path
+    (JSONL) when given.
+    """
+    metrics_logger = MetricsLogger(path=output_path)
+    trial_chunks = _chunks(load_trials(results_path), chunk_size)
+    for chunk, scores in _score_stream(evaluator, trial_chunks, max_workers):
+        for trial, (is_correct, log_message) in zip(chunk, scores):
+            response_time = trial.get('response_time')
+            metrics_logger.log_trial({
+                # Rows keep the run and trial they were generated by
+                **{key: trial[key] for key in ('run_id', 'trial_index') if key in trial},
+                'correct': is_correct,
+                'response_time': float(response_time) if response_time not in (None, '') else None,
+                'response': trial['response'],
+                'expected_output': evaluator.expected_output,
+                'evaluation_log': log_message
+            })
+    metrics_logger.close()
+    return metrics_logger
@@ -0,0 +1,126 @@
+# response_cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of model responses stored in SQLite.
+
+    Entries are keyed on a hash of (provider, model, prompt, kwargs, sample
+    index) and record their size and age. Entries older than `ttl` seconds are
+    dropped on read, and the least recently used entries are evicted once the
+    cache grows beyond `max_bytes`.
+    """
+    def __init__(self, path='response_cache.sqlite', max_bytes=512 * 1024 * 1024, ttl=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def make_key(provider, model_name, prompt, kwargs, sample_index=None):
+        payload = json.dumps({
+            'provider': provider,
+            'model': model_name,
+            'prompt': prompt,
+            'kwargs': kwargs,
+            'sample_index': sample_index,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT response, size, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, size, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self.conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.conn.commit()
+                self.total_bytes -= size
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, response, size, now, now)
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """
+        Drop expired entries, then least recently used ones until under max_bytes.
+        """
+        if self.ttl is not None:
+            self.conn.execute('DELETE FROM responses WHERE created_at < ?', (time.time() - self.ttl,))
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        cursor = self.conn.execute('SELECT key, size FROM responses ORDER BY accessed_at')
+        evicted = []
+        for key, size in cursor:
+            if self.total_bytes <= self.max_bytes:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return {'entries': entries, 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM responses')
+            self.conn.commit()
+            self.total_bytes = 0
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_response_cache(path='response_cache.sqlite', **kwargs):
+    """
+    Process-wide cache instance for `path`, shared across ModelManagers.
+    """
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(path, **kwargs)
+        return _caches[path]
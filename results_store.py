@@ -0,0 +1,274 @@
+# results_store.py
+
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from itertools import count, islice
+from urllib.parse import quote, unquote
+from metrics_logger import wilson_interval
+from tracing import COUNTERS, PHASES
+
+# Per-trial timings and counters kept from the results rows (ttft only when streaming)
+TIMING_FIELDS = tuple(f'{phase}_time' for phase in PHASES) + ('ttft_time',)
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+# Rows per Parquet file written for a run
+CHUNK_ROWS = 100000
+# A partition holding more files than this is merged into one file
+COMPACT_THRESHOLD = 8
+# Seconds after which a compaction lock left by a dead process is ignored
+LOCK_TIMEOUT = 600
+
+def _schema():
+    import pyarrow as pa
+    return pa.schema(
+        [('run_id', pa.string()), ('trial_index', pa.int64()), ('started_at', pa.timestamp('ms', tz='UTC')),
+         ('username', pa.string()), ('provider', pa.string()), ('model_name', pa.string()),
+         ('prompt_hash', pa.string()), ('task_type', pa.string()), ('evaluation_method', pa.string()),
+         ('temperature', pa.float64()), ('correct', pa.bool_()), ('response_time', pa.float64())]
+        + [(name, pa.float64()) for name in TIMING_FIELDS]
+        + [(name, pa.int64()) for name in COUNTERS]
+        + [('response', pa.string())]
+    )
+
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([('date', pa.string()), ('model', pa.string())]), flavor='hive')
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+class ResultsStore:
+    """
+    Trials of every run, kept in one Parquet dataset for queries across runs.
+
+    The dataset is Hive-partitioned by date and model
+    (root/date=YYYY-MM-DD/model=provider%2Fmodel_name/), and each row carries
+    its run_id, trial_index, run start time, user and prompt hash next to
+    the trial's outcome, latency, phase timings and token counts. Each run
+    is written as its own files; once a partition holds more than
+    COMPACT_THRESHOLD files they are merged, so queries over thousands of
+    runs read a handful of files. Queries prune partitions and columns and
+    aggregate with Arrow's vectorized group-by.
+
+    Needs pyarrow, which is imported on first use.
+    """
+    def __init__(self, root='results_store'):
+        self.root = root
+
+    def add_run(self, trials, run_id, provider, model_name, prompt, task_type, evaluation_method,
+                temperature=None, username=None, started_at=None):
+        """
+        Store a run's trials (results rows as logged by MetricsLogger),
+        replacing any trials stored before under the same run_id. Returns
+        the number of trials stored.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        started_at = started_at or time.time()
+        started = datetime.fromtimestamp(started_at, timezone.utc)
+        model = f'{provider.lower()}/{model_name}'
+        partition = os.path.join(self.root, f'date={started:%Y-%m-%d}', f'model={quote(model, safe="")}')
+        os.makedirs(partition, exist_ok=True)
+        self.remove_run(run_id, model)
+
+        schema = _schema()
+        run_fields = {
+            'run_id': run_id, 'started_at': started, 'username': username, 'provider': provider.lower(),
+            'model_name': model_name, 'prompt_hash': prompt_hash(prompt), 'task_type': task_type,
+            'evaluation_method': evaluation_method, 'temperature': temperature,
+        }
+        trials = iter(trials)
+        stored = 0
+        for chunk_index in count():
+            chunk = list(islice(trials, CHUNK_ROWS))
+            if not chunk:
+                break
+            columns = []
+            for field in schema:
+                if field.name in run_fields:
+                    values = [run_fields[field.name]] * len(chunk)
+                else:
+                    values = [trial.get(field.name) for trial in chunk]
+                columns.append(pa.array(values, type=field.type, from_pandas=True))
+            # Written under a hidden name, so readers never see a partial file
+            path = os.path.join(partition, f'run-{run_id}-{chunk_index}.parquet')
+            hidden = os.path.join(partition, f'_{os.path.basename(path)}')
+            pq.write_table(pa.Table.from_arrays(columns, schema=schema), hidden)
+            os.replace(hidden, path)
+            stored += len(chunk)
+        self._maybe_compact(partition)
+        return stored
+
+    def add_trial_manager(self, trial_manager, username=None, started_at=None):
+        """
+        Store the trials a TrialManager has logged, with its run's metadata.
+        """
+        model_manager = trial_manager.model_manager
+        evaluator = trial_manager.evaluator
+        # A resumed run's results file can also hold the trials of earlier runs
+        trials = (trial for trial in trial_manager.metrics_logger.iter_trials()
+                  if trial.get('run_id') == trial_manager.run_id)
+        return self.add_run(
+            trials, trial_manager.run_id, model_manager.provider,
+            model_manager.model_name, trial_manager.prompt, evaluator.task_type, evaluator.evaluation_method,
+            temperature=trial_manager.kwargs.get('temperature'), username=username, started_at=started_at
+        )
+
+    def remove_run(self, run_id, model=None):
+        """
+        Delete a run's trials, including those already merged into compacted
+        files; giving its model ('provider/model_name') limits the search.
+        """
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        model_dir = glob.escape(f'model={quote(model, safe="")}') if model else '*'
+        partitions = os.path.join(glob.escape(self.root), '*', model_dir)
+        for path in glob.glob(os.path.join(partitions, f'run-{glob.escape(run_id)}-*.parquet')):
+            os.remove(path)
+        for path in glob.glob(os.path.join(partitions, 'part-*.parquet')):
+            # Compacted files list their run ids in the footer, so most are skipped unread
+            metadata = pq.read_schema(path).metadata or {}
+            if run_id in json.loads(metadata.get(b'run_ids', b'[]')):
+                table = pq.read_table(path)
+                self._replace(os.path.dirname(path), [path], table.filter(pc.not_equal(table['run_id'], run_id)))
+
+    def _replace(self, partition, paths, table):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        name = f'part-{uuid.uuid4().hex}.parquet'
+        if table.num_rows:
+            run_ids = sorted(pc.unique(table['run_id']).to_pylist())
+            table = table.replace_schema_metadata({'run_ids': json.dumps(run_ids)})
+            pq.write_table(table, os.path.join(partition, f'_{name}'))
+            os.replace(os.path.join(partition, f'_{name}'), os.path.join(partition, name))
+        for path in paths:
+            os.remove(path)
+
+    @staticmethod
+    def _files(partition):
+        # Files still being written carry a leading underscore
+        paths = glob.glob(os.path.join(glob.escape(partition), '*.parquet'))
+        return sorted(path for path in paths if not os.path.basename(path).startswith('_'))
+
+    def _maybe_compact(self, partition):
+        if len(self._files(partition)) > COMPACT_THRESHOLD:
+            self.compact(partition)
+
+    def compact(self, partition=None):
+        """
+        Merge the files of a partition directory (all partitions by default)
+        into one. Partitions another process is compacting are skipped.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        partitions = [partition] if partition else glob.glob(os.path.join(glob.escape(self.root), '*', '*'))
+        for partition in partitions:
+            lock = os.path.join(partition, '_compact.lock')
+            try:
+                if time.time() - os.path.getmtime(lock) > LOCK_TIMEOUT:
+                    os.remove(lock)
+            except OSError:
+                pass
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL))
+            except FileExistsError:
+                continue
+            try:
+                paths = self._files(partition)
+                if len(paths) > 1:
+                    tables = [pq.read_table(path).replace_schema_metadata() for path in paths]
+                    self._replace(partition, paths, pa.concat_tables(tables))
+            finally:
+                os.remove(lock)
+
+    def models(self):
+        """
+        Models ('provider/model_name') with stored trials, read from the partition directories.
+        """
+        paths = glob.glob(os.path.join(glob.escape(self.root), 'date=*', 'model=*'))
+        return sorted({unquote(os.path.basename(path)[len('model='):]) for path in paths})
+
+    def query(self, columns=None, username=None, models=None, run_ids=None, prompt_hashes=None,
+              since=None, until=None):
+        """
+        Stored trials as an Arrow table, optionally restricted to some
+        columns and filtered by user, models ('provider/model_name'), runs,
+        prompt hashes and run start dates (since/until as 'YYYY-MM-DD',
+        inclusive). Filters on model and date only read the matching partitions.
+        """
+        import pyarrow.dataset as ds
+
+        if not os.path.isdir(self.root):
+            table = self._dataset_schema().empty_table()
+            return table.select(columns) if columns else table
+        dataset = ds.dataset(self.root, format='parquet', partitioning=_partitioning(), schema=self._dataset_schema())
+        conditions = []
+        if username is not None:
+            conditions.append(ds.field('username') == username)
+        if models:
+            conditions.append(ds.field('model').isin(list(models)))
+        if run_ids:
+            conditions.append(ds.field('run_id').isin(list(run_ids)))
+        if prompt_hashes:
+            conditions.append(ds.field('prompt_hash').isin(list(prompt_hashes)))
+        if since:
+            conditions.append(ds.field('date') >= str(since))
+        if until:
+            conditions.append(ds.field('date') <= str(until))
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return dataset.to_table(columns=columns, filter=expression)
+
+    @staticmethod
+    def _dataset_schema():
+        import pyarrow as pa
+        schema = _schema()
+        return pa.schema(list(schema) + [('date', pa.string()), ('model', pa.string())])
+
+    def summarize(self, group_by=('model',), confidence=0.95, **filters):
+        """
+        Per-group trial count, run count, success rate with its Wilson
+        interval, and mean and p50/p95/p99 response time (t-digest
+        estimates), as a pandas DataFrame. group_by takes any stored column,
+        'model' or 'date'; filters are those of query().
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        group_by = list(group_by)
+        table = self.query(columns=list(dict.fromkeys(group_by + ['run_id', 'correct', 'response_time'])), **filters)
+        table = table.append_column('success', pc.cast(table['correct'], pa.float64()))
+        grouped = table.group_by(group_by).aggregate([
+            ('success', 'count'),
+            ('success', 'sum'),
+            ('run_id', 'count_distinct'),
+            ('response_time', 'mean'),
+            ('response_time', 'tdigest', pc.TDigestOptions(q=list(LATENCY_QUANTILES))),
+        ]).to_pandas()
+
+        summary = grouped[group_by].copy()
+        summary['trials'] = grouped['success_count']
+        summary['runs'] = grouped['run_id_count_distinct']
+        summary['correct_count'] = grouped['success_sum'].fillna(0).astype(int)
+        summary['success_rate'] = summary['correct_count'] / summary['trials'].where(summary['trials'] > 0)
+        intervals = [wilson_interval(correct, total, confidence)
+                     for correct, total in zip(summary['correct_count'], summary['trials'])]
+        summary['success_rate_ci_low'] = [low for low, _ in intervals]
+        summary['success_rate_ci_high'] = [high for _, high in intervals]
+        summary['mean_response_time'] = grouped['response_time_mean']
+        for position, quantile in enumerate(LATENCY_QUANTILES):
+            summary[f'p{round(quantile * 100)}_response_time'] = [
+                values[position] if values is not None and len(values) > position else None
+                for values in grouped['response_time_tdigest']
+            ]
+        return summary.sort_values(group_by, ignore_index=True)
@@ -0,0 +1,128 @@
+# tests/test_batches.py
+# Batch API runs against the mock server's OpenAI and Anthropic batch endpoints
+
+import functools
+import os
+import threading
+import time
+import pytest
+from benchmarks.mock_server import start_mock_server
+from evaluator import Evaluator
+from model_manager import ModelManager
+from trial_manager import TrialManager
+
+PROVIDERS = [('openai', 'gpt-4o-mini'), ('anthropic', 'claude-3-5-haiku-latest')]
+
+@pytest.fixture
+def mock_server(request):
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_mock_server(latency=0.0, **kwargs)
+        servers.append(server)
+        return base_url
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def model_manager(provider, model_name, base_url):
+    # The OpenAI SDK expects the /v1 prefix in its base URL, the Anthropic SDK adds it
+    return ModelManager(model_name, 'sk-test', provider=provider,
+                        base_url=base_url + '/v1' if provider == 'openai' else base_url)
+
+def wait_for(model_manager, batch_id, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        finished, processed, total = model_manager.get_batch_progress(batch_id)
+        if finished or time.time() > deadline:
+            return finished, processed, total
+        time.sleep(0.05)
+
+@pytest.mark.parametrize('provider, model_name', PROVIDERS)
+def test_submit_poll_and_results(mock_server, provider, model_name):
+    base_url = mock_server(batch_duration=0.3, response_size=12)
+    manager = model_manager(provider, model_name, base_url)
+    requests = [(f'trial-{i}', 'Say hello', {'max_tokens': 16}) for i in range(5)]
+
+    [batch_id] = manager.submit_batches(requests)
+    assert manager.get_batch_progress(batch_id)[0] is False
+    assert wait_for(manager, batch_id) == (True, 5, 5)
+    results = dict(manager.iter_batch_results(batch_id))
+    assert results == {f'trial-{i}': 'lorem ipsum' for i in range(5)}
+
+@pytest.mark.parametrize('provider, model_name', PROVIDERS)
+def test_failed_requests_yield_none(mock_server, provider, model_name):
+    base_url = mock_server(failure_rate=1.0)
+    manager = model_manager(provider, model_name, base_url)
+    [batch_id] = manager.submit_batches([('trial-0', 'Say hello', {})])
+    assert wait_for(manager, batch_id)[0]
+    assert list(manager.iter_batch_results(batch_id)) == [('trial-0', None)]
+
+@pytest.mark.parametrize('provider, model_name', PROVIDERS)
+def test_run_batch_trials_records_every_trial(mock_server, tmp_path, provider, model_name):
+    base_url = mock_server(batch_duration=0.2, response_size=12)
+    trial_manager = TrialManager(model_manager(provider, model_name, base_url),
+                                 Evaluator('string_match', 'lorem ipsum'), num_trials=6, prompt='Say hello',
+                                 results_path=str(tmp_path / 'results.jsonl'))
+    trial_manager.run_batch_trials(poll_interval=0.05)
+    summary = trial_manager.metrics_logger.summary()
+    assert summary['total_trials'] == 6
+    assert summary['correct_count'] == 6
+
+@pytest.mark.parametrize('provider, model_name', PROVIDERS)
+@pytest.mark.parametrize('batch_status', ['failed', 'expired'])
+def test_batch_without_results_fails_the_run(mock_server, tmp_path, provider, model_name, batch_status):
+    base_url = mock_server(batch_status=batch_status)
+    trial_manager = TrialManager(model_manager(provider, model_name, base_url),
+                                 Evaluator('string_match', 'lorem ipsum'), num_trials=3, prompt='Say hello',
+                                 results_path=str(tmp_path / 'results.jsonl'))
+    with pytest.raises(RuntimeError, match='Batch|batch'):
+        trial_manager.run_batch_trials(poll_interval=0.05)
+    assert trial_manager.metrics_logger.summary()['total_trials'] == 0
+
+@pytest.mark.parametrize('provider, model_name', PROVIDERS)
+def test_resume_collects_submitted_batches(mock_server, tmp_path, provider, model_name, monkeypatch):
+    base_url = mock_server(batch_duration=0.2, response_size=12)
+    results_path = str(tmp_path / 'results.jsonl')
+
+    def new_trial_manager():
+        return TrialManager(model_manager(provider, model_name, base_url), Evaluator('string_match', 'lorem ipsum'),
+                            num_trials=4, prompt='Say hello', results_path=results_path, run_id='run-1')
+
+    # The first attempt dies while polling, after its batch was submitted
+    trial_manager = new_trial_manager()
+    monkeypatch.setattr(trial_manager.model_manager, 'get_batch_progress',
+                        lambda batch_id: (_ for _ in ()).throw(KeyboardInterrupt))
+    with pytest.raises(KeyboardInterrupt):
+        trial_manager.run_batch_trials(poll_interval=0.05)
+    assert os.path.exists(results_path + '.batches.json')
+
+    trial_manager = new_trial_manager()
+    monkeypatch.setattr(trial_manager.model_manager, 'submit_batches',
+                        lambda requests: pytest.fail("Resumed run submitted a new batch"))
+    monkeypatch.setattr(trial_manager, 'run_batch_trials',
+                        functools.partial(trial_manager.run_batch_trials, poll_interval=0.05))
+    trial_manager.resume(batch=True)
+    assert trial_manager.metrics_logger.summary()['total_trials'] == 4
+    assert not os.path.exists(results_path + '.batches.json')
+
+@pytest.mark.parametrize('provider, model_name', PROVIDERS)
+def test_stop_cancels_the_batch(mock_server, tmp_path, provider, model_name):
+    base_url = mock_server(batch_duration=60)
+    trial_manager = TrialManager(model_manager(provider, model_name, base_url),
+                                 Evaluator('string_match', 'lorem ipsum'), num_trials=3, prompt='Say hello',
+                                 results_path=str(tmp_path / 'results.jsonl'))
+    submitted = []
+    submit_batches = trial_manager.model_manager.submit_batches
+    trial_manager.model_manager.submit_batches = lambda requests: submitted.extend(submit_batches(requests)) or submitted
+
+    runner = threading.Thread(target=trial_manager.run_batch_trials, kwargs={'poll_interval': 30})
+    runner.start()
+    while not submitted:
+        time.sleep(0.01)
+    trial_manager.stop()
+    runner.join(timeout=5)
+    assert not runner.is_alive()
+    assert trial_manager.model_manager.get_batch_progress(submitted[0])[0]
+    assert trial_manager.metrics_logger.summary()['total_trials'] == 0
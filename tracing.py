@@ -0,0 +1,219 @@
+# tracing.py
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Trace of the trial running in the current thread / asyncio task
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+# (span_id, name) of the innermost open span
+_current_span = contextvars.ContextVar('current_span', default=None)
+# Names of the open spans, innermost last
+_span_names = contextvars.ContextVar('span_names', default=())
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+def add_hook(hook):
+    """
+    Register a callable that receives every finished span as a dict.
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+
+def remove_hook(hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+def _new_id(num_bytes):
+    return os.urandom(num_bytes).hex()
+
+# Reported for every trial, so results rows share the same columns
+PHASES = ('queue_wait', 'generation', 'client_setup', 'rate_limit_wait', 'network', 'backoff', 'evaluation')
+COUNTERS = ('retries', 'target_input_tokens', 'target_output_tokens', 'target_cache_read_tokens',
+            'target_cache_write_tokens')
+
+class TrialTrace:
+    """
+    Per-trial timings (seconds per phase) and counters such as token usage
+    and retries, accumulated by the spans opened while the trial runs.
+    """
+    def __init__(self, trial_indices):
+        self.trace_id = _new_id(16)
+        self.trial_indices = list(trial_indices)
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_record(self):
+        """
+        Flat fields to merge into the trial's results row. Trials served by
+        one multi-sample request share its trace_id, timings and counters.
+        """
+        record = {'trace_id': self.trace_id}
+        record.update({f'{name}_time': seconds for name, seconds in self.phases.items()})
+        record.update(self.counters)
+        return record
+
+def current_trace():
+    return _current_trace.get()
+
+def _emit(name, span_id, parent_id, trace_id, start_ns, end_ns, attributes):
+    if not _hooks:
+        return
+    span = {
+        'traceId': trace_id,
+        'spanId': span_id,
+        'parentSpanId': parent_id or '',
+        'name': name,
+        'startTimeUnixNano': start_ns,
+        'endTimeUnixNano': end_ns,
+        'attributes': attributes,
+    }
+    for hook in list(_hooks):
+        try:
+            hook(span)
+        except Exception as e:
+            print(f"Tracing hook error: {e}")
+
+@contextmanager
+def trial_trace(trial_indices, submitted_at=None):
+    """
+    Open the root span of a trial (or of a multi-sample group of trials).
+    submitted_at, a time.time() timestamp, adds the queue wait before it started.
+    """
+    trace = TrialTrace(trial_indices)
+    trace_token = _current_trace.set(trace)
+    root_id = _new_id(8)
+    span_token = _current_span.set((root_id, 'trial'))
+    start_ns = time.time_ns()
+    if submitted_at is not None:
+        queue_wait = max(0.0, start_ns / 1e9 - submitted_at)
+        trace.add_phase('queue_wait', queue_wait)
+        _emit('queue_wait', _new_id(8), root_id, trace.trace_id,
+              int(submitted_at * 1e9), start_ns, {})
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        _emit('trial', root_id, None, trace.trace_id, start_ns, time.time_ns(),
+              {'trial_indices': trace.trial_indices, **trace.as_record()})
+
+def _judging():
+    # Calls made inside an evaluation span belong to the LLM judge
+    return 'evaluation' in _span_names.get()
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a phase. The duration is added to the current trial's timings under
+    `name` (prefixed with 'judge_' inside an evaluation) and the span is
+    passed to the registered hooks.
+    """
+    trace = _current_trace.get()
+    phase = f'judge_{name}' if _judging() else name
+    parent = _current_span.get()
+    span_id = _new_id(8)
+    span_token = _current_span.set((span_id, name))
+    names_token = _span_names.set(_span_names.get() + (name,))
+    start_ns = time.time_ns()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        _span_names.reset(names_token)
+        _current_span.reset(span_token)
+        if trace is not None:
+            trace.add_phase(phase, duration)
+        _emit(name, span_id, parent[0] if parent else None,
+              trace.trace_id if trace else _new_id(16),
+              start_ns, start_ns + int(duration * 1e9), attributes)
+
+def record(name, value):
+    """
+    Add to a counter of the current trial (no-op outside a trial), prefixed
+    with 'judge_' inside an evaluation.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(f'judge_{name}' if _judging() else name, value)
+
+def record_phase(name, seconds):
+    """
+    Add a duration measured without a span (e.g. time to first token).
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_phase(f'judge_{name}' if _judging() else name, seconds)
+
+def record_usage(input_tokens, output_tokens, **extra):
+    """
+    Add provider-reported token usage to the current trial. Usage of calls
+    made while evaluating (LLM judges) is counted separately from the target's.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    prefix = 'judge' if _judging() else 'target'
+    trace.add(f'{prefix}_input_tokens', input_tokens or 0)
+    trace.add(f'{prefix}_output_tokens', output_tokens or 0)
+    for name, value in extra.items():
+        trace.add(f'{prefix}_{name}', value or 0)
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_otlp_value(item) for item in value]}}
+    return {'stringValue': str(value)}
+
+class FileSpanExporter:
+    """
+    Hook writing spans to a local file as OTLP/JSON lines (one
+    ExportTraceServiceRequest per span), the format read by the
+    OpenTelemetry Collector's file receiver.
+    """
+    def __init__(self, path, service_name='ai-iq'):
+        self.path = path
+        self.service_name = service_name
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, span):
+        otlp_span = {
+            'traceId': span['traceId'],
+            'spanId': span['spanId'],
+            'parentSpanId': span['parentSpanId'],
+            'name': span['name'],
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(span['startTimeUnixNano']),
+            'endTimeUnixNano': str(span['endTimeUnixNano']),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in span['attributes'].items()],
+        }
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}]},
+            'scopeSpans': [{'scope': {'name': 'ai_iq.tracing'}, 'spans': [otlp_span]}],
+        }]}
+        line = json.dumps(request) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
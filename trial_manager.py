@@ -1,59 +1,639 @@
 # trial_manager.py
 
+import asyncio
+import json
+import multiprocessing
+import os
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from metrics_logger import MetricsLogger
-import streamlit as st
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from queue import Empty, Queue
+from evaluator import score_chunk
+from metrics_logger import MetricsLogger, wilson_interval
+import tracing
+
+# Seconds the evaluation stage waits for a batched judge call to fill up
+JUDGE_BATCH_LINGER = 1.0
 
 class TrialManager:
     """
     Manages running multiple trials concurrently.
+
+    Trials run either on a thread pool (one blocking request per thread, the
+    default) or, with async_mode=True, on a single asyncio event loop where up
+    to max_concurrency requests are in flight under one shared semaphore.
+    With samples_per_request > 1, models that support it return several
+    trials' samples from one request. With evaluation_workers > 0,
+    algorithmic scoring runs as a separate stage on a process pool, fed
+    through a bounded queue, so it overlaps with generation and is not
+    serialized with the network threads by the GIL. LLM judging with an
+    evaluator whose judge_batch_size > 1 uses the same pipeline, so
+    responses from different trials are judged together. With stop_ci_width set,
+    the run stops early, cancelling pending trials, once the confidence
+    interval on the success rate is narrower than that width. With
+    streaming=True, responses are streamed, recording time to first token,
+    and a generation is cancelled as soon as the evaluator can already
+    decide its outcome.
+
+    The engine has no UI dependency: progress_callback, when given, is called
+    with the fraction of the run completed (0.0 to 1.0) as trials finish.
+
+    Every results row carries the run_id and its trial_index, and the
+    results file is written as trials complete, so an interrupted run can
+    be continued with resume(run_id), which only runs the missing trials.
+    Batch runs also checkpoint their provider batch IDs next to the results
+    file, so a resumed batch run collects the batches already submitted.
+
+    Every trial is traced (see tracing.py): its results row carries the time
+    spent per phase (queue wait, rate limiting, network, backoff,
+    evaluation) and the provider-reported token usage; with samples_per_request
+    > 1 these are per request and shared by the request's trials.
     """
-    def __init__(self, model_manager, evaluator, num_trials=50, max_workers=5, prompt='', **kwargs):
+    def __init__(self, model_manager, evaluator, num_trials=50, max_workers=5, prompt='',
+                 async_mode=False, max_concurrency=None, samples_per_request=1, results_path=None,
+                 evaluation_workers=0, stop_ci_width=None, confidence=0.95, min_trials=10, streaming=False,
+                 progress_callback=None, run_id=None, **kwargs):
         self.model_manager = model_manager
         self.evaluator = evaluator
         self.num_trials = num_trials
         self.max_workers = max_workers
         self.prompt = prompt
+        self.async_mode = async_mode
+        self.max_concurrency = max_concurrency or max_workers  # In-flight request budget for async mode
+        self.samples_per_request = samples_per_request
+        self.evaluation_workers = evaluation_workers
+        # Sequential early stopping on the Wilson interval of the success rate
+        self.stop_ci_width = stop_ci_width
+        self.confidence = confidence
+        self.min_trials = min_trials
+        self.stopped_early = False
+        self.stop_requested = False
+        self._stop_event = threading.Event()
+        self.streaming = streaming
+        self.progress_callback = progress_callback
+        self.run_id = run_id or uuid.uuid4().hex
+        self.completed_indices = set()  # Trials already checkpointed by an earlier attempt
         self.kwargs = kwargs  # Additional arguments for generate_response
-        self.metrics_logger = MetricsLogger()
+        # Streams each trial to results_path as it completes, when given
+        self.metrics_logger = MetricsLogger(path=results_path)
         self.log_messages = []
 
-    def run_trial(self):
+    def run_trial(self, trial_index=None, submitted_at=None):
+        """
+        Run a single trial. submitted_at, the time.time() at which the trial
+        was queued, lets the trace report its queue wait.
         """
-        Run a single trial.
+        with tracing.trial_trace([trial_index], submitted_at) as trace:
+            start_time = time.time()
+            with tracing.span('generation'):
+                response = self._generate_one(trial_index)
+            end_time = time.time()
+            is_correct = self.evaluator.evaluate(response)
+            return self._record_trial(trial_index, response, is_correct, end_time - start_time, trace)
+
+    async def arun_trial(self, semaphore, trial_index=None, submitted_at=None):
+        """
+        Run a single trial on the event loop, holding a slot of the shared semaphore.
+        """
+        async with semaphore:
+            with tracing.trial_trace([trial_index], submitted_at) as trace:
+                start_time = time.time()
+                with tracing.span('generation'):
+                    response = await self._agenerate_one(trial_index)
+                end_time = time.time()
+                is_correct = await self.evaluator.aevaluate(response)
+                # No await between evaluation and recording, so the evaluator's
+                # log messages cannot interleave with another trial's
+                return self._record_trial(trial_index, response, is_correct, end_time - start_time, trace)
+
+    def run_trial_group(self, trial_indices, submitted_at=None):
+        """
+        Run several trials from a single multi-sample request.
+        """
+        if len(trial_indices) == 1:
+            return [self.run_trial(trial_indices[0], submitted_at)]
+        with tracing.trial_trace(trial_indices, submitted_at) as trace:
+            responses, response_time = self._generate(trial_indices)
+            results = []
+            for trial_index, response in zip(trial_indices, responses):
+                is_correct = self.evaluator.evaluate(response)
+                results.append(self._record_trial(trial_index, response, is_correct, response_time, trace))
+            return results
+
+    async def arun_trial_group(self, semaphore, trial_indices, submitted_at=None):
+        """
+        Async counterpart of run_trial_group.
+        """
+        if len(trial_indices) == 1:
+            return [await self.arun_trial(semaphore, trial_indices[0], submitted_at)]
+        async with semaphore:
+            with tracing.trial_trace(trial_indices, submitted_at) as trace:
+                responses, response_time = await self._agenerate(trial_indices)
+                results = []
+                for trial_index, response in zip(trial_indices, responses):
+                    is_correct = await self.evaluator.aevaluate(response)
+                    results.append(self._record_trial(trial_index, response, is_correct, response_time, trace))
+                return results
+
+    def _generate(self, trial_indices):
+        """
+        Generate the responses for a group of trials with one request.
+        Returns (responses, response_time).
+        """
+        start_time = time.time()
+        with tracing.span('generation', samples=len(trial_indices)):
+            if len(trial_indices) == 1:
+                responses = [self._generate_one(trial_indices[0])]
+            else:
+                responses = self.model_manager.generate_responses(
+                    self.prompt, len(trial_indices), sample_indices=trial_indices, **self.kwargs)
+        # Every sample of the request arrived after the same latency
+        return responses, time.time() - start_time
+
+    async def _agenerate(self, trial_indices):
+        """
+        Async counterpart of _generate.
         """
         start_time = time.time()
-        response = self.model_manager.generate_response(self.prompt, **self.kwargs)
-        end_time = time.time()
-        is_correct = self.evaluator.evaluate(response)
-        response_time = end_time - start_time
+        with tracing.span('generation', samples=len(trial_indices)):
+            if len(trial_indices) == 1:
+                responses = [await self._agenerate_one(trial_indices[0])]
+            else:
+                responses = await self.model_manager.agenerate_responses(
+                    self.prompt, len(trial_indices), sample_indices=trial_indices, **self.kwargs)
+        return responses, time.time() - start_time
+
+    def _generate_one(self, trial_index):
+        if self.streaming:
+            return self.model_manager.generate_streaming_response(
+                self.prompt, sample_index=trial_index, should_stop=self._outcome_decided, **self.kwargs)
+        return self.model_manager.generate_response(self.prompt, sample_index=trial_index, **self.kwargs)
+
+    async def _agenerate_one(self, trial_index):
+        if self.streaming:
+            return await self.model_manager.agenerate_streaming_response(
+                self.prompt, sample_index=trial_index, should_stop=self._outcome_decided, **self.kwargs)
+        return await self.model_manager.agenerate_response(self.prompt, sample_index=trial_index, **self.kwargs)
+
+    def _outcome_decided(self, partial_response):
+        # Stop streaming once the rest of the response cannot change the verdict
+        return self.evaluator.decide_partial(partial_response) is not None
+
+    def trial_groups(self):
+        """
+        Split the trial indices into groups that are each served by one request.
+        """
+        size = 1
+        # Streamed requests carry a single sample
+        if self.samples_per_request > 1 and not self.streaming and self.model_manager.supports_multi_sample():
+            size = self.samples_per_request
+        indices = self._pending_indices()
+        return [indices[i:i + size] for i in range(0, len(indices), size)]
+
+    def token_usage(self):
+        """
+        Provider-reported tokens of the target model (target_*) and of the LLM
+        judge (judge_*), including prompt cache reads and writes. A manager
+        shared with other runs reports their combined usage.
+        """
+        usage = {f'target_{name}': value for name, value in self.model_manager.usage.items()}
+        judge = self.evaluator.evaluator_model_manager
+        if judge is not None:
+            usage.update({f'judge_{name}': value for name, value in judge.usage.items()})
+        return usage
+
+    def _pending_indices(self):
+        return [i for i in range(self.num_trials) if i not in self.completed_indices]
+
+    def _record_trial(self, trial_index, response, is_correct, response_time, trace=None):
         log_message = '\n'.join(self.evaluator.log_messages)
         self.evaluator.log_messages.clear()  # Clear after use
-        self.metrics_logger.log_trial({
+        timings = trace.as_record() if trace is not None else None
+        return self._log_trial(trial_index, response, is_correct, response_time, log_message, timings)
+
+    def _log_trial(self, trial_index, response, is_correct, response_time, log_message, timings=None):
+        trial_data = {
+            'run_id': self.run_id,
+            'trial_index': trial_index,
             'correct': is_correct,
             'response_time': response_time,
             'response': response,
             'expected_output': self.evaluator.expected_output,
             'evaluation_log': log_message  # Include evaluation log
-        })
+        }
+        if timings:
+            trial_data.update(timings)  # Per-phase timings and token usage
+        self.metrics_logger.log_trial(trial_data)
         return is_correct, response_time
 
     def run_trials(self):
         """
         Run multiple trials concurrently.
         """
+        if self.async_mode:
+            return asyncio.run(self.arun_trials())
+
+        try:
+            if self._batch_judging():
+                self._run_pipelined_trials(chunk_size=self.evaluator.judge_batch_size, linger=JUDGE_BATCH_LINGER)
+            elif self._use_evaluation_pool():
+                self._run_pipelined_trials()
+            else:
+                self._run_threaded_trials()
+        finally:
+            self.metrics_logger.close()
+
+    def resume(self, run_id=None, batch=False):
+        """
+        Continue an interrupted run from its results file: trials of run_id
+        (by default this manager's run_id) already checkpointed there are kept
+        and counted, and only the missing trial indices are run. With
+        batch=True the missing trials go through run_batch_trials.
+        """
+        if run_id:
+            self.run_id = run_id
+        if self.metrics_logger.path:
+            # Other runs' trials in the same file count toward neither the summary nor progress
+            self.metrics_logger = MetricsLogger.load(self.metrics_logger.path, run_id=self.run_id)
+            self.completed_indices = {
+                trial['trial_index'] for trial in self.metrics_logger.iter_trials()
+                if trial.get('trial_index') is not None
+            }
+        if batch:
+            return self.run_batch_trials()
+        return self.run_trials()
+
+    def stop(self):
+        """
+        Ask a running run_trials to stop: pending trials are dropped and the
+        ones already in flight complete. A batch run cancels its provider
+        batches and records what they had already processed. Thread-safe.
+        """
+        self.stop_requested = True
+        self._stop_event.set()
+
+    def _should_stop(self):
+        """
+        Whether stop() was called or the success rate is already known to
+        within stop_ci_width.
+        """
+        if self.stop_requested:
+            return True
+        if not self.stop_ci_width:
+            return False
+        total = self.metrics_logger.total_count
+        if total < self.min_trials:
+            return False
+        low, high = wilson_interval(self.metrics_logger.correct_count, total, self.confidence)
+        if high - low < self.stop_ci_width:
+            self.stopped_early = True
+            return True
+        return False
+
+    def _use_evaluation_pool(self):
+        # Unbatched LLM judging is I/O bound and stays on the generation threads / event loop
+        return self.evaluation_workers > 0 and self.evaluator.evaluation_method == 'algorithmic'
+
+    def _batch_judging(self):
+        return self.evaluator.evaluation_method == 'llm' and self.evaluator.judge_batch_size > 1
+
+    def _evaluation_concurrency(self):
+        # Judge calls in flight at once, or scoring processes
+        if self._batch_judging():
+            return self.evaluation_workers or self.max_workers
+        return self.evaluation_workers
+
+    def _evaluation_pool(self):
+        if self._batch_judging():
+            return ThreadPoolExecutor(max_workers=self._evaluation_concurrency())
+        # spawn avoids forking a process that is running network threads
+        return ProcessPoolExecutor(max_workers=self.evaluation_workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+
+    def _report_progress(self, fraction):
+        if self.progress_callback:
+            self.progress_callback(fraction)
+
+    def _run_threaded_trials(self):
         total_trials = self.num_trials
-        completed_trials = 0
-        progress_bar = st.progress(0)  # Initialize progress bar
+        completed_trials = len(self.completed_indices)
+        self._report_progress(completed_trials / total_trials)
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self.run_trial) for _ in range(self.num_trials)]
+            futures = [executor.submit(self.run_trial_group, group, time.time()) for group in self.trial_groups()]
             for future in as_completed(futures):
                 try:
-                    future.result()
-                    completed_trials += 1
-                    # Update progress bar
-                    progress = completed_trials / total_trials
-                    progress_bar.progress(progress)
+                    completed_trials += len(future.result())
+                    self._report_progress(completed_trials / total_trials)
                 except Exception as e:
                     print(f"Error during trial: {e}")
+                if self._should_stop():
+                    # Drop queued trials; the ones already running still complete
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+
+    def _run_pipelined_trials(self, chunk_size=64, linger=0.0):
+        """
+        Generation threads push (trial_index, response, response_time, timings) items into
+        a bounded queue; an evaluation thread drains it in chunks onto the
+        evaluation pool, waiting up to linger seconds for a chunk to fill.
+        """
+        total_trials = self.num_trials
+        completed_trials = len(self.completed_indices)
+        self._report_progress(completed_trials / total_trials)  # Tracks generation; scoring trails it closely
+        queue = Queue(maxsize=max(chunk_size, self.max_workers * 4))
+
+        def generate(trial_indices, submitted_at):
+            with tracing.trial_trace(trial_indices, submitted_at) as trace:
+                responses, response_time = self._generate(trial_indices)
+            # Evaluation time is not traced: scoring happens in another process
+            timings = trace.as_record()
+            for trial_index, response in zip(trial_indices, responses):
+                queue.put((trial_index, response, response_time, timings))
+            return len(responses)
+
+        with self._evaluation_pool() as evaluation_pool:
+            evaluation_thread = threading.Thread(
+                target=self._evaluation_stage, args=(queue, evaluation_pool, chunk_size, linger), daemon=True)
+            evaluation_thread.start()
+            try:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = [executor.submit(generate, group, time.time()) for group in self.trial_groups()]
+                    for future in as_completed(futures):
+                        try:
+                            completed_trials += future.result()
+                            self._report_progress(completed_trials / total_trials)
+                        except Exception as e:
+                            print(f"Error during trial: {e}")
+                        if self._should_stop():
+                            executor.shutdown(wait=False, cancel_futures=True)
+                            break
+            finally:
+                queue.put(None)  # No more responses
+                evaluation_thread.join()
+
+    def _evaluation_stage(self, queue, evaluation_pool, chunk_size, linger=0.0):
+        """
+        Score queued responses in chunks on the evaluation pool and log them.
+        """
+        in_flight = deque()
+        max_in_flight = 2 * self._evaluation_concurrency()
+        finished = False
+        while not finished:
+            chunk = [queue.get()]
+            deadline = time.monotonic() + linger
+            while len(chunk) < chunk_size and chunk[-1] is not None:
+                try:
+                    chunk.append(queue.get(timeout=max(0.0, deadline - time.monotonic())) if linger
+                                 else queue.get_nowait())
+                except Empty:
+                    break
+            if chunk[-1] is None:  # The end marker is always the last item queued
+                finished = True
+                chunk.pop()
+            if chunk:
+                responses = [response for _, response, _, _ in chunk]
+                known, missing = self._memoized_scores(responses)
+                future = evaluation_pool.submit(score_chunk, self.evaluator, missing)
+                in_flight.append((chunk, known, missing, future))
+            while in_flight and (finished or len(in_flight) > max_in_flight or in_flight[0][-1].done()):
+                chunk, known, missing, future = in_flight.popleft()
+                try:
+                    scores = self._merge_scores([response for _, response, _, _ in chunk], known, missing, future.result())
+                except Exception as e:
+                    print(f"Error during evaluation: {e}")
+                    continue
+                for (trial_index, response, response_time, timings), (is_correct, log_message) in zip(chunk, scores):
+                    self._log_trial(trial_index, response, is_correct, response_time, log_message, timings)
+
+    def _memoized_scores(self, responses):
+        """
+        Split responses bound for the evaluation pool into memoized verdicts
+        and the distinct responses the pool still has to score.
+        """
+        if self._batch_judging():
+            # Judge threads share this evaluator and consult its memo themselves
+            return {}, [response.strip() for response in responses]
+        # Worker processes start with empty memos, so reuse verdicts here
+        return self.evaluator.lookup_memo([response.strip() for response in responses])
+
+    def _merge_scores(self, responses, known, missing, scores):
+        """
+        (is_correct, log) pairs for responses, in order, from the memoized
+        verdicts and the pool's scores of the missing ones.
+        """
+        verdicts = dict(zip(missing, scores))
+        if not self._batch_judging():
+            self.evaluator.remember(verdicts)
+        verdicts.update(known)
+        return [verdicts[response.strip()] for response in responses]
+
+    async def _arun_pipelined_group(self, semaphore, trial_indices, evaluation_pool, submitted_at=None):
+        """
+        Generate a group of trials on the event loop and score it on the process pool.
+        """
+        async with semaphore:
+            with tracing.trial_trace(trial_indices, submitted_at) as trace:
+                responses, response_time = await self._agenerate(trial_indices)
+        timings = trace.as_record()
+        loop = asyncio.get_running_loop()
+        known, missing = self._memoized_scores(responses)
+        if missing:
+            scores = await loop.run_in_executor(evaluation_pool, score_chunk, self.evaluator, missing)
+        else:
+            scores = []
+        scores = self._merge_scores(responses, known, missing, scores)
+        return [self._log_trial(trial_index, response, is_correct, response_time, log_message, timings)
+                for trial_index, response, (is_correct, log_message) in zip(trial_indices, responses, scores)]
+
+    async def _aenqueue_group(self, semaphore, trial_indices, queue, submitted_at=None):
+        """
+        Generate a group of trials on the event loop and queue it for batched judging.
+        """
+        async with semaphore:
+            with tracing.trial_trace(trial_indices, submitted_at) as trace:
+                responses, response_time = await self._agenerate(trial_indices)
+        timings = trace.as_record()
+        for trial_index, response in zip(trial_indices, responses):
+            await queue.put((trial_index, response, response_time, timings))
+        return responses
+
+    async def _aevaluation_stage(self, queue, chunk_size, linger):
+        """
+        Async counterpart of _evaluation_stage for batched LLM judging.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self._evaluation_concurrency())
+
+        async def judge(chunk):
+            try:
+                async with semaphore:
+                    scores = await self.evaluator.aevaluate_many([response for _, response, _, _ in chunk])
+            except Exception as e:
+                print(f"Error during evaluation: {e}")
+                return
+            for (trial_index, response, response_time, timings), (is_correct, log_message) in zip(chunk, scores):
+                self._log_trial(trial_index, response, is_correct, response_time, log_message, timings)
+
+        judging = []
+        finished = False
+        while not finished:
+            chunk = [await queue.get()]
+            deadline = loop.time() + linger
+            while len(chunk) < chunk_size and chunk[-1] is not None:
+                try:
+                    chunk.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        chunk.append(await asyncio.wait_for(queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            if chunk[-1] is None:
+                finished = True
+                chunk.pop()
+            if chunk:
+                judging.append(asyncio.ensure_future(judge(chunk)))
+        await asyncio.gather(*judging)
+
+    async def arun_trials(self):
+        """
+        Run multiple trials on one event loop with at most max_concurrency in flight.
+        """
+        total_trials = self.num_trials
+        completed_trials = len(self.completed_indices)
+        self._report_progress(completed_trials / total_trials)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        evaluation_pool = self._evaluation_pool() if self._use_evaluation_pool() else None
+        judge_queue = judge_stage = None
+        submitted_at = time.time()  # Time spent waiting on the semaphore is queue wait
+        if self._batch_judging():
+            judge_queue = asyncio.Queue(maxsize=max(self.evaluator.judge_batch_size, self.max_concurrency * 4))
+            judge_stage = asyncio.ensure_future(
+                self._aevaluation_stage(judge_queue, self.evaluator.judge_batch_size, JUDGE_BATCH_LINGER))
+            tasks = [asyncio.ensure_future(self._aenqueue_group(semaphore, group, judge_queue, submitted_at))
+                     for group in self.trial_groups()]
+        elif evaluation_pool:
+            tasks = [asyncio.ensure_future(self._arun_pipelined_group(semaphore, group, evaluation_pool, submitted_at))
+                     for group in self.trial_groups()]
+        else:
+            tasks = [asyncio.ensure_future(self.arun_trial_group(semaphore, group, submitted_at))
+                     for group in self.trial_groups()]
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    completed_trials += len(await task)
+                    self._report_progress(completed_trials / total_trials)
+                except Exception as e:
+                    print(f"Error during trial: {e}")
+                if self._should_stop():
+                    break
+        finally:
+            # Cancel whatever is still pending after an early stop
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if judge_stage:
+                await judge_queue.put(None)  # No more responses
+                await judge_stage
+            if evaluation_pool:
+                evaluation_pool.shutdown()
+            self.metrics_logger.close()
+
+    def _batch_checkpoint_path(self):
+        return f'{self.metrics_logger.path}.batches.json' if self.metrics_logger.path else None
+
+    def _checkpointed_batches(self):
+        path = self._batch_checkpoint_path()
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _checkpoint_batches(self, batch_ids):
+        """
+        Record (or, given None, forget) this run's submitted batch IDs.
+        """
+        path = self._batch_checkpoint_path()
+        if not path:
+            return
+        batches = self._checkpointed_batches()  # Keyed by run_id, as runs can share a results file
+        if batch_ids:
+            batches[self.run_id] = batch_ids
+        else:
+            batches.pop(self.run_id, None)
+        if not batches:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump(batches, f)
+        os.replace(f'{path}.tmp', path)
+
+    def run_batch_trials(self, poll_interval=30):
+        """
+        Run all trials through the provider's batch API, then score the results
+        as they stream back. Trades turnaround time for batch pricing and limits.
+        Batches this run submitted before being interrupted are collected
+        instead of submitting their trials again; stop() cancels them.
+        """
+        self._report_progress(len(self.completed_indices) / self.num_trials)  # Tracks requests processed by the provider
+        batch_ids = self._checkpointed_batches().get(self.run_id)
+        if not batch_ids:
+            requests = [(f'trial-{i}', self.prompt, self.kwargs) for i in self._pending_indices()]
+            if not requests:
+                self.metrics_logger.close()
+                return
+            batch_ids = self.model_manager.submit_batches(requests)
+            self._checkpoint_batches(batch_ids)
+
+        pending = set(batch_ids)
+        processed = dict.fromkeys(batch_ids, 0)
+        cancelled = False
+        while pending:
+            if self.stop_requested and not cancelled:
+                # Polling continues until the provider has wound the batches down
+                for batch_id in pending:
+                    self.model_manager.cancel_batch(batch_id)
+                cancelled = True
+            for batch_id in list(pending):
+                finished, processed[batch_id], _ = self.model_manager.get_batch_progress(batch_id)
+                if finished:
+                    pending.discard(batch_id)
+            processed_trials = len(self.completed_indices) + sum(processed.values())
+            self._report_progress(min(1.0, processed_trials / self.num_trials))
+            if pending and cancelled:
+                time.sleep(poll_interval)
+            elif pending:
+                self._stop_event.wait(poll_interval)  # stop() cuts the wait short
+
+        failures = []
+        try:
+            for batch_id in batch_ids:
+                succeeded = 0
+                try:
+                    for custom_id, response in self.model_manager.iter_batch_results(batch_id):
+                        if response is None:
+                            print(f"Error during trial: batch request {custom_id} failed")
+                            continue
+                        succeeded += 1
+                        trial_index = int(custom_id.rsplit('-', 1)[1])
+                        if trial_index in self.completed_indices:
+                            continue  # Recorded before the run was interrupted
+                        is_correct = self.evaluator.evaluate(response)
+                        # Per-request latency is not observable through the batch API
+                        self._record_trial(trial_index, response, is_correct, None)
+                except RuntimeError as e:
+                    failures.append(str(e))
+                    continue
+                if not succeeded:
+                    failures.append(f"Batch {batch_id} returned no successful responses")
+        finally:
+            self.metrics_logger.close()
+        # Every result is recorded, so a later resume submits only the failed trials afresh
+        self._checkpoint_batches(None)
+        if failures and not self.stop_requested:
+            raise RuntimeError('; '.join(failures))